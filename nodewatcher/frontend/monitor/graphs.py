@@ -7,6 +7,7 @@ import traceback
 from django.conf import settings
 
 from frontend.nodes.models import GraphItem, GraphType
+from frontend.nodes.bulk import ChangeTracker, chunked, bulk_update, MAX_QUERY_PARAMS
 from frontend.monitor.rrd import *
 
 # Mapping of graph types to their respective rrd configurations
@@ -30,19 +31,61 @@ RRA_CONF_MAP = {
   GraphType.Voltage         : RRAVoltage,
 }
 
+# Display priorities of graph types
+DISPLAY_PRIORITY = dict([(type, priority) for priority, type in enumerate(GraphType.ordering)])
+
+# Graph items of nodes processed by this process, keyed by node primary key;
+# each entry is a (generation, items, tracker) tuple
+GRAPH_ITEM_CACHE = {}
+
+def mark_updated(graph_ids):
+  """
+  Marks graph items as updated and signals that they need to be redrawn.
+  This should be called once per cycle with all updated graph items.
+  
+  @param graph_ids: A list of graph item primary keys
+  @return: A set of primary keys of graph items that no longer exist
+  """
+  now = datetime.now()
+  missing = set()
+  for chunk in chunked(graph_ids, MAX_QUERY_PARAMS):
+    if GraphItem.objects.filter(pk__in = chunk).update(last_update = now, dead = False, need_redraw = True) < len(set(chunk)):
+      # Some items have been removed while they were cached
+      missing.update(chunk)
+      missing.difference_update(GraphItem.objects.filter(pk__in = chunk).values_list('pk', flat = True))
+  
+  GraphItem.notify_updated_many(graph_ids)
+  return missing
+
 class Grapher(object):
   """
   A helper class used to dispatch graph requests to rrdtool and
-  the archiver (when enabled).
+  the archiver (when enabled). Updates are buffered until flush()
+  is called.
+  
+  Graph items of a node are cached by the process between cycles, so
+  steady state updates need no queries. The cache of a node is reloaded
+  when its generation changes (the monitor increments it when graph items
+  of the node are removed) and when a graph item is not found, as it may
+  have been created by another process.
   """
-  def __init__(self, node):
+  def __init__(self, node, generation = 0):
     """
     Class constructor.
     
     @param node: A valid Node instance
+    @param generation: Generation of the node's graph items
     """
     self.node = node
+    self.generation = generation
     self.rebooted = False
+    self.writer = RRDWriter()
+    self.tracker = None
+    self.items = None
+    self.loaded = False
+    self.updated = []
+    self.rrd_updates = 0
+    self.rrd_seconds = 0.0
   
   def enable_reboot_mode(self, uptime, last_seen):
     """
@@ -58,6 +101,43 @@ class Grapher(object):
     # cause RRD update problems
     self.uptime = min((datetime.now() - last_seen).seconds - 10, uptime)
   
+  def load_graph_items(self):
+    """
+    Loads all graph items of this node with a single query and caches
+    them.
+    """
+    self.items = {}
+    self.tracker = ChangeTracker()
+    for graph in GraphItem.objects.filter(node = self.node):
+      self.items[(graph.name, graph.type, graph.parent_id)] = graph
+      self.tracker.track(graph)
+    
+    self.loaded = True
+    GRAPH_ITEM_CACHE[self.node.pk] = (self.generation, self.items, self.tracker)
+  
+  def get_graph_item(self, name, type, parent):
+    """
+    Returns an existing graph item of this node. Cached graph items are
+    used when they are of the current generation.
+    
+    @param name: Graph name
+    @param type: Graph type
+    @param parent: Parent graph item or None for toplevel graphs
+    @return: A GraphItem instance or None when it does not exist
+    """
+    if self.items is None:
+      generation, items, tracker = GRAPH_ITEM_CACHE.get(self.node.pk, (None, None, None))
+      if generation != self.generation:
+        self.load_graph_items()
+      else:
+        self.items, self.tracker = items, tracker
+    
+    key = (name, type, getattr(parent, 'pk', None))
+    if key not in self.items and not self.loaded:
+      self.load_graph_items()
+    
+    return self.items.get(key)
+  
   def add_graph(self, type, title, filename, *values, **attrs):
     """
     A helper function for generating graphs.
@@ -76,17 +156,25 @@ class Grapher(object):
     # Resolve graph configuration
     conf = RRA_CONF_MAP[type]
     
-    # Resolve graph ordering
-    display_priority = GraphType.ordering.index(type)
-
-    try:
-      graph = GraphItem.objects.get(node = self.node, name = name, type = type, parent = parent)
-      if graph.graph != graph_image_name:
-        graph.graph = graph_image_name
-    except GraphItem.DoesNotExist:
-      graph = GraphItem(node = self.node, name = name, type = type, parent = parent)
+    graph = self.get_graph_item(name, type, parent)
+    if graph is not None:
+      # Only changed metadata is written on flush
+      graph.graph = graph_image_name
+      graph.title = title
+      graph.display_priority = DISPLAY_PRIORITY[type]
+    else:
+      # New graph items are saved immediately as their primary keys are needed
+      graph = GraphItem(node_id = self.node.pk, name = name, type = type, parent = parent)
       graph.rra = graph_rra_name
       graph.graph = graph_image_name
+      graph.title = title
+      graph.display_priority = DISPLAY_PRIORITY[type]
+      graph.last_update = datetime.now()
+      graph.save()
+      self.items[(name, type, graph.parent_id)] = graph
+      self.tracker.track(graph)
+    
+    self.updated.append(graph.pk)
     
     rra = str(os.path.join(settings.MONITOR_WORKDIR, 'rra', graph.rra))
     try:
@@ -94,11 +182,11 @@ class Grapher(object):
       # spikes are avoided
       if self.rebooted and any([x.is_counter() for x in conf.sources]):
         ts = int(time.time() - self.uptime)
-        RRA.update(self.node, conf, rra, *[None for x in values], graph = graph.pk, timestamp = ts - 1)
-        RRA.update(self.node, conf, rra, *[0 for x in values], graph = graph.pk, timestamp = ts)
+        self.writer.update(self.node, conf, rra, *[None for x in values], graph = graph.pk, timestamp = ts - 1)
+        self.writer.update(self.node, conf, rra, *[0 for x in values], graph = graph.pk, timestamp = ts)
       
       # Update the entry
-      RRA.update(
+      self.writer.update(
         self.node,
         conf,
         rra,
@@ -108,12 +196,57 @@ class Grapher(object):
     except:
       logging.warning(traceback.format_exc())
     
-    graph.title = title
-    graph.last_update = datetime.now()
-    graph.dead = False
-    graph.need_redraw = True
-    graph.display_priority = display_priority
-    graph.save()
-    graph.notify_updated()
     return graph
-
+  
+  def add_link_graphs(self, links):
+    """
+    A helper function for generating average link quality and ETX graphs
+    together with graphs of individual links.
+    
+    @param links: Precomputed link metrics of the node (a dictionary with
+      averages under 'lq', 'ilq' and 'etx' keys and a list of (dst pk,
+      dst IP, dst label, lq, ilq, etx) tuples under the 'links' key)
+    """
+    lq_graph = self.add_graph(GraphType.LQ, 'Average Link Quality', 'lq', links['ilq'], links['lq'])
+    etx_graph = self.add_graph(GraphType.ETX, 'Average ETX', 'etx', links['etx'])
+    
+    for dst_pk, dst_ip, dst_label, lq, ilq, etx in links['links']:
+      # Link quality
+      self.add_graph(
+        GraphType.LQ,
+        'Link Quality to {0}'.format(dst_label),
+        'lq_peer_{0}'.format(dst_pk),
+        ilq,
+        lq,
+        name = dst_ip,
+        parent = lq_graph
+      )
+      
+      # ETX
+      self.add_graph(
+        GraphType.ETX,
+        'ETX to {0}'.format(dst_label),
+        'etx_peer_{0}'.format(dst_pk),
+        etx,
+        name = dst_ip,
+        parent = etx_graph
+      )
+  
+  def flush(self):
+    """
+    Writes all buffered RRD updates (a single rrdtool call per archive)
+    and changed graph item metadata.
+    
+    The number of written archives and the time spent writing them are
+    accumulated in rrd_updates and rrd_seconds.
+    
+    @return: A list of primary keys of updated graph items that should be
+      passed to mark_updated
+    """
+    start = time.time()
+    self.rrd_updates += self.writer.flush()
+    self.rrd_seconds += time.time() - start
+    if self.tracker is not None:
+      bulk_update(self.tracker.changes())
+    updated, self.updated = self.updated, []
+    return updated
@@ -0,0 +1,19 @@
+from django.db import models
+
+class MonitorInstance(models.Model):
+  """
+  This model represents a running monitor instance in sharded mode. Each
+  instance periodically updates its entry, so other instances know which
+  instances are alive and how nodes are distributed between them.
+  """
+  name = models.CharField(max_length = 50, unique = True)
+  host = models.CharField(max_length = 100)
+  pid = models.IntegerField()
+  started_at = models.DateTimeField()
+  last_seen = models.DateTimeField(db_index = True)
+  
+  def __unicode__(self):
+    """
+    Returns a string representation of this instance.
+    """
+    return self.name
@@ -4,6 +4,9 @@ import time
 import os
 import subprocess
 import re
+import logging
+import traceback
+import itertools
 
 # Define export classes
 __all__ = [
@@ -27,6 +30,7 @@ __all__ = [
   'RRAGlobalClients',
   'RRATemperature',
   'RRAVoltage',
+  'RRDWriter',
 ]
 
 # Models
@@ -738,6 +742,222 @@ class RRAVoltage(RRAConfiguration):
     '--lower-limit', '0'
   ]
 
+def get_daemon_options():
+  """
+  Returns rrdtool options for routing requests through the caching daemon
+  when one is configured.
+  """
+  address = getattr(settings, 'MONITOR_RRDCACHED_ADDRESS', None)
+  if not address:
+    return []
+  
+  return ['--daemon', str(address)]
+
+class RRDTransform(object):
+  """
+  A streaming transformation of an RRD archive. The archive is dumped into
+  XML, transformed element by element and written directly into rrdtool
+  restore, so memory usage does not depend on the size of the archive.
+  """
+  def __init__(self, source_map, archives = (), renames = None):
+    """
+    Class constructor.
+    
+    @param source_map: Data source layout of the output archive, each item is
+      either an index of an existing data source or a DataSource instance
+      for a new data source
+    @param archives: A list of RoundRobinArchive instances to append
+    @param renames: A dictionary mapping existing data source names to new ones
+    """
+    self.source_map = source_map
+    self.archives = archives
+    self.renames = renames or {}
+  
+  def apply(self, archive):
+    """
+    Transforms the given archive. The original archive is only replaced
+    when the transformation has succeeded.
+    
+    @param archive: Path to the RRD archive
+    """
+    new_archive = "%s__new" % archive
+    if os.path.exists(new_archive):
+      os.unlink(new_archive)
+    
+    devnull = open(os.devnull, 'w')
+    dump = subprocess.Popen(
+      ['/usr/bin/rrdtool', 'dump', archive],
+      bufsize = -1,
+      stdout = subprocess.PIPE,
+      stderr = devnull
+    )
+    restore = subprocess.Popen(
+      ['/usr/bin/rrdtool', 'restore', '-', new_archive],
+      bufsize = -1,
+      stdin = subprocess.PIPE,
+      stdout = devnull,
+      stderr = devnull
+    )
+    
+    try:
+      self.transform(dump.stdout, restore.stdin)
+      restore.stdin.close()
+      if dump.wait() != 0 or restore.wait() != 0:
+        raise Exception("Unable to transform RRD '%s'!" % archive)
+      
+      os.rename(new_archive, archive)
+    except:
+      for process in (dump, restore):
+        if process.poll() is None:
+          process.kill()
+          process.wait()
+      
+      if os.path.exists(new_archive):
+        os.unlink(new_archive)
+      raise
+    finally:
+      devnull.close()
+  
+  def transform(self, input, output):
+    """
+    Reads a dumped archive from input and writes the transformed archive
+    to output.
+    """
+    sources = []
+    sources_written = False
+    depth = 0
+    
+    for event, elem in ElementTree.iterparse(input, events = ('start', 'end')):
+      if event == 'start':
+        depth += 1
+        if depth == 1:
+          output.write("<rrd>\n")
+        elif depth == 2 and elem.tag == 'rra':
+          if not sources_written:
+            self.write_sources(output, sources)
+            sources_written = True
+          output.write("<rra>\n")
+        elif depth == 3 and elem.tag == 'database':
+          output.write("<database>\n")
+        continue
+      
+      level = depth
+      depth -= 1
+      if level == 1:
+        if not sources_written:
+          self.write_sources(output, sources)
+        for rra in self.archives:
+          self.write_archive(output, rra)
+        output.write("</rrd>\n")
+        continue
+      elif level == 2:
+        if elem.tag == 'ds':
+          # Data source definitions are small and are written all at once
+          sources.append(elem)
+          continue
+        elif elem.tag == 'rra':
+          output.write("</rra>\n")
+        else:
+          if sources and not sources_written:
+            self.write_sources(output, sources)
+            sources_written = True
+          output.write(self.to_string(elem))
+      elif level == 3 and elem.getparent().tag == 'rra':
+        if elem.tag == 'database':
+          output.write("</database>\n")
+        elif elem.tag == 'cdp_prep':
+          output.write("<cdp_prep>")
+          for item in self.map_sources(elem.findall('ds'), self.cdp_element):
+            output.write(self.to_string(item))
+          output.write("</cdp_prep>\n")
+        else:
+          output.write(self.to_string(elem))
+      elif level == 4 and elem.tag == 'row' and elem.getparent().tag == 'database':
+        values = [v.text.strip() for v in elem.findall('v')]
+        output.write("<row>%s</row>\n" % "".join(["<v>%s</v>" % value for value in self.map_sources(values, lambda source: "NaN")]))
+      else:
+        continue
+      
+      # Release already processed elements
+      elem.clear()
+      while elem.getprevious() is not None:
+        del elem.getparent()[0]
+  
+  def map_sources(self, items, factory):
+    """
+    Reorders per-source items according to the source map.
+    
+    @param items: A list of items for existing data sources
+    @param factory: Callable that creates an item for a new data source
+    """
+    return [items[x] if isinstance(x, int) else factory(x) for x in self.source_map]
+  
+  def write_sources(self, output, sources):
+    """
+    Writes data source definitions.
+    """
+    for ds in sources:
+      name = ds.find('name')
+      name.text = " %s " % self.renames.get(name.text.strip(), name.text.strip())
+      
+      # Fix all empty last_ds values otherwise rrdtool will complain on restore
+      last_ds = ds.find('last_ds')
+      if last_ds is not None and not (last_ds.text or '').strip():
+        last_ds.text = "UNKN"
+    
+    for ds in self.map_sources(sources, self.source_element):
+      output.write(self.to_string(ds))
+  
+  def write_archive(self, output, rra):
+    """
+    Writes a new empty round robin archive.
+    """
+    output.write("<rra><cf>%s</cf><pdp_per_row>%s</pdp_per_row><params><xff>%s</xff></params>\n" % (rra.cf, rra.steps, rra.xff))
+    output.write("<cdp_prep>")
+    for x in self.source_map:
+      output.write(self.to_string(self.cdp_element(x)))
+    output.write("</cdp_prep>\n<database>\n")
+    
+    row = "<row>%s</row>\n" % ("<v>NaN</v>" * len(self.source_map))
+    for i in xrange(rra.rows):
+      output.write(row)
+    output.write("</database></rra>\n")
+  
+  @staticmethod
+  def to_string(elem):
+    """
+    Serializes an element without its tail.
+    """
+    return ElementTree.tostring(elem, with_tail = False) + "\n"
+  
+  @staticmethod
+  def source_element(source):
+    """
+    Creates a data source definition element for a new data source.
+    """
+    dse = ElementTree.Element("ds")
+    ElementTree.SubElement(dse, "name").text = source.name
+    ElementTree.SubElement(dse, "type").text = source.type
+    ElementTree.SubElement(dse, "minimal_heartbeat").text = str(source.heartbeat)
+    ElementTree.SubElement(dse, "min").text = "NaN"
+    ElementTree.SubElement(dse, "max").text = "NaN"
+    ElementTree.SubElement(dse, "last_ds").text = "UNKN"
+    ElementTree.SubElement(dse, "value").text = "0.0000000000e+00"
+    ElementTree.SubElement(dse, "unknown_sec").text = "0"
+    return dse
+  
+  @staticmethod
+  def cdp_element(source):
+    """
+    Creates a consolidation state element for a new data source.
+    """
+    dse = ElementTree.Element("ds")
+    ElementTree.SubElement(dse, "primary_value").text = "NaN"
+    ElementTree.SubElement(dse, "secondary_value").text = "NaN"
+    ElementTree.SubElement(dse, "value").text = "NaN"
+    ElementTree.SubElement(dse, "unknown_datapoints").text = "0"
+    return dse
+
 class RRA:
   """
   A wrapper class for managing round-robin archives via RRDTool.
@@ -745,143 +965,50 @@ class RRA:
   @staticmethod
   def convert(conf, archive, action = "refresh", opts = "", graph = None):
     """
-    Converts 
+    Converts an RRD archive. Archives are inspected via their headers and
+    only streamed through a transformation when something needs to be
+    changed, so memory usage remains constant regardless of their size.
     """
     try:
       os.stat(archive)
     except OSError:
       return
     
-    # Dump the archive into XML form
-    process = subprocess.Popen(
-      ['/usr/bin/rrdtool', 'dump', archive],
-      stdout = subprocess.PIPE,
-      stderr = subprocess.PIPE
-    )
-    
-    # Make any transformations needed
-    xml = ElementTree.parse(process.stdout)
+    info = rrdtool.info(archive)
+    data_source_names = RRA.get_source_names(info)
     wanted_source_names = [source.name for source in conf.sources]
-    start_offset = 5 # version, step, seconds comment, lastupdate, timestamp comment
-    changed = False
     
     if action == "refresh":
-      # A simple marker to rescan sources as something has been modified
-      class RescanSources(Exception): pass
+      for ds in data_source_names:
+        if ds not in wanted_source_names:
+          print "WARNING: Removal of sources currently not supported!"
       
-      while True:
-        data_sources = xml.findall('/ds')
-        data_source_names = [source.findtext('./name').strip() for source in data_sources]
-        
-        try:
-          for ds in data_source_names:
-            if ds not in wanted_source_names:
-              print "WARNING: Removal of sources currently not supported!"
-              # If we remove something we must continue the loop
-              # raise RescanSources
-          
-          for idx, ds in enumerate(wanted_source_names):
-            if ds not in data_source_names:
-              print "INFO: Adding data source '%s' to RRD '%s.'" % (ds, os.path.basename(archive))
-              
-              # Update header
-              dse = ElementTree.Element("ds")
-              ElementTree.SubElement(dse, "name").text = conf.sources[idx].name
-              ElementTree.SubElement(dse, "type").text = conf.sources[idx].type
-              ElementTree.SubElement(dse, "minimal_heartbeat").text = str(conf.sources[idx].heartbeat) 
-              ElementTree.SubElement(dse, "min").text = "NaN"
-              ElementTree.SubElement(dse, "max").text = "NaN"
-              ElementTree.SubElement(dse, "last_ds").text = "UNKN"
-              ElementTree.SubElement(dse, "value").text = "0.0000000000e+00"
-              ElementTree.SubElement(dse, "unknown_sec").text = "0"
-              xml.getroot().insert(start_offset + idx, dse)
-              
-              # Update all RRAs
-              for rra in xml.findall('/rra'):
-                # Update RRA header
-                cdp = rra.find('./cdp_prep')
-                dse = ElementTree.Element("ds")
-                ElementTree.SubElement(dse, "primary_value").text = "NaN"
-                ElementTree.SubElement(dse, "secondary_value").text = "NaN"
-                ElementTree.SubElement(dse, "value").text = "NaN"
-                ElementTree.SubElement(dse, "unknown_datapoints").text = "0"
-                cdp.insert(idx, dse)
-                
-                # Update all RRA datapoints
-                for row in rra.findall('./database/row'):
-                  v = ElementTree.Element("v")
-                  v.text = "NaN"
-                  row.insert(idx, v)
-              
-              changed = True
-          
-          break
-        except RescanSources:
-          pass
+      # Determine the new data source layout
+      source_map = range(len(data_source_names))
+      layout = list(data_source_names)
+      for idx, ds in enumerate(wanted_source_names):
+        if ds not in layout:
+          print "INFO: Adding data source '%s' to RRD '%s.'" % (ds, os.path.basename(archive))
+          layout.insert(idx, ds)
+          source_map.insert(idx, conf.sources[idx])
       
       # Add RRAs when they have changed (only addition is supported)
+      archives = []
+      existing_archives = RRA.get_archives(info)
       for wanted_rra in conf.archives:
-        for rra in xml.findall('/rra'):
-          cf = rra.findtext('./cf').strip()
-          steps = int(rra.findtext('./pdp_per_row').strip())
-          rows = len(rra.findall('./database/row'))
-          xff = float(rra.findtext('./params/xff').strip())
-          
-          match = all([
-            cf == wanted_rra.cf,
-            steps == wanted_rra.steps,
-            rows == wanted_rra.rows,
-            xff == wanted_rra.xff
-          ])
-          
-          if match:
-            break
-        else:
+        if (wanted_rra.cf, wanted_rra.steps, wanted_rra.rows, wanted_rra.xff) not in existing_archives:
           # Not found in existing RRAs, we need to add it
           print "INFO: Adding new RRA '%s' to '%s'." % (wanted_rra, os.path.basename(archive)) 
-          changed =  True
-          
-          rra = ElementTree.SubElement(xml.getroot(), "rra")
-          ElementTree.SubElement(rra, "cf").text = wanted_rra.cf
-          ElementTree.SubElement(rra, "pdp_per_row").text = str(wanted_rra.steps)
-          params = ElementTree.SubElement(rra, "params")
-          ElementTree.SubElement(params, "xff").text = str(wanted_rra.xff)
-          cdp_prep = ElementTree.SubElement(rra, "cdp_prep")
-          
-          for ds in conf.sources:
-            dse = ElementTree.SubElement(cdp_prep, "ds")
-            ElementTree.SubElement(dse, "primary_value").text = "NaN"
-            ElementTree.SubElement(dse, "secondary_value").text = "NaN"
-            ElementTree.SubElement(dse, "value").text = "NaN"
-            ElementTree.SubElement(dse, "unknown_datapoints").text = "0"
-          
-          database = ElementTree.SubElement(rra, "database")
-          for row in xrange(wanted_rra.rows):
-            row = ElementTree.SubElement(database, "row")
-            for v in xrange(len(conf.sources)):
-              ElementTree.SubElement(row, "v").text = "NaN"
+          archives.append(wanted_rra)
+      
+      if len(layout) != len(data_source_names) or archives:
+        RRDTransform(source_map, archives = archives).apply(archive)
     elif action == "archive":
       # Archives data from RRDs
       print "INFO: Archiving RRD '%s.'" % os.path.basename(archive)
       
-      for rra in xml.findall('/rra'):
-        cf = rra.findtext('./cf').strip()
-        if cf == 'AVERAGE':
-          timestamp = None
-          
-          for item in rra.findall('./database')[0]:
-            if item.tag == "row":
-              # Data
-              values = [x.text.strip() for x in item.findall('./v')]
-              data = {}
-              for i, x in enumerate(conf.sources):
-                data[x.name] = values[i]
-              
-              if graph is not None:
-                data_archive.record_data(graph, timestamp, data)
-            else:
-              # Comment
-              timestamp = datetime.fromtimestamp(int(item.text.split("/")[1].strip()))
+      if graph is not None:
+        data_archive.record_data_bulk(graph, RRA.fetch_rows(archive, info, conf, AverageCF))
     elif action == "switch_sources":
       # Switches two data sources
       try:
@@ -894,51 +1021,84 @@ class RRA:
       if conf.__name__ != ar_name:
         return
       
-      num_switched = 0
-      for ds in xml.findall('/ds/name'):
-        if ds.text.strip() == ds1:
-          ds.text = ds2
-          num_switched += 1
-        elif ds.text.strip() == ds2:
-          ds.text = ds1
-          num_switched += 1
-
-      if num_switched != 2:
+      if ds1 not in data_source_names or ds2 not in data_source_names or ds1 == ds2:
         print "ERROR: Unable to switch names for '{0}'!".format(os.path.basename(archive))
         return
       
       print "INFO: Switching '{0}' and '{1}' in '{2}'.".format(ds1, ds2, os.path.basename(archive))
-      changed = True
+      RRDTransform(range(len(data_source_names)), renames = { ds1 : ds2, ds2 : ds1 }).apply(archive)
     else:
       print "ERROR: Invalid RRD convert action '%s'!" % action
       return
+  
+  @staticmethod
+  def get_source_names(info):
+    """
+    Returns data source names ordered by their index.
     
-    if changed:
-      try:
-        os.rename(archive, "%s__bak" % archive)
-        process = subprocess.Popen(
-          ['/usr/bin/rrdtool', 'restore', '-', archive],
-          stdin = subprocess.PIPE,
-          stdout = subprocess.PIPE,
-          stderr = subprocess.PIPE
-        )
-        
-        # Fix all empty last_ds values otherwise rrdtool will complain on restore
-        for last_ds in xml.findall('/ds/last_ds'):
-          if not last_ds.text:
-            last_ds.text = "UNKN"
-        
-        process.communicate(ElementTree.tostring(xml.getroot()))
-        if process.returncode != 0:
-          raise Exception
-        
-        try:
-          os.unlink("%s__bak" % archive)
-        except:
-          pass
-      except:
-        os.rename("%s__bak" % archive, archive)
-        raise
+    @param info: Archive header as returned by rrdtool.info
+    """
+    sources = []
+    for key, value in info.iteritems():
+      match = re.match(r'^ds\[(.+)\]\.index$', key)
+      if match:
+        sources.append((value, match.group(1)))
+    
+    return [name for index, name in sorted(sources)]
+  
+  @staticmethod
+  def get_archives(info):
+    """
+    Returns a list of (cf, steps, rows, xff) tuples describing the round
+    robin archives.
+    
+    @param info: Archive header as returned by rrdtool.info
+    """
+    archives = []
+    idx = 0
+    while 'rra[%d].cf' % idx in info:
+      archives.append((
+        info['rra[%d].cf' % idx],
+        int(info['rra[%d].pdp_per_row' % idx]),
+        int(info['rra[%d].rows' % idx]),
+        float(info['rra[%d].xff' % idx])
+      ))
+      idx += 1
+    
+    return archives
+  
+  @staticmethod
+  def fetch_rows(archive, info, conf, cf):
+    """
+    Reads rows of all round robin archives with the given consolidation
+    function directly from the archive. Timestamps are computed from the
+    archive step instead of being parsed for each row.
+    
+    @param archive: Path to the RRD archive
+    @param info: Archive header as returned by rrdtool.info
+    @param conf: Archive configuration
+    @param cf: Consolidation function
+    @return: A generator of (timestamp, data dictionary) tuples
+    """
+    step = int(info['step'])
+    last_update = int(info['last_update'])
+    
+    for rra_cf, steps, rows, xff in RRA.get_archives(info):
+      if rra_cf != cf:
+        continue
+      
+      resolution = step * steps
+      end = last_update - last_update % resolution
+      (start, end, resolution), names, values = rrdtool.fetch(
+        archive, cf,
+        '--resolution', str(resolution),
+        '--start', str(end - rows * resolution),
+        '--end', str(end)
+      )
+      
+      indices = [(x.name, names.index(x.name)) for x in conf.sources if x.name in names]
+      for timestamp, row in itertools.izip(xrange(start + resolution, end + 1, resolution), values):
+        yield datetime.fromtimestamp(timestamp), dict([(name, row[idx]) for name, idx in indices])
   
   @staticmethod
   def create(conf, archive, start = None):
@@ -990,6 +1150,14 @@ class RRA:
     if not os.path.isfile(archive):
       RRA.create(conf, archive)
     
+    rrdtool.update(*(get_daemon_options() + [archive, RRA.format_update(values, kwargs.get("timestamp", "N"))]))
+    RRA.record(node, conf, values, kwargs.get('graph'))
+  
+  @staticmethod
+  def format_update(values, timestamp = "N"):
+    """
+    Formats values as an rrdtool update argument.
+    """
     nvalues = []
     for idx, value in enumerate(values):
       if value is None:
@@ -997,14 +1165,13 @@ class RRA:
       else:
         nvalues.append(str(value))
     
-    rrdtool.update(
-      archive,
-      "{0}:{1}".format(
-        kwargs.get("timestamp", "N"),
-        ":".join(nvalues)
-      )
-    )
-
+    return "{0}:{1}".format(timestamp, ":".join(nvalues))
+  
+  @staticmethod
+  def record(node, conf, values, graph = None):
+    """
+    Records values in the database store and the data archive.
+    """
     # Record data in database store if set
     data = {}
     for i, x in enumerate(conf.sources):
@@ -1022,8 +1189,8 @@ class RRA:
         pass
     
     # Record data in archive when available
-    if kwargs.get('graph') is not None:
-      data_archive.record_data(kwargs.get('graph'), datetime.now(), data)
+    if graph is not None:
+      data_archive.record_data(graph, datetime.now(), data)
   
   @staticmethod
   def graph(conf, title, graph_id, archive, **kwargs):
@@ -1049,6 +1216,7 @@ class RRA:
       args.append('COMMENT:Last updated on %s\\c' % kwargs['last_update'].strftime('%Y-%m-%d %H\:%M\:%S'))
     
     args = args + conf.graph
+    args = args + get_daemon_options()
     args.append('--font')
     args.append('DEFAULT:0:DejaVu Sans Mono')
     args.append('--disable-rrdtool-tag')
@@ -1080,3 +1248,57 @@ class RRA:
         
         rrdtool.graph(*(options + args))
 
+
+class RRDWriter(object):
+  """
+  A write-behind buffer for RRD updates. Updates are queued in memory and
+  written on flush with a single rrdtool call per archive. When a caching
+  daemon is configured updates go through it, so disk writes are further
+  coalesced across cycles.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.__pending = {}
+    self.__order = []
+  
+  def update(self, node, conf, archive, *values, **kwargs):
+    """
+    Queues an update of an RRD archive. Arguments are the same as for
+    RRA.update.
+    """
+    if archive not in self.__pending:
+      self.__pending[archive] = (conf, [], [])
+      self.__order.append(archive)
+    
+    conf, updates, timestamps = self.__pending[archive]
+    timestamp = kwargs.get("timestamp", "N")
+    updates.append(RRA.format_update(values, timestamp))
+    if timestamp != "N":
+      timestamps.append(int(timestamp))
+    
+    RRA.record(node, conf, values, kwargs.get('graph'))
+  
+  def flush(self):
+    """
+    Writes all queued updates.
+    
+    @return: Number of archives that have been updated
+    """
+    written = 0
+    for archive in self.__order:
+      conf, updates, timestamps = self.__pending[archive]
+      try:
+        if not os.path.isfile(archive):
+          # Explicitly timestamped updates must not precede the archive start
+          RRA.create(conf, archive, start = min(timestamps) - 1 if timestamps else None)
+        
+        rrdtool.update(*(get_daemon_options() + [archive] + updates))
+        written += 1
+      except:
+        logging.warning(traceback.format_exc())
+    
+    self.__pending = {}
+    self.__order = []
+    return written
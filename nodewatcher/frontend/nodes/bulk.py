@@ -0,0 +1,126 @@
+from django.db import connection, transaction
+
+# Maximum number of query parameters in a single statement (SQLite has the
+# lowest limit of all supported backends)
+MAX_QUERY_PARAMS = 900
+
+# Quote name
+qn = connection.ops.quote_name
+
+def chunked(items, size):
+  """
+  Splits a list into chunks of the given size.
+
+  @param items: A list of items
+  @param size: Maximum chunk size
+  """
+  items = list(items)
+  for i in xrange(0, len(items), size):
+    yield items[i:i + size]
+
+class ChangeTracker(object):
+  """
+  Remembers field values of model instances when they are loaded so that
+  only the changed fields of changed instances need to be written back.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.__snapshots = {}
+
+  def __values(self, obj):
+    """
+    Returns current field values of a model instance.
+    """
+    return dict([(field.name, getattr(obj, field.attname)) for field in obj._meta.local_fields if not field.primary_key])
+
+  def track(self, obj):
+    """
+    Starts tracking changes of a model instance.
+
+    @param obj: Model instance
+    """
+    self.__snapshots[id(obj)] = (obj, self.__values(obj))
+
+  def forget(self, obj):
+    """
+    Stops tracking changes of a model instance.
+
+    @param obj: Model instance
+    """
+    self.__snapshots.pop(id(obj), None)
+
+  def changes(self):
+    """
+    Returns a list of (instance, changed field names) tuples for all
+    changed instances and resets their snapshots.
+    """
+    changes = []
+    for key, (obj, values) in self.__snapshots.items():
+      current = self.__values(obj)
+      changed = [name for name, value in current.iteritems() if values[name] != value]
+      if changed:
+        changes.append((obj, changed))
+        self.__snapshots[key] = (obj, current)
+
+    return changes
+
+def bulk_update(changes):
+  """
+  Writes changed fields of model instances back to the database. Instances
+  are grouped by their set of changed fields and each group is written with
+  a single parametrized UPDATE statement executed for all of its rows.
+
+  @param changes: A list of (instance, changed field names) tuples
+  """
+  groups = {}
+  for obj, names in changes:
+    groups.setdefault((obj.__class__, tuple(sorted(names))), []).append(obj)
+
+  if not groups:
+    return
+
+  cursor = connection.cursor()
+  for (model, names), objects in groups.iteritems():
+    opts = model._meta
+    fields = [opts.get_field(name) for name in names]
+    sql = "UPDATE %s SET %s WHERE %s = %%s" % (
+      qn(opts.db_table),
+      ", ".join(["%s = %%s" % qn(field.column) for field in fields]),
+      qn(opts.pk.column)
+    )
+
+    params = []
+    for obj in objects:
+      row = [field.get_db_prep_save(getattr(obj, field.attname), connection = connection) for field in fields]
+      row.append(opts.pk.get_db_prep_save(obj.pk, connection = connection))
+      params.append(row)
+
+    cursor.executemany(sql, params)
+
+  transaction.set_dirty()
+
+def bulk_insert(model, objects):
+  """
+  Inserts model instances using multi-row INSERT statements. Note that
+  save() is not called, so any fields it would normally set must already
+  be set. Primary keys of auto-increment models are not populated.
+
+  @param model: Model class
+  @param objects: A list of model instances
+  """
+  size = max(1, MAX_QUERY_PARAMS // len(model._meta.local_fields))
+  for chunk in chunked(objects, size):
+    model.objects.bulk_create(chunk)
+
+def bulk_delete(model, pks):
+  """
+  Deletes model instances with the given primary keys. Deletion cascades
+  and signals are handled as with any other query set deletion.
+
+  @param model: Model class
+  @param pks: A list of primary keys
+  """
+  for chunk in chunked(pks, MAX_QUERY_PARAMS):
+    model.objects.filter(pk__in = chunk).delete()
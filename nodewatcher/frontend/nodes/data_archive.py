@@ -42,6 +42,35 @@ if getattr(settings, 'DATA_ARCHIVE_ENABLED', False):
     data.update(q)
     db.statistics.update(q, data, upsert = True)
   
+  def record_data_bulk(graph, rows):
+    """
+    Records many graph data points into the archive at once. Records with
+    equal timestamps are replaced, just like with record_data.
+    
+    @param graph: Graph identifier
+    @param rows: An iterable of (timestamp, data dictionary) tuples
+    """
+    now = datetime.now()
+    records = {}
+    for timestamp, data in rows:
+      if timestamp > now:
+        continue
+      
+      if all([x == "NaN" or x == None for x in data.values()]):
+        continue
+      
+      data.update({ 'graph' : graph, 'timestamp' : timestamp })
+      records[timestamp] = data
+    
+    if not records:
+      return
+    
+    timestamps = records.keys()
+    for i in xrange(0, len(timestamps), 1000):
+      db.statistics.remove({ 'graph' : graph, 'timestamp' : { '$in' : timestamps[i:i + 1000] } })
+    
+    db.statistics.insert(records.values())
+  
   def fetch_data(graph, start = None, sort = False):
     """
     Returns all data records recorded for a specific graph.
@@ -94,6 +123,9 @@ else:
   def record_data(graph, timestamp, data):
     pass
   
+  def record_data_bulk(graph, rows):
+    pass
+  
   def fetch_data(graph, start = None, sort = False):
     return []
   
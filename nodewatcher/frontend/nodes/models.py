@@ -5,7 +5,7 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core.cache import cache
-from django.core.mail import send_mail
+from django.core.mail import send_mass_mail
 from django.db import models
 from django.template import loader, Context
 from django.utils.translation import ugettext as _
@@ -14,6 +14,7 @@ from frontend.dns.models import Zone, Record
 from frontend.generator.types import IfaceType
 from frontend.nodes.locker import require_lock, model_lock
 from frontend.nodes import ipcalc, data_archive
+from frontend.nodes.bulk import bulk_update, bulk_insert, bulk_delete
 from frontend.nodes.common import load_plugin
 from frontend.nodes.transitions import RouterTransition
 from frontend.nodes.util import IPField, IPManager, queryset_by_ip
@@ -1074,8 +1075,17 @@ class GraphItem(models.Model, GraphItemNP):
     Should be called when graph item has changed and requires a
     redraw to signal other parts.
     """
-    for timespan in settings.GRAPH_TIMESPANS:
-      cache.delete('nodewatcher.graphs.drawn.{0}.{1}'.format(self.id, timespan))
+    GraphItem.notify_updated_many([self.id])
+  
+  @staticmethod
+  def notify_updated_many(graph_ids):
+    """
+    Signals that multiple graph items have changed using a single cache
+    operation.
+    
+    @param graph_ids: A list of graph item primary keys
+    """
+    cache.delete_many(['nodewatcher.graphs.drawn.{0}.{1}'.format(graph_id, timespan) for graph_id in graph_ids for timespan in settings.GRAPH_TIMESPANS])
 
 class WhitelistItem(models.Model):
   """
@@ -1556,19 +1566,26 @@ class Event(models.Model):
     event.timestamp = datetime.now()
     event.save()
     event.post_event()
-
-    # Check if there are any repeated events that need sending
-    Event.post_events_that_need_resend()
   
   @staticmethod
   def post_events_that_need_resend():
     """
     Posts all events that need to be resent.
     """
-    for event in Event.objects.filter(need_resend = True, timestamp__lt = datetime.now() - timedelta(minutes = 30)):
+    events = list(Event.objects.filter(need_resend = True, timestamp__lt = datetime.now() - timedelta(minutes = 30)).select_related('node'))
+    if not events:
+      return
+    
+    for event in events:
       event.need_resend = False
-      event.save()
-      event.post_event()
+    
+    bulk_update([(event, ['need_resend']) for event in events])
+    subscriptions = SubscriptionIndex()
+    notifications = []
+    for event in events:
+      notifications.extend(event.get_notifications(subscriptions.get_subscribers(event.node, event.code)))
+    
+    bulk_insert(EventNotification, notifications)
 
   def has_repeated(self):
     """
@@ -1580,8 +1597,8 @@ class Event(models.Model):
     """
     Posts an event to all subscribers.
     """
-    # Check subscriptions and post notifications
-    subscriptions = EventSubscription.objects.filter(
+    # Check subscriptions and queue notifications
+    subscriptions = SubscriptionIndex(EventSubscription.objects.filter(
       # Filter by nodes
       models.Q(type = SubscriptionType.SingleNode, node = self.node) | \
       models.Q(type = SubscriptionType.AllNodes) | \
@@ -1589,10 +1606,31 @@ class Event(models.Model):
       
       # Filter by event code
       models.Q(code = self.code) | models.Q(code__isnull = True)
-    )
-
-    for subscription in subscriptions:
-      subscription.notify(self)
+    ))
+    
+    bulk_insert(EventNotification, self.get_notifications(subscriptions.get_subscribers(self.node, self.code)))
+  
+  def get_notifications(self, users):
+    """
+    Renders this event and returns notifications for the given users. The
+    event is only rendered once regardless of the number of users.
+    
+    @param users: A list of User instances
+    @return: A list of unsaved EventNotification instances
+    """
+    if not users:
+      return []
+    
+    # Format node name and IP
+    if self.node.name:
+      name_ip = '%s/%s' % (self.node.ip, self.node.name)
+    else:
+      name_ip = self.node.ip
+    
+    subject = '%s%s - %s' % (settings.EMAIL_SUBJECT_PREFIX or "", name_ip, self.code_to_string())
+    text = loader.get_template('nodes/event_notification.txt').render(Context({ 'event' : self }))
+    now = datetime.now()
+    return [EventNotification(user = user, subject = subject, text = text, created_at = now) for user in users]
 
 class SubscriptionType:
   """
@@ -1652,37 +1690,106 @@ class EventSubscription(models.Model):
 
     @param event: A valid Event instance
     """
+    bulk_insert(EventNotification, event.get_notifications([self.user]))
+
+class SubscriptionIndex(object):
+  """
+  An index of event subscriptions that resolves subscribers of any event
+  without further queries.
+  """
+  def __init__(self, subscriptions = None):
+    """
+    Class constructor.
+
+    @param subscriptions: Optional query set of subscriptions to index (all
+      subscriptions are indexed by default)
+    """
+    if subscriptions is None:
+      subscriptions = EventSubscription.objects.all()
+    
+    self.__index = {}
+    for subscription in subscriptions.select_related('user'):
+      if subscription.type == SubscriptionType.SingleNode:
+        key = (subscription.type, subscription.node_id, subscription.code)
+      elif subscription.type == SubscriptionType.AllNodes:
+        key = (subscription.type, None, subscription.code)
+      elif subscription.type == SubscriptionType.MyNodes:
+        key = (subscription.type, subscription.user_id, subscription.code)
+      else:
+        continue
+      
+      self.__index.setdefault(key, []).append(subscription.user)
+  
+  def get_subscribers(self, node, code):
+    """
+    Returns a list of users subscribed to an event. Every user is
+    included only once even when multiple subscriptions match.
+
+    @param node: Node instance that generated the event
+    @param code: Event code
+    """
+    users = {}
+    for c in (code, None):
+      for key in ((SubscriptionType.SingleNode, node.pk, c), (SubscriptionType.AllNodes, None, c),
+                  (SubscriptionType.MyNodes, node.owner_id, c)):
+        for user in self.__index.get(key, ()):
+          users[user.pk] = user
+    
+    return users.values()
+
+class EventNotification(models.Model):
+  """
+  A queued event notification. Notifications are sent in batches, so each
+  user receives a single message containing all pending notifications.
+  """
+  user = models.ForeignKey(User)
+  subject = models.CharField(max_length = 200)
+  text = models.TextField()
+  created_at = models.DateTimeField()
+
+  @staticmethod
+  def send_pending():
+    """
+    Sends all pending notifications, one message per user.
+    """
+    pending = {}
+    for notification in EventNotification.objects.select_related('user').order_by('created_at', 'pk'):
+      pending.setdefault(notification.user_id, []).append(notification)
+    
+    if not pending:
+      return
+    
     t = loader.get_template('nodes/event_mail.txt')
-    c = Context({
-      'user'  : self.user,
-      'event' : event,
+    base_context = {
       'network' : { 'name'        : settings.NETWORK_NAME,
                     'home'        : settings.NETWORK_HOME,
                     'contact'     : settings.NETWORK_CONTACT,
                     'description' : getattr(settings, 'NETWORK_DESCRIPTION', None)
                   },
       'base_url' : "%s://%s" % ('https' if getattr(settings, 'USE_HTTPS', False) else 'http', Site.objects.get_current().domain)
-    })
-
-    # Format node name and IP
-    if event.node.name:
-      name_ip = '%s/%s' % (event.node.ip, event.node.name)
-    else:
-      name_ip = event.node.ip
-
+    }
+    
+    messages = []
+    for notifications in pending.values():
+      user = notifications[0].user
+      if len(notifications) == 1:
+        subject = notifications[0].subject
+      else:
+        subject = '%s%d events' % (settings.EMAIL_SUBJECT_PREFIX or "", len(notifications))
+      
+      c = Context(dict(base_context, user = user, notifications = notifications))
+      messages.append((subject, t.render(c), settings.EMAIL_EVENTS_SENDER, [user.email]))
+    
     # Should we really send an e-mail?
     if getattr(settings, 'EMAIL_TO_CONSOLE', None):
-      print 'Subject: %s%s - %s' % (settings.EMAIL_SUBJECT_PREFIX or "", name_ip, event.code_to_string())
-      print 'To: %s' % self.user.email
-      print t.render(c)
+      for subject, body, sender, recipients in messages:
+        print 'Subject: %s' % subject
+        print 'To: %s' % recipients[0]
+        print body
     else:
-      send_mail(
-        '%s%s - %s' % (settings.EMAIL_SUBJECT_PREFIX or "", name_ip, event.code_to_string()),
-        t.render(c),
-        settings.EMAIL_EVENTS_SENDER,
-        [self.user.email],
-        fail_silently = True
-      )
+      send_mass_mail(messages, fail_silently = True)
+    
+    bulk_delete(EventNotification, [n.pk for notifications in pending.values() for n in notifications])
 
 class WarningCode:
   """
@@ -0,0 +1,117 @@
+from frontend.nodes import ipcalc
+
+class TrieNode(object):
+  """
+  A single node of the prefix trie.
+  """
+  __slots__ = ('children', 'values')
+
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.children = [None, None]
+    self.values = []
+
+class PrefixTrie(object):
+  """
+  A binary trie over IP prefixes that answers containment and conflict
+  queries in time proportional to the prefix length. It provides the
+  same lookups as IPQuerySet.ip_filter for in-memory sets of prefixes.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.__roots = {}
+
+  def __bits(self, prefix):
+    """
+    Returns a tuple (root, bits) where bits is a list of network bits of
+    the given prefix.
+    """
+    network = ipcalc.Network(prefix)
+    width = 32 if network.version() == 4 else 128
+    address = long(network.network())
+    root = self.__roots.get(network.version())
+    if root is None:
+      root = self.__roots[network.version()] = TrieNode()
+
+    return root, [(address >> (width - 1 - i)) & 1 for i in xrange(network.subnet())]
+
+  def add(self, prefix, value):
+    """
+    Adds a prefix to the trie.
+
+    @param prefix: Prefix in address/length notation
+    @param value: Value associated with the prefix
+    """
+    node, bits = self.__bits(prefix)
+    for bit in bits:
+      if node.children[bit] is None:
+        node.children[bit] = TrieNode()
+      node = node.children[bit]
+
+    node.values.append(value)
+
+  def contains(self, prefix):
+    """
+    Returns values of all prefixes that contain (or are equal to) the
+    given prefix.
+
+    @param prefix: Prefix in address/length notation
+    """
+    node, bits = self.__bits(prefix)
+    values = list(node.values)
+    for bit in bits:
+      node = node.children[bit]
+      if node is None:
+        break
+      values.extend(node.values)
+
+    return values
+
+  def contained_in(self, prefix):
+    """
+    Returns values of all prefixes that are contained in (or are equal
+    to) the given prefix.
+
+    @param prefix: Prefix in address/length notation
+    """
+    node, bits = self.__bits(prefix)
+    for bit in bits:
+      node = node.children[bit]
+      if node is None:
+        return []
+
+    values = []
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      values.extend(node.values)
+      stack.extend([child for child in node.children if child is not None])
+
+    return values
+
+  def conflicts(self, prefix):
+    """
+    Returns values of all prefixes that overlap with the given prefix.
+
+    @param prefix: Prefix in address/length notation
+    """
+    node, bits = self.__bits(prefix)
+    values = []
+    for bit in bits:
+      values.extend(node.values)
+      node = node.children[bit]
+      if node is None:
+        return values
+
+    # Equal and more specific prefixes
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      values.extend(node.values)
+      stack.extend([child for child in node.children if child is not None])
+
+    return values
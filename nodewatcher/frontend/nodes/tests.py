@@ -1,8 +1,45 @@
+import httplib
 import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from StringIO import StringIO
+from datetime import datetime, timedelta
 
+from django.contrib.auth.models import User
+from django.core import mail
 from django.db import transaction, connection
+from django.test.utils import override_settings
 from django.utils import unittest
-from frontend.nodes.models import Pool, PoolStatus
+import lxml.etree as ElementTree
+from frontend.nodes.models import Pool, PoolStatus, Node, NodeStatus, NodeWarning, WarningCode, Event, EventCode, EventSource
+from frontend.nodes.models import EventSubscription, EventNotification, SubscriptionType, GraphItem, GraphType, APClient, Subnet, InstalledPackage
+from frontend.monitor import graphs
+from frontend.monitor.models import MonitorInstance
+from frontend.monitor.rrd import RRDTransform, RoundRobinArchive, DataSource, GaugeDST, MaxCF
+from frontend.nodes.bulk import ChangeTracker, bulk_update, bulk_insert, bulk_delete
+from frontend.nodes.prefix_trie import PrefixTrie
+
+# Monitor modules are imported relative to the monitor directory, the same
+# way the monitor imports them
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "monitor"))
+from lib.node_warnings import WarningAccumulator
+from lib.node_events import EventAggregator
+from lib.topology_delta import TopologyHistory
+from lib.wifi_utils import OlsrNode, OlsrLink, TablesParser
+from lib.workers import process_chunk, worker_init, WorkerPool, INHERITED_CONNECTIONS
+from lib.scheduler import NodeScheduler
+from lib.report_state import ReportState
+from lib.clients import SubnetMatcher, sync_ap_clients
+from lib.packages import PackageRefreshSchedule, sync_installed_packages
+from lib.link_metrics import LinkMetrics, topology_links, NUMPY_ENABLED
+from lib.sharding import HashRing, ShardMembership
+from lib.push import ReportBuffer, HTTPPushReceiver
+from lib.fetcher import Fetcher
+from lib.report_schema import ReportSchema, safe_int_convert, safe_dbm_convert
+from lib.metrics import Metrics, QueryCounter
 
 @transaction.commit_on_success
 def _concurrent_allocation_worker(pool):
@@ -95,3 +132,1063 @@ class PoolTestCase(unittest.TestCase):
       workers.close()
       workers.join()
 
+
+def _failing_pool_worker(i):
+  Pool.objects.create(family = 4, network = "10.21.%d.0" % i, cidr = 24)
+  if i == 1:
+    raise ValueError("failing item")
+
+  return i
+
+def _inherited_connection_worker(i):
+  # Workers never use the inherited connection
+  return connection.connection not in INHERITED_CONNECTIONS
+
+class WorkersTestCase(unittest.TestCase):
+  def tearDown(self):
+    Pool.objects.filter(network__startswith = "10.21.").delete()
+
+  def test_process_chunk(self):
+    # A failed item is rolled back without affecting other items of the chunk
+    self.assertEqual(process_chunk(_failing_pool_worker, [(0,), (1,), (2,)]), [0, 2])
+    self.assertEqual(sorted(Pool.objects.filter(network__startswith = "10.21.").values_list('network', flat = True)), ["10.21.0.0", "10.21.2.0"])
+
+  def test_lock(self):
+    # Rows are locked at the start of every transaction, before any item is processed
+    locked = []
+    def lock(chunk):
+      locked.append((list(chunk), Pool.objects.filter(network__startswith = "10.21.").count()))
+
+    self.assertEqual(process_chunk(_failing_pool_worker, [(0,), (2,)], lock = lock), [0, 2])
+    if connection.features.uses_savepoints:
+      self.assertEqual(locked, [([(0,), (2,)], 0)])
+    else:
+      self.assertEqual(locked, [([(0,)], 0), ([(2,)], 1)])
+
+  def test_inherited_connection(self):
+    cursor = connection.cursor()
+    parent = connection.connection
+
+    # A forked worker keeps the inherited connection aside instead of dropping it
+    pid = os.fork()
+    if pid == 0:
+      worker_init()
+      os._exit(0 if connection.connection is None and INHERITED_CONNECTIONS == [parent] else 1)
+
+    self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    # Workers are replaced after every chunk, so some are forked while items are processed
+    pool = WorkerPool(processes = 2, chunk_size = 1, max_tasks = 1)
+    try:
+      self.assertEqual(list(pool.imap_unordered(_inherited_connection_worker, [(i,) for i in xrange(6)])), [True] * 6)
+    finally:
+      pool.terminate()
+
+    # Workers kept the inherited connection without using it, so it still works
+    self.assertTrue(connection.connection is parent)
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1")
+    self.assertEqual(cursor.fetchone()[0], 1)
+
+class BulkTestCase(unittest.TestCase):
+  def tearDown(self):
+    Pool.objects.filter(network__startswith = "10.20.").delete()
+
+  def test_bulk_operations(self):
+    # Insert more rows than fit into a single statement
+    bulk_insert(Pool, [Pool(family = 4, network = "10.20.%d.0" % i, cidr = 24, ip_subnet = "10.20.%d.0/24" % i) for i in xrange(200)])
+    pools = list(Pool.objects.filter(network__startswith = "10.20."))
+    self.assertEqual(len(pools), 200)
+
+    # Only changed fields of changed instances should be reported
+    tracker = ChangeTracker()
+    for pool in pools:
+      tracker.track(pool)
+
+    pools[0].description = "changed"
+    pools[1].status = PoolStatus.Full
+    changes = dict([(obj.pk, names) for obj, names in tracker.changes()])
+    self.assertEqual(changes, { pools[0].pk : ["description"], pools[1].pk : ["status"] })
+    self.assertEqual(tracker.changes(), [])
+
+    bulk_update([(pools[0], ["description"]), (pools[1], ["status"])])
+    self.assertEqual(Pool.objects.get(pk = pools[0].pk).description, "changed")
+    self.assertEqual(Pool.objects.get(pk = pools[1].pk).status, PoolStatus.Full)
+
+    bulk_delete(Pool, [pool.pk for pool in pools[:150]])
+    self.assertEqual(Pool.objects.filter(network__startswith = "10.20.").count(), 50)
+
+class WarningAccumulatorTestCase(unittest.TestCase):
+  def setUp(self):
+    self.nodes = [Node.objects.create(ip = "10.30.0.%d" % i, status = NodeStatus.Invalid, visible = True) for i in xrange(3)]
+    self.past = datetime.now() - timedelta(hours = 1)
+
+  def tearDown(self):
+    Node.objects.filter(ip__startswith = "10.30.").delete()
+
+  def store(self, node, code, details = '', source = EventSource.Monitor):
+    return NodeWarning.objects.create(node = node, code = code, source = source, details = details,
+      created_at = self.past, last_update = self.past)
+
+  def test_apply(self):
+    a, b, c = self.nodes
+    touched = self.store(a, WarningCode.DupedReplies)
+    updated = self.store(a, WarningCode.TimeOutOfSync, "skew 10 s")
+    removed = self.store(b, WarningCode.DnsDown)
+    custom = self.store(b, WarningCode.Custom, "first")
+
+    warnings = WarningAccumulator(EventSource.Monitor)
+    warnings.add(a, WarningCode.DupedReplies)
+    warnings.add(a, WarningCode.TimeOutOfSync, "skew 5 s")
+    warnings.add(a, WarningCode.TimeOutOfSync, "skew 20 s")
+    warnings.add(b, WarningCode.Custom, "first")
+    warnings.add(b, WarningCode.Custom, "second")
+    warnings.merge([(c.pk, WarningCode.NoRedundancy, '')])
+    warnings.apply()
+
+    stored = dict([(w.pk, w) for w in NodeWarning.objects.filter(node__in = self.nodes)])
+    self.assertEqual(len(stored), 5)
+
+    # Warnings that are still present are only touched
+    self.assertTrue(stored[touched.pk].last_update > self.past)
+    self.assertEqual(stored[touched.pk].created_at, self.past)
+
+    # Only the last details of a warning raised multiple times are kept
+    self.assertEqual(stored[updated.pk].details, "skew 20 s")
+    self.assertTrue(stored[updated.pk].last_update > self.past)
+
+    # Warnings that have not been raised are removed
+    self.assertFalse(removed.pk in stored)
+
+    # Custom warnings are identified by their details
+    self.assertTrue(custom.pk in stored)
+    self.assertEqual(NodeWarning.objects.filter(node = b, code = WarningCode.Custom, details = "second").count(), 1)
+
+    # New warnings are inserted as dirty
+    new = NodeWarning.objects.get(node = c)
+    self.assertEqual(new.code, WarningCode.NoRedundancy)
+    self.assertTrue(new.dirty)
+
+  def test_apply_scope(self):
+    a, b, c = self.nodes
+    self.store(a, WarningCode.DnsDown)
+    other = self.store(b, WarningCode.DnsDown)
+
+    # Warnings outside the scope are neither removed nor duplicated
+    warnings = WarningAccumulator(EventSource.Monitor)
+    warnings.add(b, WarningCode.DnsDown)
+    warnings.apply(scope = lambda w: w.node_id == a.pk)
+
+    self.assertEqual(NodeWarning.objects.filter(node = a).count(), 0)
+    self.assertEqual(list(NodeWarning.objects.filter(node = b).values_list('pk', 'last_update')), [(other.pk, self.past)])
+
+class EventTestCase(unittest.TestCase):
+  def setUp(self):
+    self.nodes = [Node.objects.create(ip = "10.31.0.%d" % i, status = NodeStatus.Invalid, visible = True) for i in xrange(2)]
+    self.users = [User.objects.create(username = "events%d" % i, email = "events%d@example.net" % i) for i in xrange(2)]
+    EventNotification.objects.all().delete()
+
+  def tearDown(self):
+    EventNotification.objects.all().delete()
+    User.objects.filter(username__startswith = "events").delete()
+    Node.objects.filter(ip__startswith = "10.31.").delete()
+
+  def test_aggregation(self):
+    a, b = self.nodes
+    EventSubscription.objects.create(user = self.users[0], type = SubscriptionType.AllNodes)
+
+    events = EventAggregator()
+    events.add(a, EventCode.NodeDown, '', EventSource.Monitor)
+    events.add(a, EventCode.NodeDown, '', EventSource.Monitor)
+    events.merge([(b.pk, EventCode.NodeDown, '', EventSource.Monitor, '', True, datetime.now())])
+    events.add(b, EventCode.VersionChange, '', EventSource.Monitor, aggregate = False)
+    events.add(b, EventCode.VersionChange, '', EventSource.Monitor, aggregate = False)
+    events.add("missing-node", EventCode.NodeDown, '', EventSource.Monitor)
+    events.apply()
+
+    # Repeated events of the same node and code are merged before insertion
+    self.assertEqual(Event.objects.filter(node = a).get().counter, 2)
+    self.assertEqual(Event.objects.filter(node = b, code = EventCode.NodeDown).get().counter, 1)
+    self.assertEqual(Event.objects.filter(node = b, code = EventCode.VersionChange).count(), 2)
+    self.assertEqual(Event.objects.filter(node__in = self.nodes).count(), 4)
+
+    # Subscribers are notified once per stored event
+    self.assertEqual(EventNotification.objects.filter(user = self.users[0]).count(), 4)
+    self.assertEqual(EventNotification.objects.filter(user = self.users[1]).count(), 0)
+
+    # Events repeated within the window in a later cycle update stored events
+    events.add(a, EventCode.NodeDown, '', EventSource.Monitor)
+    events.apply()
+    event = Event.objects.filter(node = a).get()
+    self.assertEqual(event.counter, 3)
+    self.assertTrue(event.need_resend)
+    self.assertEqual(EventNotification.objects.count(), 4)
+
+  @override_settings(EMAIL_TO_CONSOLE = False)
+  def test_send_pending(self):
+    first, second = self.users
+    event = Event(node = self.nodes[0], code = EventCode.NodeDown, summary = '', source = EventSource.Monitor, data = '', timestamp = datetime.now())
+    bulk_insert(EventNotification, event.get_notifications([first, second]) + event.get_notifications([first]))
+
+    mail.outbox = []
+    EventNotification.send_pending()
+
+    # Every user receives a single message with all pending notifications
+    self.assertEqual(sorted([message.to for message in mail.outbox]), [[first.email], [second.email]])
+    self.assertEqual(EventNotification.objects.count(), 0)
+    subjects = dict([(message.to[0], message.subject) for message in mail.outbox])
+    self.assertTrue(subjects[first.email].endswith("2 events"))
+    self.assertFalse(subjects[second.email].endswith("events"))
+
+class GrapherTestCase(unittest.TestCase):
+  def setUp(self):
+    self.node = Node.objects.create(ip = "10.32.0.1", status = NodeStatus.Invalid, visible = True)
+    graphs.GRAPH_ITEM_CACHE.clear()
+
+  def tearDown(self):
+    Node.objects.filter(ip__startswith = "10.32.").delete()
+
+  def create(self, name, type, parent = None):
+    return GraphItem.objects.create(node = self.node, name = name, type = type, parent = parent, rra = "", graph = "", title = "")
+
+  def test_cache(self):
+    rtt = self.create('', GraphType.RTT)
+    lq = self.create('', GraphType.LQ)
+    peer = self.create('10.32.0.2', GraphType.LQ, lq)
+
+    grapher = graphs.Grapher(self.node)
+    self.assertEqual(grapher.get_graph_item('', GraphType.RTT, None).pk, rtt.pk)
+    self.assertEqual(grapher.get_graph_item('10.32.0.2', GraphType.LQ, lq).pk, peer.pk)
+    cached = grapher.get_graph_item('', GraphType.LQ, None)
+
+    # Cached items are reused by later cycles
+    grapher = graphs.Grapher(self.node)
+    self.assertTrue(grapher.get_graph_item('', GraphType.LQ, None) is cached)
+
+    # Items created by another process are loaded when they are not found
+    etx = self.create('', GraphType.ETX)
+    self.assertEqual(grapher.get_graph_item('', GraphType.ETX, None).pk, etx.pk)
+    self.assertEqual(grapher.get_graph_item('', GraphType.Clients, None), None)
+
+    # Removed items are reported when marking items updated
+    rtt.delete()
+    self.assertEqual(graphs.mark_updated([rtt.pk, lq.pk, peer.pk, etx.pk]), set([rtt.pk]))
+    self.assertEqual(graphs.mark_updated([lq.pk]), set())
+
+    # Removed items stay cached until the generation of the node changes
+    self.assertNotEqual(graphs.Grapher(self.node).get_graph_item('', GraphType.RTT, None), None)
+    self.assertEqual(graphs.Grapher(self.node, 1).get_graph_item('', GraphType.RTT, None), None)
+
+class TopologyHistoryTestCase(unittest.TestCase):
+  def topology(self, *links):
+    nodes = {}
+    for src, dst, lq, ilq, etx in links:
+      nodes.setdefault(src, OlsrNode(src)).links.append(OlsrLink(dst, lq, ilq, etx, 10.0))
+
+    return nodes
+
+  def test_thresholds(self):
+    history = TopologyHistory(threshold = 0.05)
+    delta = history.compute(self.topology(("a", "b", 1.0, 1.0, 1.0), ("a", "c", 0.5, 0.5, 10.0)))
+    self.assertTrue(delta.full)
+    self.assertTrue(delta.link_needs_update("a", "b"))
+    history.accept(delta)
+
+    # Link quality thresholds are absolute and the ETX threshold is relative
+    delta = history.compute(self.topology(("a", "b", 0.96, 1.04, 1.04), ("a", "c", 0.5, 0.5, 10.4)))
+    self.assertFalse(delta.full)
+    self.assertEqual(delta.links_changed, set())
+    self.assertFalse(delta.link_needs_update("a", "b"))
+
+    delta = history.compute(self.topology(("a", "b", 1.0, 0.94, 1.0), ("a", "c", 0.5, 0.5, 10.6)))
+    self.assertEqual(delta.links_changed, set([("a", "b"), ("a", "c")]))
+
+    # Changes are measured against the last written metrics, so small changes
+    # can not accumulate unnoticed
+    history.accept(history.compute(self.topology(("a", "b", 0.97, 1.0, 1.0), ("a", "c", 0.5, 0.5, 10.0))))
+    delta = history.compute(self.topology(("a", "b", 0.94, 1.0, 1.0), ("c", "a", 0.5, 0.5, 10.0)))
+    self.assertEqual(delta.links_changed, set([("a", "b")]))
+    self.assertEqual(delta.links_added, set([("c", "a")]))
+    self.assertEqual(delta.links_removed, set([("a", "c")]))
+    self.assertTrue(delta.link_needs_update("c", "a"))
+
+TXTINFO_TABLES = "\n".join([
+  "HTTP/1.0 200 OK",
+  "Content-type: text/plain",
+  "",
+  "Table: Topology",
+  "Dest. IP\tLast hop IP\tLQ\tNLQ\tCost\tVTime",
+  "10.40.0.2\t10.40.0.1\t1.000\t0.871\t1.148\t300.0",
+  "10.40.0.1\t10.40.0.2\t0.871\t1.000\t1.148\t300.0",
+  "10.40.0.3\t10.40.0.1\t0.500\t0.250\tINFINITE\t300.0",
+  "10.40.0.3\t10.40.0.2\t0.750\t0.500\t2.667",
+  "",
+  "Table: HNA",
+  "Destination\tGateway",
+  "10.40.128.0/27\t10.40.0.1",
+  "0.0.0.0/0\t10.40.0.2",
+  "",
+  "Table: MID",
+  "IP address\tAliases",
+  "10.40.0.1\t172.16.0.1;172.16.0.2",
+  "",
+  "",
+])
+
+class LinkMetricsTestCase(unittest.TestCase):
+  def setUp(self):
+    """
+    Prepares a routing table snapshot.
+    """
+    self.nodes = {}
+    for src, dst, lq, ilq, etx in (
+      ("10.60.0.1", "10.60.0.2", 1.0, 0.871, 1.148),
+      ("10.60.0.1", "10.60.0.3", 0.5, 0.25, 8.0),
+      ("10.60.0.2", "10.60.0.1", 0.871, 1.0, 1.148),
+      ("10.60.0.3", "10.60.0.1", 0.25, 0.5, 8.0),
+      ("10.60.0.3", "10.60.0.2", 0.333, 0.9, 3.3),
+      ("10.60.0.3", "10.60.0.9", 1.0, 1.0, 1.0),
+    ):
+      self.nodes.setdefault(src, OlsrNode(src)).links.append(OlsrLink(dst, lq, ilq, etx, 10.0))
+
+    self.peers = dict([("10.60.0.%d" % i, ("node-%d" % i, "n%d (10.60.0.%d)" % (i, i))) for i in (1, 2, 3)])
+
+  def test_node(self):
+    metrics = LinkMetrics(topology_links(self.nodes, self.peers), use_numpy = False)
+
+    # Links to unknown nodes are skipped and links are ordered by their destination
+    node = metrics.node("10.60.0.3")
+    self.assertEqual(node['peers'], 2)
+    self.assertEqual(node['links'], [("node-1", "10.60.0.1", "n1 (10.60.0.1)", 0.25, 0.5, 8.0), ("node-2", "10.60.0.2", "n2 (10.60.0.2)", 0.333, 0.9, 3.3)])
+    self.assertAlmostEqual(node['lq'], 0.2915)
+    self.assertAlmostEqual(node['ilq'], 0.7)
+    self.assertAlmostEqual(node['etx'], 5.65)
+    self.assertAlmostEqual(node['asymmetry'], 0.4085)
+    self.assertEqual(metrics.node("10.60.0.9"), None)
+    self.assertEqual(metrics.summary()['links'], 5)
+    self.assertEqual(LinkMetrics([]).summary(), { 'links' : 0, 'lq' : 0.0, 'asymmetry' : 0.0 })
+
+  @unittest.skipUnless(NUMPY_ENABLED, "NumPy is not available")
+  def test_numpy(self):
+    # Both implementations compute the same metrics
+    links = topology_links(self.nodes, self.peers)
+    arrays = LinkMetrics(links)
+    lists = LinkMetrics(links, use_numpy = False)
+    for node_ip in ("10.60.0.1", "10.60.0.2", "10.60.0.3", "10.60.0.9"):
+      self.assertEqual(arrays.node(node_ip), lists.node(node_ip))
+
+    self.assertEqual(arrays.summary(), lists.summary())
+
+RRD_DUMP = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE rrd SYSTEM "http://oss.oetiker.ch/rrdtool/rrdtool.dtd">
+<rrd>
+  <version>0003</version>
+  <step>300</step> <!-- Seconds -->
+  <lastupdate>1300000000</lastupdate>
+  <ds>
+    <name> a </name>
+    <type> GAUGE </type>
+    <minimal_heartbeat>600</minimal_heartbeat>
+    <min>NaN</min>
+    <max>NaN</max>
+    <last_ds></last_ds>
+    <value>0.0000000000e+00</value>
+    <unknown_sec> 0 </unknown_sec>
+  </ds>
+  <ds>
+    <name> b </name>
+    <type> GAUGE </type>
+    <minimal_heartbeat>600</minimal_heartbeat>
+    <min>NaN</min>
+    <max>NaN</max>
+    <last_ds>5</last_ds>
+    <value>0.0000000000e+00</value>
+    <unknown_sec> 0 </unknown_sec>
+  </ds>
+  <!-- Round Robin Archives -->
+  <rra>
+    <cf>AVERAGE</cf>
+    <pdp_per_row>1</pdp_per_row> <!-- 300 seconds -->
+    <params>
+      <xff>5.0000000000e-01</xff>
+    </params>
+    <cdp_prep>
+      <ds>
+        <primary_value>1.0</primary_value>
+        <secondary_value>NaN</secondary_value>
+        <value>NaN</value>
+        <unknown_datapoints>0</unknown_datapoints>
+      </ds>
+      <ds>
+        <primary_value>2.0</primary_value>
+        <secondary_value>NaN</secondary_value>
+        <value>NaN</value>
+        <unknown_datapoints>0</unknown_datapoints>
+      </ds>
+    </cdp_prep>
+    <database>
+      <!-- 2011-03-13 06:25:00 CET / 1299993900 --> <row><v>1.0</v><v>2.0</v></row>
+      <!-- 2011-03-13 06:30:00 CET / 1299994200 --> <row><v>3.0</v><v>4.0</v></row>
+    </database>
+  </rra>
+</rrd>
+"""
+
+class RRDTransformTestCase(unittest.TestCase):
+  def transform(self, source_map, **kwargs):
+    """
+    Transforms the dump and returns the output and its parsed tree.
+    """
+    output = StringIO()
+    RRDTransform(source_map, **kwargs).transform(StringIO(RRD_DUMP), output)
+    return output.getvalue(), ElementTree.fromstring(output.getvalue())
+
+  def rows(self, output):
+    return [line for line in output.split("\n") if line.startswith("<row>")]
+
+  def test_identity(self):
+    output, rrd = self.transform([0, 1])
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/*[not(self::ds or self::rra)]")], ["0003", "300", "1300000000"])
+    self.assertEqual([x.text.strip() for x in rrd.xpath("/rrd/ds/name")], ["a", "b"])
+    self.assertEqual(self.rows(output), ["<row><v>1.0</v><v>2.0</v></row>", "<row><v>3.0</v><v>4.0</v></row>"])
+
+    # Empty last_ds values are replaced, so rrdtool accepts them on restore
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/ds/last_ds")], ["UNKN", "5"])
+
+  def test_reorder(self):
+    output, rrd = self.transform([1, 0])
+    self.assertEqual([x.text.strip() for x in rrd.xpath("/rrd/ds/name")], ["b", "a"])
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/rra/cdp_prep/ds/primary_value")], ["2.0", "1.0"])
+    self.assertEqual(self.rows(output), ["<row><v>2.0</v><v>1.0</v></row>", "<row><v>4.0</v><v>3.0</v></row>"])
+
+  def test_new_source(self):
+    output, rrd = self.transform([0, DataSource('c', GaugeDST, 3600), 1])
+    self.assertEqual([x.text.strip() for x in rrd.xpath("/rrd/ds/name")], ["a", "c", "b"])
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/ds[2]/*")], ["c", "GAUGE", "3600", "NaN", "NaN", "UNKN", "0.0000000000e+00", "0"])
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/rra/cdp_prep/ds/primary_value")], ["1.0", "NaN", "2.0"])
+    self.assertEqual(self.rows(output), ["<row><v>1.0</v><v>NaN</v><v>2.0</v></row>", "<row><v>3.0</v><v>NaN</v><v>4.0</v></row>"])
+
+  def test_rename(self):
+    # Sources are switched by renaming them, their data stays in place
+    output, rrd = self.transform([0, 1], renames = { 'a' : 'b', 'b' : 'a' })
+    self.assertEqual([x.text.strip() for x in rrd.xpath("/rrd/ds/name")], ["b", "a"])
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/ds/last_ds")], ["UNKN", "5"])
+    self.assertEqual(self.rows(output), ["<row><v>1.0</v><v>2.0</v></row>", "<row><v>3.0</v><v>4.0</v></row>"])
+
+  def test_new_archive(self):
+    output, rrd = self.transform([1, 0], archives = [RoundRobinArchive(MaxCF, 0.5, 12, 3)])
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/rra/cf")], ["AVERAGE", "MAX"])
+    self.assertEqual(rrd.xpath("/rrd/rra[2]/pdp_per_row")[0].text, "12")
+    self.assertEqual(rrd.xpath("/rrd/rra[2]/params/xff")[0].text, "0.5")
+    self.assertEqual([x.text for x in rrd.xpath("/rrd/rra[2]/cdp_prep/ds/primary_value")], ["NaN", "NaN"])
+    self.assertEqual(self.rows(output), [
+      "<row><v>2.0</v><v>1.0</v></row>",
+      "<row><v>4.0</v><v>3.0</v></row>",
+      "<row><v>NaN</v><v>NaN</v></row>",
+      "<row><v>NaN</v><v>NaN</v></row>",
+      "<row><v>NaN</v><v>NaN</v></row>",
+    ])
+
+class TablesParserTestCase(unittest.TestCase):
+  def parse(self, chunk_size):
+    parser = TablesParser()
+    for i in xrange(0, len(TXTINFO_TABLES), chunk_size):
+      parser.feed(TXTINFO_TABLES[i:i + chunk_size])
+
+    return parser.close()
+
+  def test_parse(self):
+    nodes, hna = self.parse(len(TXTINFO_TABLES))
+    self.assertEqual(set(nodes.keys()), set(["10.40.0.1", "10.40.0.2", "10.40.0.3"]))
+
+    # Link metrics are floats and links with infinite cost are skipped
+    self.assertEqual(nodes["10.40.0.1"].links, [OlsrLink("10.40.0.2", 1.0, 0.871, 1.148, 300.0)])
+    self.assertEqual(nodes["10.40.0.2"].links, [OlsrLink("10.40.0.1", 0.871, 1.0, 1.148, 300.0), OlsrLink("10.40.0.3", 0.75, 0.5, 2.667, 0.0)])
+    self.assertEqual(nodes["10.40.0.3"].links, [])
+    for link in nodes["10.40.0.2"].links:
+      for value in link[1:]:
+        self.assertTrue(isinstance(value, float))
+
+    # Nodes and their MID aliases are announced as host routes
+    self.assertEqual(hna["10.40.0.1"], ["10.40.0.1/32", "10.40.128.0/27", "172.16.0.1/32", "172.16.0.2/32"])
+    self.assertEqual(hna["10.40.0.2"], ["10.40.0.2/32", "0.0.0.0/0"])
+
+  def test_chunk_boundaries(self):
+    # Chunks may split lines at any position
+    expected = self.parse(len(TXTINFO_TABLES))
+    for chunk_size in xrange(1, 40):
+      nodes, hna = self.parse(chunk_size)
+      self.assertEqual(hna, expected[1])
+      self.assertEqual(dict([(ip, node.links) for ip, node in nodes.iteritems()]),
+        dict([(ip, node.links) for ip, node in expected[0].iteritems()]))
+
+class NodeSchedulerTestCase(unittest.TestCase):
+  def test_phase_spreading(self):
+    scheduler = NodeScheduler(interval = 300)
+    node_ips = ["10.50.%d.%d" % (i // 256, i % 256) for i in xrange(300)]
+    now = 3000000
+    scheduler.update(node_ips, now)
+
+    # Nodes are spread over the whole interval based on their phase
+    for node_ip in node_ips:
+      self.assertEqual(scheduler.due_at[node_ip] - now, scheduler.offset(node_ip))
+
+    windows = {}
+    for node_ip in node_ips:
+      windows[scheduler.offset(node_ip) // 30] = windows.get(scheduler.offset(node_ip) // 30, 0) + 1
+    self.assertEqual(len(windows), 10)
+    self.assertTrue(max(windows.values()) < 60)
+
+    # Nodes polled on time keep their phase
+    polled = []
+    for timestamp in xrange(now, now + 300):
+      polled.extend(scheduler.due(timestamp))
+    self.assertEqual(sorted(polled), sorted(node_ips))
+    for node_ip in node_ips:
+      self.assertEqual(scheduler.due_at[node_ip] - now - 300, scheduler.offset(node_ip))
+
+    # Nodes polled late also keep their phase unless they are very late
+    due = scheduler.due_at[node_ips[0]]
+    self.assertTrue(node_ips[0] in scheduler.due(due + 100))
+    self.assertEqual(scheduler.due_at[node_ips[0]], due + 300)
+
+  def test_fast_polls(self):
+    scheduler = NodeScheduler(interval = 300, fast_interval = 60, fast_polls = 2)
+    scheduler.update(["10.50.0.1"], 0)
+    due = scheduler.due_at["10.50.0.1"]
+    self.assertEqual(scheduler.due(due), ["10.50.0.1"])
+    scheduler.completed("10.50.0.1", NodeStatus.Up, due)
+    self.assertEqual(scheduler.due_at["10.50.0.1"], due + 300)
+
+    # A status change is followed by polls at the fast interval
+    due += 300
+    self.assertEqual(scheduler.due(due), ["10.50.0.1"])
+    scheduler.completed("10.50.0.1", NodeStatus.Down, due)
+    self.assertEqual(scheduler.due_at["10.50.0.1"], due + 60)
+    for i in xrange(2):
+      due = scheduler.due_at["10.50.0.1"]
+      self.assertEqual(scheduler.due(due), ["10.50.0.1"])
+      scheduler.completed("10.50.0.1", NodeStatus.Down, due)
+
+    self.assertEqual(scheduler.due_at["10.50.0.1"], due + 300)
+
+    # Nodes that appear after startup are polled right away at the fast interval
+    scheduler.update(["10.50.0.1", "10.50.0.2"], due)
+    self.assertEqual(scheduler.due(due), ["10.50.0.2"])
+    scheduler.completed("10.50.0.2", NodeStatus.Up, due)
+    self.assertEqual(scheduler.due_at["10.50.0.2"], due + 60)
+
+  def test_max_interval(self):
+    # Polls are never further apart than the maximum interval (below the RRD heartbeat)
+    scheduler = NodeScheduler(interval = 900, fast_interval = 600, max_interval = 570)
+    self.assertEqual(scheduler.interval, 570)
+    self.assertEqual(scheduler.fast_interval, 570)
+
+    scheduler.update(["10.50.0.1"], 0)
+    due = scheduler.due_at["10.50.0.1"]
+    self.assertTrue(due < 570)
+    scheduler.due(due)
+    scheduler.completed("10.50.0.1", NodeStatus.Up, due + 100)
+    self.assertEqual(scheduler.due_at["10.50.0.1"], due + 570)
+
+class HashRingTestCase(unittest.TestCase):
+  def setUp(self):
+    """
+    Prepares keys that are assigned to members.
+    """
+    self.keys = [str(i) for i in xrange(1000)]
+
+  def test_assignment(self):
+    ring = HashRing(["a", "b", "c"])
+    owners = dict([(key, ring.owner(key)) for key in self.keys])
+
+    # Assignment only depends on members and keys are distributed evenly
+    self.assertEqual(owners, dict([(key, HashRing(["c", "a", "b", "a"]).owner(key)) for key in self.keys]))
+    for member in ("a", "b", "c"):
+      self.assertTrue(owners.values().count(member) > 200)
+
+    self.assertEqual(HashRing([]).owner("1"), None)
+
+  def test_join_leave(self):
+    owners = dict([(key, HashRing(["a", "b", "c"]).owner(key)) for key in self.keys])
+
+    # Only keys taken over by a joining member change their owner
+    ring = HashRing(["a", "b", "c", "d"])
+    moved = [key for key in self.keys if ring.owner(key) != owners[key]]
+    self.assertTrue(moved)
+    self.assertEqual(set([ring.owner(key) for key in moved]), set(["d"]))
+
+    # Only keys of a leaving member change their owner
+    ring = HashRing(["a", "c"])
+    moved = [key for key in self.keys if ring.owner(key) != owners[key]]
+    self.assertEqual(set(moved), set([key for key in self.keys if owners[key] == "b"]))
+
+class ShardMembershipTestCase(unittest.TestCase):
+  def setUp(self):
+    """
+    Sets up monitor instances.
+    """
+    self.a = ShardMembership("test-shard-a", timeout = 90)
+    self.b = ShardMembership("test-shard-b", timeout = 90)
+
+  def tearDown(self):
+    """
+    Removes monitor instances.
+    """
+    MonitorInstance.objects.filter(name__startswith = "test-shard-").delete()
+
+  def test_heartbeat(self):
+    self.assertEqual(self.a.heartbeat(), (["test-shard-a"], True))
+    self.assertEqual(MonitorInstance.objects.get(name = "test-shard-a").pid, os.getpid())
+    self.assertEqual(self.a.heartbeat(), (["test-shard-a"], False))
+
+    self.assertEqual(self.b.heartbeat(), (["test-shard-a", "test-shard-b"], True))
+    self.assertEqual(self.a.heartbeat(), (["test-shard-a", "test-shard-b"], True))
+    self.assertEqual(self.a.heartbeat(), (["test-shard-a", "test-shard-b"], False))
+
+  def test_timeout(self):
+    self.a.heartbeat()
+    self.b.heartbeat()
+    self.a.heartbeat()
+
+    # Instances without recent heartbeats are considered dead
+    MonitorInstance.objects.filter(name = "test-shard-b").update(last_seen = datetime.now() - timedelta(seconds = 100))
+    self.assertEqual(self.a.heartbeat(), (["test-shard-a"], True))
+
+    # They are live again after their next heartbeat, with the same start time
+    started_at = MonitorInstance.objects.get(name = "test-shard-b").started_at
+    self.assertEqual(self.b.heartbeat(), (["test-shard-a", "test-shard-b"], False))
+    self.assertEqual(MonitorInstance.objects.get(name = "test-shard-b").started_at, started_at)
+    self.assertEqual(self.a.heartbeat(), (["test-shard-a", "test-shard-b"], True))
+
+  def test_leave(self):
+    self.a.heartbeat()
+    self.b.heartbeat()
+    self.a.heartbeat()
+
+    # Instances that leave are removed immediately
+    self.b.leave()
+    self.assertFalse(MonitorInstance.objects.filter(name = "test-shard-b").exists())
+    self.assertEqual(self.a.heartbeat(), (["test-shard-a"], True))
+
+class FetcherTestCase(unittest.TestCase):
+  def setUp(self):
+    """
+    Opens a local socket that requests are sent to.
+    """
+    self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.server.bind(("127.0.0.1", 0))
+    self.port = self.server.getsockname()[1]
+    self.callbacks = []
+    self.open = 0
+    self.max_open = 0
+    self.lock = threading.Lock()
+
+  def tearDown(self):
+    """
+    Closes the local socket.
+    """
+    self.server.close()
+
+  def serve(self, count, delay = 0):
+    """
+    Answers the given number of requests in the background, each one in
+    its own thread after a delay.
+    """
+    def respond(conn):
+      with self.lock:
+        self.open += 1
+        self.max_open = max(self.max_open, self.open)
+
+      try:
+        request = conn.recv(1024)
+        time.sleep(delay)
+        with self.lock:
+          self.open -= 1
+        conn.sendall("HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\n%s" % request.split(" ")[1])
+      finally:
+        conn.close()
+
+    def accept():
+      for i in xrange(count):
+        thread = threading.Thread(target = respond, args = (self.server.accept()[0],))
+        thread.daemon = True
+        thread.start()
+
+    thread = threading.Thread(target = accept)
+    thread.daemon = True
+    thread.start()
+
+  def callback(self, key, body):
+    self.callbacks.append((key, body))
+
+  def test_response(self):
+    self.server.listen(5)
+    self.serve(1)
+    fetcher = Fetcher(timeout = 5)
+    fetcher.add("a", "127.0.0.1", "/a", port = self.port, callback = self.callback)
+    self.assertEqual(fetcher.run(), { "a" : "/a" })
+    self.assertEqual(self.callbacks, [("a", "/a")])
+    self.assertEqual(fetcher.timeouts, 0)
+
+  def test_deadline(self):
+    # Connections are accepted, but requests are never answered
+    self.server.listen(5)
+    fetcher = Fetcher(timeout = 0.5, retries = 1)
+    fetcher.add("a", "127.0.0.1", "/a", port = self.port, callback = self.callback)
+    start = time.time()
+    self.assertEqual(fetcher.run(), { "a" : None })
+    self.assertTrue(time.time() - start < 1.5)
+    self.assertEqual(self.callbacks, [("a", None)])
+    self.assertEqual(fetcher.timeouts, 1)
+
+  def test_retry(self):
+    # The first connection is refused as the socket only starts listening afterwards
+    failures = []
+    test = self
+    class ListeningFetcher(Fetcher):
+      def request_failed(self, request, retry = True):
+        failures.append(request.key)
+        test.server.listen(5)
+        super(ListeningFetcher, self).request_failed(request, retry)
+
+    self.serve(1)
+    fetcher = ListeningFetcher(timeout = 5, retries = 1)
+    fetcher.add("a", "127.0.0.1", "/a", port = self.port, callback = self.callback)
+    self.assertEqual(fetcher.run(), { "a" : "/a" })
+    self.assertEqual(failures, ["a"])
+    self.assertEqual(self.callbacks, [("a", "/a")])
+
+  def test_concurrency(self):
+    self.server.listen(10)
+    self.serve(6, delay = 0.1)
+    fetcher = Fetcher(concurrency = 2, timeout = 5)
+    for i in xrange(6):
+      fetcher.add(i, "127.0.0.1", "/%d" % i, port = self.port)
+
+    self.assertEqual(fetcher.run(), dict([(i, "/%d" % i) for i in xrange(6)]))
+    self.assertEqual(self.max_open, 2)
+
+class HTTPPushReceiverTestCase(unittest.TestCase):
+  def setUp(self):
+    """
+    Starts a receiver on a free local port.
+    """
+    self.buffer = ReportBuffer(lambda data: { 'report' : data })
+    self.buffer.allow(["127.0.0.1"])
+    self.receiver = HTTPPushReceiver(self.buffer, ("127.0.0.1", 0), timeout = 1)
+    self.receiver.start()
+    self.port = self.receiver.server.server_address[1]
+
+  def tearDown(self):
+    """
+    Stops the receiver.
+    """
+    self.receiver.server.shutdown()
+    self.receiver.server.server_close()
+
+  def push(self, data):
+    conn = httplib.HTTPConnection("127.0.0.1", self.port, timeout = 5)
+    try:
+      conn.request("POST", "/", data)
+      return conn.getresponse().status
+    finally:
+      conn.close()
+
+  def test_stalled_connection(self):
+    # A connection that never sends its request does not block other nodes
+    stalled = socket.create_connection(("127.0.0.1", self.port))
+    try:
+      stalled.sendall("POST / HTTP/1.0\r\n")
+      start = time.time()
+      self.assertEqual(self.push("general.uuid: test"), 204)
+      self.assertTrue(time.time() - start < 1)
+      self.assertEqual(self.buffer.take(["127.0.0.1"]), { "127.0.0.1" : { 'report' : "general.uuid: test" } })
+
+      # It is closed after the timeout
+      stalled.settimeout(5)
+      self.assertEqual(stalled.recv(1024), "")
+    finally:
+      stalled.close()
+
+class ReportSchemaTestCase(unittest.TestCase):
+  def setUp(self):
+    """
+    Sets up a schema with exact and wildcard keys.
+    """
+    self.schema = ReportSchema({
+      'general.memfree' : safe_int_convert,
+      'wifi.signal' : safe_dbm_convert,
+      'nds.client*.up' : safe_int_convert,
+      'nds.client0.up' : lambda value: value.upper(),
+      'iface.*.down' : safe_int_convert,
+    })
+
+  def test_keys(self):
+    info = self.schema.parse("\n".join([
+      "general.memfree: 1024",
+      "general.uuid: abc",
+      "wifi.signal: 200",
+      "nds.client1.up: 7",
+      "nds.client1.mac: 00:11",
+      "nds.client0.up: x",
+      "nds.clients.up.total: 9",
+      "nds.down: 4",
+      "iface.wlan0.down: 12 ",
+    ]))
+
+    self.assertEqual(info['general'], { 'memfree' : 1024, 'uuid' : "abc" })
+    self.assertEqual(info['wifi'], { 'signal' : -56 })
+
+    # Wildcards only match a single segment and exact keys take precedence
+    self.assertEqual(info['nds'], {
+      'client1' : { 'up' : 7, 'mac' : "00:11" },
+      'client0' : { 'up' : "X" },
+      'clients' : { 'up' : { 'total' : "9" } },
+      'down' : "4",
+    })
+    self.assertEqual(info['iface'], { 'wlan0' : { 'down' : 12 } })
+
+  def test_bad_values(self):
+    # Values that cannot be converted are stored as None
+    info = self.schema.parse("general.memfree: lots\nwifi.signal:\nnds.client1.up: 1.5\n")
+    self.assertEqual(info, { 'general' : { 'memfree' : None }, 'wifi' : { 'signal' : None }, 'nds' : { 'client1' : { 'up' : None } } })
+
+    # Lines without a value make the whole report invalid
+    self.assertEqual(self.schema.parse("general.memfree: 1\ngeneral.uuid\n"), None)
+
+  def test_iterable(self):
+    report = "; comment\ngeneral.memfree: 1\nnds.client2.up: 3\n\ngeneral.uuid: ignored\n"
+    self.assertEqual(self.schema.parse(StringIO(report)), self.schema.parse(report))
+    self.assertEqual(self.schema.parse(StringIO(report)), { 'general' : { 'memfree' : 1 }, 'nds' : { 'client2' : { 'up' : 3 } } })
+
+  def test_max_keys(self):
+    # Forgetting compiled keys does not change results
+    schema = ReportSchema({ 'nds.client*.up' : safe_int_convert }, max_keys = 2)
+    report = "\n".join(["nds.client%d.up: %d" % (i, i) for i in xrange(5)])
+    for run in xrange(2):
+      self.assertEqual(schema.parse(report), { 'nds' : dict([("client%d" % i, { 'up' : i }) for i in xrange(5)]) })
+
+class ClientsTestCase(unittest.TestCase):
+  def setUp(self):
+    self.node = Node.objects.create(ip = "10.70.0.1", status = NodeStatus.Invalid, visible = True)
+    self.now = datetime.now().replace(microsecond = 0)
+
+  def tearDown(self):
+    Node.objects.filter(ip__startswith = "10.70.").delete()
+
+  def clients(self):
+    return dict([(c.ip, (c.uploaded, c.downloaded, c.last_update)) for c in APClient.objects.filter(node = self.node)])
+
+  def test_matcher(self):
+    subnets = [Subnet(subnet = subnet, cidr = cidr) for subnet, cidr in (("10.70.0.0", 16), ("10.70.1.128", 25), ("10.70.1.0", 24), ("2001:db8::", 32))]
+    matcher = SubnetMatcher(subnets)
+
+    # The most specific of overlapping subnets is matched
+    self.assertTrue(matcher.match("10.70.1.200") is subnets[1])
+    self.assertTrue(matcher.match("10.70.1.5") is subnets[2])
+    self.assertTrue(matcher.match("10.70.2.1") is subnets[0])
+    self.assertTrue(matcher.match("2001:db8::1") is subnets[3])
+
+    # Addresses outside of all subnets, of another IP version or invalid ones are not matched
+    self.assertEqual(matcher.match("10.71.0.1"), None)
+    self.assertEqual(matcher.match("::a46:105"), None)
+    self.assertEqual(matcher.match("not-an-ip"), None)
+    self.assertEqual(SubnetMatcher([]).match("10.70.1.5"), None)
+
+  def test_sync(self):
+    for ip, age in (("10.70.1.1", 1), ("10.70.1.2", 5), ("10.70.1.3", 20), ("10.70.1.4", None)):
+      APClient.objects.create(node = self.node, ip = ip, uploaded = 0, downloaded = 0, last_update = self.now - timedelta(minutes = age) if age else None)
+
+    pk = APClient.objects.get(ip = "10.70.1.1").pk
+
+    # Reported clients are updated or inserted (once for duplicates), stale ones are removed
+    new = sync_ap_clients(self.node, [
+      ("10.70.1.1", self.now, 10, 20),
+      ("10.70.1.5", self.now, 1, 2),
+      ("10.70.1.5", self.now, 3, 4),
+    ], self.now)
+    self.assertEqual(new, 1)
+    self.assertEqual(self.clients(), {
+      "10.70.1.1" : (10, 20, self.now),
+      "10.70.1.2" : (0, 0, self.now - timedelta(minutes = 5)),
+      "10.70.1.5" : (3, 4, self.now),
+    })
+    self.assertEqual(APClient.objects.get(ip = "10.70.1.1").pk, pk)
+
+    later = self.now + timedelta(minutes = 15)
+    new = sync_ap_clients(self.node, [("10.70.1.5", self.now, 5, 6), ("10.70.1.6", later, 7, 8)], later)
+    self.assertEqual(new, 1)
+    self.assertEqual(self.clients(), {
+      "10.70.1.5" : (5, 6, later),
+      "10.70.1.6" : (7, 8, later),
+    })
+
+class PackagesTestCase(unittest.TestCase):
+  def setUp(self):
+    self.nodes = [Node.objects.create(ip = "10.71.0.%d" % i, status = NodeStatus.Invalid, visible = True) for i in xrange(1, 20)]
+
+  def tearDown(self):
+    Node.objects.filter(ip__startswith = "10.71.").delete()
+
+  def packages(self, node):
+    return dict([(p.name, (p.pk, p.version, p.last_update)) for p in InstalledPackage.objects.filter(node = node)])
+
+  def test_sync(self):
+    node = self.nodes[0]
+    sync_installed_packages(node, { 'a' : "1", 'b' : "1", 'c' : "1" })
+    before = self.packages(node)
+    self.assertEqual(sorted([(name, version) for name, (pk, version, last_update) in before.items()]), [('a', "1"), ('b', "1"), ('c', "1")])
+
+    # Removed packages are deleted, changed ones updated in place and new ones inserted
+    sync_installed_packages(node, { 'a' : "1", 'b' : "2", 'd' : "1" })
+    after = self.packages(node)
+    self.assertEqual(sorted(after.keys()), ['a', 'b', 'd'])
+    self.assertEqual(after['a'], before['a'])
+    self.assertEqual(after['b'][:2], (before['b'][0], "2"))
+    self.assertTrue(after['b'][2] >= before['b'][2])
+    self.assertEqual(after['d'][1], "1")
+
+  def test_due(self):
+    schedule = PackageRefreshSchedule(interval = 3600, poll_interval = 300)
+    # Choose a cycle in the slot of the first node
+    timestamp = 1299999600 + 300 * schedule.slot(self.nodes[0].ip)
+    in_slot = [n for n in self.nodes if schedule.slot(n.ip) == schedule.slot(self.nodes[0].ip)]
+    out_slot = [n for n in self.nodes if n not in in_slot]
+
+    now = datetime.fromtimestamp(timestamp)
+    for node, age in ((in_slot[0], 10), (out_slot[0], 10), (out_slot[2], 3600 + 300 + 10)):
+      InstalledPackage.objects.create(node = node, name = "a", version = "1", last_update = now - timedelta(minutes = age // 60, seconds = age % 60))
+
+    # Nodes in the current slot, nodes without packages and overdue nodes are refreshed
+    node_ips = [in_slot[0].ip, out_slot[0].ip, out_slot[1].ip, out_slot[2].ip]
+    self.assertEqual(schedule.due(node_ips, timestamp), [in_slot[0].ip, out_slot[1].ip, out_slot[2].ip])
+    self.assertEqual(schedule.due([], timestamp), [])
+
+class ReportStateTestCase(unittest.TestCase):
+  class Warnings(object):
+    def __init__(self):
+      self.items = []
+
+    def add(self, node, code, details = ''):
+      self.items.append((node, code, details))
+
+  def setUp(self):
+    self.calls = []
+
+  def check(self, raise_warning):
+    self.calls.append(1)
+    raise_warning(WarningCode.NoRedundancy, "check %d" % len(self.calls))
+    return len(self.calls)
+
+  def cycle(self, previous, inputs, now, **kwargs):
+    """
+    Runs the check in a new cycle and returns its result, raised warnings
+    and state items.
+    """
+    state = ReportState(previous, max_age = 3600)
+    state.now = now
+    warnings = self.Warnings()
+    result = state.run('check', inputs, warnings, "node", self.check, **kwargs)
+    return result, warnings.items, state.items()
+
+  def test_carry_forward(self):
+    result, warnings, items = self.cycle(None, { 'a' : 1 }, 1000)
+    self.assertEqual((result, warnings, len(self.calls)), (1, [("node", WarningCode.NoRedundancy, "check 1")], 1))
+
+    # Equal inputs reuse the result and warnings of the previous check
+    result, warnings, items = self.cycle(items, { 'a' : 1 }, 1100)
+    self.assertEqual((result, warnings, len(self.calls)), (1, [("node", WarningCode.NoRedundancy, "check 1")], 1))
+
+    # Unchanged inputs reuse them as well
+    result, warnings, items = self.cycle(items, None, 1200)
+    self.assertEqual((result, warnings, len(self.calls)), (1, [("node", WarningCode.NoRedundancy, "check 1")], 1))
+
+    # Changed inputs cause the check to be performed again
+    result, warnings, items = self.cycle(items, { 'a' : 2 }, 1300)
+    self.assertEqual((result, warnings, len(self.calls)), (2, [("node", WarningCode.NoRedundancy, "check 2")], 2))
+
+  def test_expiry(self):
+    result, warnings, items = self.cycle(None, { 'a' : 1 }, 1000)
+
+    # Checks are performed again once their entries expire
+    self.assertEqual(self.cycle(items, { 'a' : 1 }, 4599)[0], 1)
+    result, warnings, items = self.cycle(items, { 'a' : 1 }, 4600, max_age = 10)
+    self.assertEqual(result, 2)
+
+    # Expiry can be overridden per check
+    self.assertEqual(self.cycle(items, None, 4609)[0], 2)
+    result, warnings, items = self.cycle(items, None, 4610)
+    self.assertEqual((result, warnings), (3, [("node", WarningCode.NoRedundancy, "check 3")]))
+
+  def test_items(self):
+    result, warnings, items = self.cycle(None, { 'a' : 1 }, 1000)
+
+    # Entries of checks that are not performed are kept until they expire
+    state = ReportState(items, max_age = 3600)
+    state.now = 4599
+    self.assertEqual(state.items(), items)
+    state.now = 4600
+    self.assertEqual(state.items(), {})
+
+class MetricsTestCase(unittest.TestCase):
+  def test_render(self):
+    metrics = Metrics()
+    metrics.describe('test_nodes', 'gauge', 'Number of nodes.')
+    metrics.describe('test_cycles', 'counter', 'Number of cycles.')
+    metrics.describe('test_duration', 'histogram', 'Cycle duration.', buckets = [10, 1])
+    metrics.set('test_nodes', 3, status = 'up')
+    metrics.set('test_nodes', 1, status = 'say "hi"\\\n')
+    metrics.inc('test_cycles')
+    metrics.inc('test_cycles', 2)
+    for value in (0.5, 1, 5, 20):
+      metrics.observe('test_duration', value, shard = 'a')
+
+    self.assertEquals(metrics.render().split('\n'), [
+      '# HELP test_nodes Number of nodes.',
+      '# TYPE test_nodes gauge',
+      'test_nodes{status="say \\"hi\\"\\\\\\n"} 1.0',
+      'test_nodes{status="up"} 3.0',
+      '# HELP test_cycles Number of cycles.',
+      '# TYPE test_cycles counter',
+      'test_cycles 3.0',
+      '# HELP test_duration Cycle duration.',
+      '# TYPE test_duration histogram',
+      'test_duration_bucket{shard="a",le="1.0"} 2',
+      'test_duration_bucket{shard="a",le="10.0"} 3',
+      'test_duration_bucket{shard="a",le="+Inf"} 4',
+      'test_duration_sum{shard="a"} 26.5',
+      'test_duration_count{shard="a"} 4',
+      '',
+    ])
+    self.assertEquals(metrics.get('test_duration', shard = 'a'), (26.5, 4))
+
+  def test_query_counter(self):
+    debug_cursor = connection.use_debug_cursor
+    queries = QueryCounter()
+    queries.start()
+    try:
+      list(Node.objects.all()[:1])
+      raise ValueError
+    except ValueError:
+      pass
+    finally:
+      self.assertEquals(queries.stop(), 1)
+
+    self.assertEquals(connection.use_debug_cursor, debug_cursor)
+    self.assertEquals(queries.stop(), 1)
+    self.assertEquals(connection.use_debug_cursor, debug_cursor)
+    self.assertEquals(QueryCounter(enabled = False).stop(), None)
+
+class PrefixTrieTestCase(unittest.TestCase):
+  def test_lookups(self):
+    trie = PrefixTrie()
+    for prefix in ("10.0.0.0/8", "10.14.0.0/16", "10.14.1.0/24", "192.168.0.0/24", "2001:db8::/32"):
+      trie.add(prefix, prefix)
+
+    self.assertEqual(set(trie.contains("10.14.1.0/24")), set(["10.0.0.0/8", "10.14.0.0/16", "10.14.1.0/24"]))
+    self.assertEqual(set(trie.contained_in("10.14.0.0/16")), set(["10.14.0.0/16", "10.14.1.0/24"]))
+    self.assertEqual(set(trie.conflicts("10.14.0.0/15")), set(["10.0.0.0/8", "10.14.0.0/16", "10.14.1.0/24"]))
+    self.assertEqual(trie.conflicts("172.16.0.0/12"), [])
+    self.assertEqual(trie.contains("2001:db8:1::/48"), ["2001:db8::/32"])
@@ -254,6 +254,27 @@ MONITOR_GRAPH_WORKERS = 5
 MONITOR_POLL_INTERVAL = 300
 MONITOR_OLSR_HOST = '127.0.0.1' # A host with OLSR txt-info plugin running
 MONITOR_LOGFILE = os.path.join(MONITOR_WORKDIR, 'monitor.log')
+MONITOR_HTTP_CONCURRENCY = 50 # Maximum number of concurrent HTTP connections when fetching node data
+MONITOR_HTTP_TIMEOUT = 15 # Per-node HTTP fetch timeout (in seconds)
+MONITOR_HTTP_RETRIES = 1 # Number of retries for failed HTTP fetches
+MONITOR_PING_CHUNK = 50 # Number of nodes pinged together, nodes are processed as soon as their chunk is done
+MONITOR_PING_RATE = 200 # Total ICMP ECHO send rate (in packets per second) shared by all probe packet sizes
+MONITOR_OUTBOX_INTERVAL = 60 # Maximum delay (in seconds) before queued event notifications are sent
+MONITOR_RRDCACHED_ADDRESS = None # Address of a running rrdcached (like unix:/var/run/rrdcached.sock) to route RRD updates through
+MONITOR_LINK_THRESHOLD = 0.05 # Minimum change of link quality (or relative change of ETX) that is written to the database
+MONITOR_WORKER_CHUNK = 10 # Number of nodes dispatched to a worker process together (and processed in one transaction)
+MONITOR_WORKER_MAX_TASKS = 100 # Number of chunks after which a worker process is replaced (None to never replace workers)
+MONITOR_REPORT_STATE_MAX_AGE = 3600 # Maximum number of seconds that results of checks on unchanged node reports are reused
+MONITOR_FAST_POLL_INTERVAL = 60 # Interval (in seconds) at which newly seen and flapping nodes are polled for a few times
+MONITOR_SCHEDULER_TICK = 30 # Interval (in seconds) at which nodes that are due are polled, routing tables are synchronized every MONITOR_POLL_INTERVAL
+MONITOR_METRICS_ADDRESS = None # Address (like ('127.0.0.1', 9110)) on which monitor metrics are served in Prometheus text format
+MONITOR_INSTANCE_TIMEOUT = 90 # Number of seconds after which a sharded monitor instance that stopped sending heartbeats is replaced by the others
+MONITOR_PUSH_HTTP_ADDRESS = None # Address (like ('0.0.0.0', 9120)) on which reports pushed by nodes with HTTP POST are received
+# WARNING: Reports pushed over UDP are NOT authenticated. Their source address can be
+# spoofed, so anyone able to send packets to the monitor can push fake reports in the
+# name of any node. Keep this disabled unless only trusted hosts can reach the address.
+MONITOR_PUSH_UDP_ADDRESS = None # Address (like ('0.0.0.0', 9120)) on which reports pushed by nodes as UDP datagrams are received
+MONITOR_PUSH_MAX_AGE = 300 # Maximum age (in seconds) of a pushed report that is used instead of fetching node data
 
 # Data archive configuration
 DATA_ARCHIVE_ENABLED = False
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+#
+# Benchmark of the OLSR txtinfo parser against the original implementation
+# that split the complete response into lines and stored links as strings.
+# Run with:
+#
+#   python benchmarks/olsr_parser.py
+#
+import os
+import sys
+import random
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib import wifi_utils
+
+class ReferenceOlsrNode(object):
+  ip = None
+  links = None
+
+  def __init__(self):
+    self.links = []
+
+def reference_create_node(ip, nodes, hna):
+  if not nodes.has_key(ip):
+    node = ReferenceOlsrNode()
+    node.ip = ip
+    nodes[ip] = node
+    l = hna.setdefault(ip, [])
+    l.append('%s/32' % ip)
+  else:
+    node = nodes[ip]
+
+  return node
+
+def reference_parse_tables(data):
+  """
+  The original parser, kept here for comparison.
+  """
+  isTable = False
+  isTableHead = False
+  currentTable = ''
+  nodes = {}
+  hna = {}
+
+  for line in data.splitlines():
+    line = line.strip()
+    if line[0:6] == 'Table:' and line[7:] in ('Topology', 'HNA', 'MID'):
+      isTable = True
+      isTableHead = True
+      currentTable = line[7:]
+      continue
+
+    if isTable and isTableHead:
+      isTableHead = False
+      continue
+
+    if isTable and not line:
+      isTable = False
+      currentTable = ''
+      continue
+
+    if currentTable == 'Topology':
+      try:
+        dstIp, srcIp, LQ, ILQ, ETX, vtime = line.split('\t')
+      except ValueError:
+        dstIp, srcIp, LQ, ILQ, ETX = line.split('\t')
+        vtime = 0.0
+
+      try:
+        if not float(ETX):
+          continue
+      except ValueError:
+        continue
+
+      srcNode = reference_create_node(srcIp, nodes, hna)
+      reference_create_node(dstIp, nodes, hna)
+      srcNode.links.append((dstIp, LQ, ILQ, ETX, vtime))
+    elif currentTable == 'HNA':
+      network, gwIp = line.split('\t')[0:2]
+      network, cidr = network.split('/')
+      node = hna.setdefault(gwIp, [])
+      node.append('%s/%s' % (network, cidr))
+    elif currentTable == 'MID':
+      ip, alias = line.split('\t')[0:2]
+      alias = alias.split(';')
+      for x in alias:
+        l = hna.setdefault(ip, [])
+        l.append('%s/32' % x)
+
+  return nodes, hna
+
+def generate_tables(node_count, degree):
+  """
+  Generates synthetic txtinfo output for a random mesh.
+
+  @param node_count: Number of nodes
+  @param degree: Average number of links per node
+  """
+  rnd = random.Random(42)
+  ips = ['10.%d.%d.1' % (i // 256, i % 256) for i in xrange(node_count)]
+  out = ['Table: Topology', 'Dest. IP\tLast hop IP\tLQ\tNLQ\tCost\tVTime']
+  for src in ips:
+    for dst in rnd.sample(ips, degree):
+      if dst != src:
+        out.append('%s\t%s\t%.3f\t%.3f\t%.3f\t%.3f' % (dst, src, rnd.random(), rnd.random(), 1 + rnd.random() * 5, 300.0))
+
+  out += ['', 'Table: HNA', 'Destination\tGateway']
+  for i, ip in enumerate(ips):
+    out.append('10.%d.%d.0/24\t%s' % (128 + i // 256, i % 256, ip))
+
+  out += ['', 'Table: MID', 'IP address\tAliases']
+  for i, ip in enumerate(ips[::10]):
+    out.append('%s\t172.16.%d.%d' % (ip, i // 256, i % 256))
+
+  return '\n'.join(out) + '\n\n'
+
+def reference_parse_typed(data):
+  """
+  The original parser followed by float conversions that consumers had
+  to perform on link metrics.
+  """
+  nodes, hna = reference_parse_tables(data)
+  for node in nodes.itervalues():
+    for dst, lq, ilq, etx, vtime in node.links:
+      float(lq), float(ilq), float(etx), float(vtime)
+
+  return nodes, hna
+
+def retained_size(nodes):
+  """
+  Returns the approximate number of bytes retained by link records.
+  """
+  seen = set()
+  total = 0
+  for node in nodes.itervalues():
+    for obj in [node, node.links] + node.links:
+      total += sys.getsizeof(obj)
+
+    for link in node.links:
+      for value in link:
+        if id(value) not in seen:
+          seen.add(id(value))
+          total += sys.getsizeof(value)
+
+  return total
+
+def feed_chunked(data):
+  parser = wifi_utils.TablesParser()
+  for i in xrange(0, len(data), wifi_utils.READ_CHUNK_SIZE):
+    parser.feed(data[i:i + wifi_utils.READ_CHUNK_SIZE])
+
+  return parser.close()
+
+def measure(function, data, repeat):
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    result = function(data)
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+
+  return best, result
+
+if __name__ == '__main__':
+  parser = OptionParser()
+  parser.add_option('--nodes', dest = 'nodes', type = 'int', default = 2000, help = 'Number of simulated nodes')
+  parser.add_option('--degree', dest = 'degree', type = 'int', default = 8, help = 'Average number of links per node')
+  parser.add_option('--repeat', dest = 'repeat', type = 'int', default = 5, help = 'Number of repetitions')
+  options, args = parser.parse_args()
+
+  data = generate_tables(options.nodes, options.degree)
+  print "Routing tables: %d bytes" % len(data)
+
+  ref_time, (ref_nodes, ref_hna) = measure(reference_parse_tables, data, options.repeat)
+  typed_time = measure(reference_parse_typed, data, options.repeat)[0]
+  new_time, (nodes, hna) = measure(feed_chunked, data, options.repeat)
+
+  # Both parsers must produce the same topology
+  assert sorted(nodes.keys()) == sorted(ref_nodes.keys())
+  assert hna == ref_hna
+  for ip, node in nodes.iteritems():
+    assert [(l.dst, l.lq, l.ilq, l.etx, l.vtime) for l in node.links] == \
+      [(d, float(lq), float(ilq), float(etx), float(vtime)) for d, lq, ilq, etx, vtime in ref_nodes[ip].links]
+
+  print "Reference parser:                   %.3f sec, %d bytes retained by links" % (ref_time, retained_size(ref_nodes))
+  print "Reference parser with conversions:  %.3f sec" % typed_time
+  print "Streaming parser:                   %.3f sec, %d bytes retained by links" % (new_time, retained_size(nodes))
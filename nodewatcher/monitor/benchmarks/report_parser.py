@@ -0,0 +1,132 @@
+#!/usr/bin/python
+#
+# Benchmark of nodewatcher report parsing with the report schema against the
+# original implementation that kept all values as strings. Reports captured
+# for the simulator (simulator/data/nodes/*.txt) are used when available,
+# otherwise reports are generated by a synthetic mesh. Run with:
+#
+#   python benchmarks/report_parser.py
+#
+import glob
+import os
+import sys
+import time
+from optparse import OptionParser
+
+MONITOR_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, MONITOR_DIR)
+from lib.report_schema import NODEWATCHER_SCHEMA, safe_int_convert, safe_float_convert, safe_loadavg_convert, safe_uptime_convert, safe_date_convert, safe_dbm_convert
+from simulator.mesh import SyntheticMesh
+
+def legacy_parse(data):
+  """
+  Parses a report the way it was parsed before the schema was introduced,
+  all values are kept as strings.
+  """
+  try:
+    info = {}
+    for line in data.split('\n'):
+      if not line:
+        break
+
+      if line[0] == ';':
+        continue
+
+      key, value = line.split(':', 1)
+      value = value.strip()
+      key = key.split('.')
+
+      d = info
+      for part in key[:-1]:
+        d = d.setdefault(part, {})
+
+      d[key[-1]] = value
+  except:
+    return None
+
+  return info
+
+def legacy_convert(info):
+  """
+  Performs the conversions that node processing used to perform on
+  string values of a report.
+  """
+  general = info.get('general', {})
+  wifi = info.get('wifi', {})
+  safe_date_convert(general.get('local_time'))
+  safe_uptime_convert(general.get('uptime'))
+  safe_loadavg_convert(general.get('loadavg'))
+  for key in ('memfree', 'buffers', 'cached'):
+    safe_int_convert(general.get(key))
+  for key in ('mcast_rate', 'errors', 'cells', 'rts', 'frag', 'bitrate'):
+    safe_int_convert(wifi.get(key))
+  for key in ('signal', 'noise'):
+    safe_dbm_convert(wifi.get(key))
+
+  safe_int_convert(info.get('net', {}).get('losses'))
+  for cid, client in info.get('nds', {}).iteritems():
+    if cid.startswith('client'):
+      safe_date_convert(client['added_at'])
+      safe_int_convert(client['up'])
+      safe_int_convert(client['down'])
+
+  for key, value in info.get('environment', {}).iteritems():
+    if key.startswith('sensor'):
+      safe_float_convert(value.get('temp'))
+
+  return info
+
+def load_reports(count, seed):
+  """
+  Returns captured reports or reports of a synthetic mesh.
+
+  @param count: Number of nodes of the synthetic mesh
+  @param seed: Random seed of the synthetic mesh
+  """
+  reports = []
+  for filename in sorted(glob.glob(os.path.join(MONITOR_DIR, "simulator", "data", "nodes", "*.txt"))):
+    f = open(filename)
+    try:
+      reports.append(f.read())
+    finally:
+      f.close()
+
+  if reports:
+    return reports, "captured"
+
+  mesh = SyntheticMesh(count, seed = seed)
+  reports = [mesh.report(node.ip) for node in mesh.nodes]
+  return [report for report in reports if report is not None], "synthetic"
+
+def measure(parse, reports, repeat):
+  """
+  Returns the best time of parsing all reports.
+  """
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    for report in reports:
+      parse(report)
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+
+  return best
+
+if __name__ == '__main__':
+  parser = OptionParser()
+  parser.add_option('--reports', dest = 'reports', help = 'Number of synthetic reports when no captures are available', type = 'int', default = 1000)
+  parser.add_option('--seed', dest = 'seed', help = 'Random seed of the synthetic mesh', type = 'int', default = 0)
+  parser.add_option('--repeat', dest = 'repeat', help = 'Number of repetitions (the best one is reported)', type = 'int', default = 5)
+  options, args = parser.parse_args()
+
+  reports, source = load_reports(options.reports, options.seed)
+  lines = sum([report.count('\n') for report in reports])
+  print ">>> Parsing %d %s reports (%d lines), best of %d runs:" % (len(reports), source, lines, options.repeat)
+
+  for name, parse in (
+    ("legacy (strings only)", legacy_parse),
+    ("legacy + conversions", lambda report: legacy_convert(legacy_parse(report))),
+    ("schema", NODEWATCHER_SCHEMA.parse),
+  ):
+    duration = measure(parse, reports, options.repeat)
+    print "  > %-22s %.3f sec, %.1f us per report, %.2f us per line" % (name, duration, 1e6 * duration / len(reports), 1e6 * duration / max(1, lines))
@@ -0,0 +1,147 @@
+import json
+import resource
+import time
+
+from lib.pipeline import StageTimer
+from lib.metrics import QueryCounter
+
+class Benchmark(object):
+  """
+  Measures monitor cycles. For each cycle the wall time, stage durations,
+  number of database queries (of the main process and of node
+  processing, which may happen in worker processes), RRD updates and
+  memory usage are recorded. Results can be saved and compared against
+  a baseline of an earlier run.
+  """
+  def __init__(self, metrics, parameters = None):
+    """
+    Class constructor.
+
+    @param metrics: Metrics instance the monitor records node statistics in
+    @param parameters: A dictionary of benchmark parameters (stored with
+      results, so runs with different parameters are not compared)
+    """
+    self.metrics = metrics
+    self.parameters = parameters or {}
+    self.cycles = []
+
+  def __snapshot(self):
+    """
+    Returns current values of metrics that are recorded per node.
+    """
+    return {
+      'node_queries' : self.metrics.get('nodewatcher_monitor_node_queries')[0],
+      'nodes' : self.metrics.get('nodewatcher_monitor_node_processing_seconds')[1],
+      'rrd_updates' : self.metrics.get('nodewatcher_monitor_rrd_updates_total'),
+      'rrd_seconds' : self.metrics.get('nodewatcher_monitor_rrd_update_seconds_total'),
+    }
+
+  def run(self, cycle):
+    """
+    Performs and measures a single cycle.
+
+    @param cycle: A callable that performs the cycle, it receives a
+      StageTimer instance
+    @return: A dictionary of measurements
+    """
+    timer = StageTimer()
+    before = self.__snapshot()
+    queries = QueryCounter()
+    queries.start()
+    start = time.time()
+    try:
+      cycle(timer)
+    finally:
+      wall = time.time() - start
+      main_queries = queries.stop()
+
+    after = self.__snapshot()
+    worker_rss = self.metrics.values('nodewatcher_monitor_worker_rss_bytes').values()
+    record = {
+      'wall' : wall,
+      'nodes' : after['nodes'] - before['nodes'],
+      'queries' : main_queries + int(after['node_queries'] - before['node_queries']),
+      'rrd_updates' : int(after['rrd_updates'] - before['rrd_updates']),
+      'rrd_seconds' : after['rrd_seconds'] - before['rrd_seconds'],
+      'peak_rss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+      'worker_rss' : max(worker_rss) if worker_rss else 0,
+      'stages' : dict(timer.durations),
+    }
+    self.cycles.append(record)
+    return record
+
+  def format_cycle(self, record):
+    """
+    Returns a single line description of measurements of a cycle.
+    """
+    return "%.2f sec, %d nodes, %d queries, %d RRD updates (%.2f sec), peak RSS %.1f MB, worker RSS %.1f MB, slowest: %s" % (
+      record['wall'],
+      record['nodes'],
+      record['queries'],
+      record['rrd_updates'],
+      record['rrd_seconds'],
+      record['peak_rss'] / 1048576.0,
+      record['worker_rss'] / 1048576.0,
+      ", ".join(["%s (%.2f sec)" % x for x in sorted(record['stages'].items(), key = lambda x: x[1], reverse = True)[:3]])
+    )
+
+  def summary(self):
+    """
+    Returns median measurements of all cycles except the first one, which
+    also includes creation of database entries for new nodes and graphs.
+    When only a single cycle has been measured, it is used.
+    """
+    cycles = self.cycles[1:] or self.cycles
+    if not cycles:
+      return {}
+
+    def median(values):
+      values = sorted(values)
+      return values[len(values) // 2]
+
+    summary = {}
+    for key in ('wall', 'nodes', 'queries', 'rrd_updates', 'rrd_seconds', 'worker_rss'):
+      summary[key] = median([record[key] for record in cycles])
+
+    summary['peak_rss'] = max([record['peak_rss'] for record in self.cycles])
+    return summary
+
+  def save(self, filename):
+    """
+    Saves benchmark results to a file.
+
+    @param filename: Output filename
+    """
+    f = open(filename, 'w')
+    try:
+      json.dump({ 'parameters' : self.parameters, 'cycles' : self.cycles, 'summary' : self.summary() }, f, indent = 2)
+    finally:
+      f.close()
+
+  def compare(self, filename):
+    """
+    Compares results against a baseline saved by an earlier run.
+
+    @param filename: Baseline filename
+    @return: A list of lines describing differences
+    """
+    f = open(filename)
+    try:
+      baseline = json.load(f)
+    finally:
+      f.close()
+
+    lines = []
+    if baseline.get('parameters') != self.parameters:
+      lines.append("Baseline was measured with different parameters: %s" % baseline.get('parameters'))
+
+    summary = self.summary()
+    for key, value in sorted(summary.items()):
+      old = baseline.get('summary', {}).get(key)
+      if not old:
+        lines.append("%s: %s (no baseline)" % (key, value))
+        continue
+
+      lines.append("%s: %s (baseline %s, %+.1f%%)" % (key, value, old, 100.0 * (value - old) / old))
+
+    return lines
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from frontend.nodes.models import APClient
+from frontend.nodes.bulk import bulk_update, bulk_insert, bulk_delete
+from lib import ipcalc
+
+# Clients that have not been reported for this long are removed
+CLIENT_EXPIRY = timedelta(minutes = 11)
+
+class SubnetMatcher(object):
+  """
+  Matches IP addresses to subnets using integer range checks instead of
+  issuing a query per address.
+  """
+  def __init__(self, subnets):
+    """
+    Class constructor.
+
+    @param subnets: An iterable of Subnet instances
+    """
+    self.ranges = []
+    for subnet in subnets:
+      network = ipcalc.Network(subnet.subnet, subnet.cidr)
+      self.ranges.append((network.version(), long(network.network()), long(network.broadcast()), subnet))
+
+    # Prefer the most specific subnet when subnets overlap
+    self.ranges.sort(key = lambda x: x[2] - x[1])
+
+  def match(self, ip):
+    """
+    Returns the subnet that contains the given address.
+
+    @param ip: IP address
+    @return: A Subnet instance or None when no subnet matches
+    """
+    try:
+      address = ipcalc.IP(ip)
+    except (ValueError, AssertionError):
+      return None
+
+    version = address.version()
+    value = long(address)
+    for subnet_version, first, last, subnet in self.ranges:
+      if subnet_version == version and first <= value <= last:
+        return subnet
+
+    return None
+
+def sync_ap_clients(node, clients, timestamp):
+  """
+  Stores clients reported by a node's captive portal. Existing clients
+  are loaded with a single query, new clients are inserted and existing
+  ones updated in bulk. Clients that have not been reported for a while
+  are removed in the same pass.
+
+  @param node: Node instance
+  @param clients: A list of (ip, connected_at, uploaded, downloaded) tuples
+  @param timestamp: Current datetime
+  @return: Number of new clients
+  """
+  existing = {}
+  for client in APClient.objects.filter(node = node):
+    existing.setdefault(client.ip, []).append(client)
+
+  changed = []
+  new_clients = []
+  reported = {}
+  for ip, connected_at, uploaded, downloaded in clients:
+    c = reported.get(ip)
+    if c is None:
+      if existing.get(ip):
+        c = existing[ip].pop()
+        changed.append((c, ['connected_at', 'uploaded', 'downloaded', 'last_update']))
+      else:
+        c = APClient(node = node, ip = ip)
+        new_clients.append(c)
+
+      reported[ip] = c
+
+    c.connected_at = connected_at
+    c.uploaded = uploaded
+    c.downloaded = downloaded
+    c.last_update = timestamp
+
+  expire_before = timestamp - CLIENT_EXPIRY
+  stale = [client.pk for entries in existing.values() for client in entries if client.last_update is None or client.last_update < expire_before]
+
+  bulk_delete(APClient, stale)
+  bulk_update(changed)
+  bulk_insert(APClient, new_clients)
+  return len(new_clients)
@@ -0,0 +1,213 @@
+import asyncore
+import socket
+import time
+from collections import deque
+
+class HttpRequest(asyncore.dispatcher):
+  """
+  A single non-blocking HTTP/1.0 GET request.
+  """
+  def __init__(self, fetcher, key, host, path, port, map):
+    """
+    Class constructor.
+
+    @param fetcher: Fetcher instance that owns this request
+    @param key: Request identifier
+    @param host: Destination host
+    @param path: Request path
+    @param port: Destination port
+    @param map: Asyncore socket map
+    """
+    asyncore.dispatcher.__init__(self, map = map)
+    self.fetcher = fetcher
+    self.key = key
+    self.done = False
+    self.address = (host, port)
+    self.outbuf = "GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n" % (path, host)
+    self.inbuf = []
+    self.deadline = None
+
+  def start(self, deadline):
+    """
+    Opens a non-blocking connection to the destination host.
+
+    @param deadline: UNIX timestamp after which the request is aborted
+    """
+    self.deadline = deadline
+    self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.connect(self.address)
+
+  def writable(self):
+    return not self.connected or len(self.outbuf) > 0
+
+  def handle_connect(self):
+    pass
+
+  def handle_write(self):
+    sent = self.send(self.outbuf)
+    self.outbuf = self.outbuf[sent:]
+
+  def handle_read(self):
+    data = self.recv(8192)
+    if data:
+      self.inbuf.append(data)
+
+  def handle_close(self):
+    self.finish()
+    if not self.inbuf:
+      # Connection has been closed before any data was received
+      self.fetcher.request_failed(self)
+      return
+
+    # Split response headers from the body and check the status code
+    try:
+      headers, body = "".join(self.inbuf).split("\r\n\r\n", 1)
+      status = int(headers.split("\r\n", 1)[0].split()[1])
+    except (ValueError, IndexError):
+      self.fetcher.request_failed(self, retry = False)
+      return
+
+    if status < 200 or status > 299:
+      self.fetcher.request_failed(self, retry = False)
+    else:
+      self.fetcher.request_completed(self, body)
+
+  def handle_expt(self):
+    self.handle_error()
+
+  def handle_error(self):
+    self.finish()
+    self.fetcher.request_failed(self)
+
+  def expire(self):
+    """
+    Aborts this request because its deadline has passed.
+    """
+    self.finish()
+    self.fetcher.request_failed(self)
+
+  def finish(self):
+    """
+    Closes the underlying socket.
+    """
+    self.done = True
+    self.close()
+
+class Fetcher(object):
+  """
+  A non-blocking HTTP client that fetches many URLs concurrently. The
+  number of simultaneously open connections is capped and every host
+  gets its own deadline, so unreachable hosts only cost one timeout
+  that runs in parallel with all other requests. The deadline starts with
+  the first attempt and covers all retries of a request, so a host never
+  takes longer than a single timeout.
+  """
+  def __init__(self, concurrency = 50, timeout = 15, retries = 1):
+    """
+    Class constructor.
+
+    @param concurrency: Maximum number of concurrent connections
+    @param timeout: Per-request timeout in seconds (including retries)
+    @param retries: Number of retries for failed requests that fail
+      before their deadline
+    """
+    self.concurrency = concurrency
+    self.timeout = timeout
+    self.retries = retries
+    self.results = {}
+    self.timeouts = 0
+    self.__map = {}
+    self.__pending = deque()
+    self.__active = {}
+    self.__attempts = {}
+    self.__deadlines = {}
+    self.__requests = {}
+
+  def add(self, key, host, path, port = 80, callback = None):
+    """
+    Queues a new request.
+
+    @param key: Unique request identifier under which the result is stored
+    @param host: Destination host
+    @param path: Request path
+    @param port: Destination port
+    @param callback: Optional callable invoked with (key, body) on completion,
+      body is None when the request has failed
+    """
+    self.__requests[key] = (host, path, port, callback)
+    self.__attempts[key] = 0
+    self.__pending.append(key)
+
+  def run(self):
+    """
+    Performs all queued requests and blocks until all of them have either
+    completed or failed.
+
+    @return: A dictionary of response bodies (None for failed requests)
+    """
+    while self.__pending or self.__active:
+      # Start new connections while below the concurrency limit
+      while self.__pending and len(self.__active) < self.concurrency:
+        self.__start(self.__pending.popleft())
+
+      # Expire requests that have passed their deadline
+      now = time.time()
+      for request in self.__active.values():
+        if now > request.deadline:
+          self.timeouts += 1
+          request.expire()
+
+      if self.__map:
+        asyncore.loop(timeout = 0.2, map = self.__map, count = 1)
+
+    return self.results
+
+  def request_completed(self, request, body):
+    """
+    Called by a request when a response has been received.
+    """
+    if self.__active.get(request.key) is not request:
+      return
+
+    self.__finish(request.key, body)
+
+  def request_failed(self, request, retry = True):
+    """
+    Called by a request when it has failed.
+    """
+    if self.__active.get(request.key) is not request:
+      return
+
+    del self.__active[request.key]
+    if retry and self.__attempts[request.key] <= self.retries and time.time() < request.deadline:
+      self.__pending.append(request.key)
+    else:
+      self.__finish(request.key, None)
+
+  def __start(self, key):
+    """
+    Opens a new connection for the given request.
+    """
+    host, path, port, callback = self.__requests[key]
+    self.__attempts[key] += 1
+    if key not in self.__deadlines:
+      self.__deadlines[key] = time.time() + self.timeout
+
+    request = HttpRequest(self, key, host, path, port, self.__map)
+    self.__active[key] = request
+
+    try:
+      request.start(self.__deadlines[key])
+    except socket.error:
+      request.finish()
+      self.request_failed(request)
+
+  def __finish(self, key, body):
+    """
+    Stores the result and notifies the callback.
+    """
+    self.__active.pop(key, None)
+    self.results[key] = body
+    callback = self.__requests[key][3]
+    if callback is not None:
+      callback(key, body)
@@ -0,0 +1,132 @@
+try:
+  import numpy
+  NUMPY_ENABLED = True
+except ImportError:
+  NUMPY_ENABLED = False
+
+def topology_links(nodes, peers):
+  """
+  Returns links of a routing table snapshot in the form expected by
+  LinkMetrics. Metrics are taken as reported by the routing daemon, not
+  as stored for links in the database (where small changes are damped).
+
+  @param nodes: Topology information from the routing daemon (a
+    dictionary mapping IPs to OlsrNode instances)
+  @param peers: A dictionary mapping node IPs to (pk, label) tuples;
+    links to other nodes are skipped
+  @return: A list of (src IP, dst pk, dst IP, dst label, lq, ilq, etx)
+    tuples
+  """
+  links = []
+  for src_ip, olsr_node in nodes.iteritems():
+    for dst_ip, lq, ilq, etx, vtime in olsr_node.links:
+      peer = peers.get(dst_ip)
+      if peer is not None:
+        links.append((src_ip, peer[0], dst_ip, peer[1], lq, ilq, etx))
+
+  return links
+
+class LinkMetrics(object):
+  """
+  Link metrics of the whole mesh, computed once per cycle. Links are
+  grouped by their source node and per-node averages, LQ/ILQ asymmetry
+  and peer counts are stored in arrays indexed by node. NumPy is used
+  when available, otherwise the same values are computed in a single
+  pass over all links.
+  """
+  def __init__(self, links, use_numpy = True):
+    """
+    Class constructor.
+
+    @param links: A list of (src IP, dst pk, dst IP, dst label, lq, ilq,
+      etx) tuples (see topology_links)
+    @param use_numpy: Use NumPy when it is available
+    """
+    # Links of each node are ordered by their destination, as peers are displayed
+    self.links = sorted(links, key = lambda l: (l[0], l[3]))
+    self.index = {}
+    self.starts = []
+    for i, link in enumerate(self.links):
+      if link[0] not in self.index:
+        self.index[link[0]] = len(self.starts)
+        self.starts.append(i)
+
+    if use_numpy and NUMPY_ENABLED and self.links:
+      self.__compute_arrays()
+    else:
+      self.__compute_lists()
+
+  def __compute_arrays(self):
+    """
+    Computes per-node metrics using NumPy.
+    """
+    nodes = len(self.starts)
+    starts = numpy.array(self.starts)
+    node = numpy.zeros(len(self.links), dtype = int)
+    node[starts[1:]] = 1
+    node = numpy.cumsum(node)
+    lq, ilq, etx = [numpy.array([l[x] for l in self.links], dtype = float) for x in (4, 5, 6)]
+
+    self.peers = numpy.bincount(node, minlength = nodes)
+    self.lq = numpy.bincount(node, weights = lq, minlength = nodes) / self.peers
+    self.ilq = numpy.bincount(node, weights = ilq, minlength = nodes) / self.peers
+    self.etx = numpy.bincount(node, weights = etx, minlength = nodes) / self.peers
+    self.asymmetry = numpy.bincount(node, weights = numpy.abs(lq - ilq), minlength = nodes) / self.peers
+
+  def __compute_lists(self):
+    """
+    Computes per-node metrics without NumPy.
+    """
+    self.peers, self.lq, self.ilq, self.etx, self.asymmetry = [], [], [], [], []
+    ends = self.starts[1:] + [len(self.links)]
+    for start, end in zip(self.starts, ends):
+      peers = end - start
+      lq_sum = ilq_sum = etx_sum = asymmetry = 0.0
+      for src, dst_pk, dst_ip, dst_label, lq, ilq, etx in self.links[start:end]:
+        lq_sum += lq
+        ilq_sum += ilq
+        etx_sum += etx
+        asymmetry += abs(lq - ilq)
+
+      self.peers.append(peers)
+      self.lq.append(lq_sum / peers)
+      self.ilq.append(ilq_sum / peers)
+      self.etx.append(etx_sum / peers)
+      self.asymmetry.append(asymmetry / peers)
+
+  def node(self, node_ip):
+    """
+    Returns link metrics of a single node in a form that can be passed
+    to worker processes.
+
+    @param node_ip: Node's IP address
+    @return: A dictionary of metrics with a list of (dst pk, dst IP, dst
+      label, lq, ilq, etx) tuples under the 'links' key or None when the
+      node has no links
+    """
+    i = self.index.get(node_ip)
+    if i is None:
+      return None
+
+    metrics = dict([(key, float(getattr(self, key)[i])) for key in ('lq', 'ilq', 'etx', 'asymmetry')])
+    metrics['peers'] = int(self.peers[i])
+    metrics['links'] = [link[1:] for link in self.links[self.starts[i]:self.starts[i] + metrics['peers']]]
+    return metrics
+
+  def summary(self):
+    """
+    Returns network-wide totals as a dictionary with the number of links
+    and mean link quality and asymmetry over all links.
+    """
+    if not self.links:
+      return { 'links' : 0, 'lq' : 0.0, 'asymmetry' : 0.0 }
+
+    peers = [int(x) for x in self.peers]
+    return {
+      'links' : len(self.links),
+      'lq' : sum([float(x) * n for x, n in zip(self.lq, peers)]) / len(self.links),
+      'asymmetry' : sum([float(x) * n for x, n in zip(self.asymmetry, peers)]) / len(self.links),
+    }
+
+  def __len__(self):
+    return len(self.starts)
@@ -0,0 +1,230 @@
+import resource
+import threading
+import logging
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from traceback import format_exc
+
+from django.db import connection
+
+class Metrics(object):
+  """
+  A thread-safe registry of monitor metrics that can be rendered in the
+  Prometheus text exposition format.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.__lock = threading.Lock()
+    self.__metrics = {}
+    self.__order = []
+
+  def describe(self, name, type, help, buckets = None):
+    """
+    Declares a metric.
+
+    @param name: Metric name
+    @param type: One of 'counter', 'gauge' or 'histogram'
+    @param help: Metric description
+    @param buckets: Upper bounds of histogram buckets
+    """
+    with self.__lock:
+      if name not in self.__metrics:
+        self.__order.append(name)
+
+      self.__metrics[name] = (type, help, sorted(buckets or []), {})
+
+  def __labels(self, labels):
+    return tuple(sorted(labels.items()))
+
+  def set(self, name, value, **labels):
+    """
+    Sets the value of a gauge.
+    """
+    with self.__lock:
+      self.__metrics[name][3][self.__labels(labels)] = value
+
+  def inc(self, name, value = 1, **labels):
+    """
+    Increments a counter.
+    """
+    with self.__lock:
+      values = self.__metrics[name][3]
+      key = self.__labels(labels)
+      values[key] = values.get(key, 0) + value
+
+  def observe(self, name, value, **labels):
+    """
+    Records an observation in a histogram.
+    """
+    with self.__lock:
+      type, help, buckets, values = self.__metrics[name]
+      key = self.__labels(labels)
+      if key not in values:
+        values[key] = [[0] * len(buckets), 0.0, 0]
+
+      counts, total, count = values[key]
+      for i, bound in enumerate(buckets):
+        if value <= bound:
+          counts[i] += 1
+
+      values[key][1] = total + value
+      values[key][2] = count + 1
+
+  def get(self, name, **labels):
+    """
+    Returns the current value of a metric.
+
+    @param name: Metric name
+    @return: Value of a counter or gauge (0 when not yet recorded) or a
+      (sum, count) tuple for histograms
+    """
+    with self.__lock:
+      type, help, buckets, values = self.__metrics[name]
+      value = values.get(self.__labels(labels))
+      if type == 'histogram':
+        return (value[1], value[2]) if value is not None else (0.0, 0)
+
+      return value or 0
+
+  def values(self, name):
+    """
+    Returns all values of a counter or gauge.
+
+    @param name: Metric name
+    @return: A dictionary mapping label tuples to values
+    """
+    with self.__lock:
+      return dict(self.__metrics[name][3])
+
+  def clear(self, name):
+    """
+    Removes all values of a metric.
+    """
+    with self.__lock:
+      self.__metrics[name][3].clear()
+
+  def render(self):
+    """
+    Returns all metrics in Prometheus text format.
+    """
+    def format_labels(labels, extra = ()):
+      labels = list(labels) + list(extra)
+      if not labels:
+        return ''
+
+      return '{%s}' % ','.join(['%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels])
+
+    out = []
+    with self.__lock:
+      for name in self.__order:
+        type, help, buckets, values = self.__metrics[name]
+        out.append('# HELP %s %s' % (name, help))
+        out.append('# TYPE %s %s' % (name, type))
+        for labels, value in sorted(values.items()):
+          if type == 'histogram':
+            counts, total, count = value
+            for bound, bucket_count in zip(buckets, counts):
+              out.append('%s_bucket%s %s' % (name, format_labels(labels, [('le', repr(float(bound)))]), bucket_count))
+            out.append('%s_bucket%s %s' % (name, format_labels(labels, [('le', '+Inf')]), count))
+            out.append('%s_sum%s %r' % (name, format_labels(labels), float(total)))
+            out.append('%s_count%s %s' % (name, format_labels(labels), count))
+          else:
+            out.append('%s%s %r' % (name, format_labels(labels), float(value)))
+
+    return '\n'.join(out) + '\n'
+
+class MetricsServer(threading.Thread):
+  """
+  Serves metrics over HTTP in a background thread.
+  """
+  def __init__(self, metrics, address):
+    """
+    Class constructor.
+
+    @param metrics: Metrics instance
+    @param address: A (host, port) tuple to listen on
+    """
+    super(MetricsServer, self).__init__(name = "metrics")
+    self.daemon = True
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        try:
+          body = metrics.render()
+        except:
+          logging.warning(format_exc())
+          self.send_error(500)
+          return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    self.server = HTTPServer(address, Handler)
+
+  def run(self):
+    self.server.serve_forever()
+
+class QueryCounter(object):
+  """
+  Counts database queries issued by the current process using Django's
+  debug cursor. Recorded queries are discarded, so memory does not grow
+  even when counting is enabled for a long time.
+  """
+  def __init__(self, enabled = True):
+    """
+    Class constructor.
+
+    @param enabled: When false no queries are counted
+    """
+    self.enabled = enabled
+    self.count = None
+    self.__start = None
+
+  def start(self):
+    """
+    Starts counting queries.
+    """
+    if not self.enabled:
+      return
+
+    self.__debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    self.__start = len(connection.queries)
+
+  def stop(self):
+    """
+    Stops counting queries. Stopping a counter that is not running has no
+    effect.
+
+    @return: Number of queries issued since start() or None when counting
+      is disabled
+    """
+    if self.__start is None:
+      return self.count
+
+    self.count = len(connection.queries) - self.__start
+    del connection.queries[self.__start:]
+    connection.use_debug_cursor = self.__debug_cursor
+    self.__start = None
+    return self.count
+
+def get_rss():
+  """
+  Returns the resident set size of the current process in bytes.
+  """
+  try:
+    statm = open('/proc/self/statm')
+    try:
+      return int(statm.read().split()[1]) * resource.getpagesize()
+    finally:
+      statm.close()
+  except (IOError, IndexError, ValueError):
+    # Fall back to peak usage where /proc is not available
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
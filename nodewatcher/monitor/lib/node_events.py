@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+from frontend.nodes.models import Node, Event, EventCode, EventNotification, SubscriptionIndex
+from frontend.nodes.bulk import chunked, bulk_update, bulk_insert, MAX_QUERY_PARAMS
+
+# Events of the same node and code occurring within this window are
+# aggregated into a single event
+AGGREGATION_WINDOW = timedelta(minutes = 30)
+
+class EventAggregator(object):
+  """
+  Collects events generated during a monitor cycle in memory. Once the
+  cycle is complete, events are aggregated against recent events using a
+  single query, new events are inserted in bulk and notifications for
+  subscribers are queued in the outbox.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.__events = []
+
+  def add(self, node, code, summary, source, data = "", aggregate = True):
+    """
+    Records a new event. Arguments are the same as for Event.create_event.
+
+    @param node: Node instance or primary key of the node
+    """
+    self.__events.append((node, code, summary, source, data, aggregate, datetime.now()))
+
+  def items(self):
+    """
+    Returns a list of recorded events, suitable for passing between
+    processes.
+    """
+    return [(getattr(event[0], 'pk', event[0]),) + event[1:] for event in self.__events]
+
+  def merge(self, items):
+    """
+    Adds events recorded by another aggregator.
+
+    @param items: A list of events as returned by items()
+    """
+    self.__events.extend(items)
+
+  def apply(self):
+    """
+    Aggregates recorded events, stores them and queues notifications.
+    """
+    if not self.__events:
+      return
+
+    events, self.__events = self.__events, []
+    now = datetime.now()
+
+    # Resolve nodes referenced by primary key and check which nodes still exist,
+    # events of removed nodes are only posted and never stored
+    nodes = {}
+    for node, code, summary, source, data, aggregate, timestamp in events:
+      if isinstance(node, Node):
+        nodes[node.pk] = node
+      else:
+        nodes.setdefault(node, None)
+
+    existing = set()
+    for chunk in chunked(nodes.keys(), MAX_QUERY_PARAMS):
+      for node in Node.objects.filter(pk__in = chunk):
+        existing.add(node.pk)
+        if nodes[node.pk] is None:
+          nodes[node.pk] = node
+
+    # Load the aggregation window of recent events
+    recent = {}
+    for event in Event.objects.filter(timestamp__gt = now - AGGREGATION_WINDOW).order_by('timestamp'):
+      recent.setdefault((event.node_id, event.code), event)
+
+    subscriptions = SubscriptionIndex()
+    new_events = []
+    repeated = {}
+    notifications = []
+    for node, code, summary, source, data, aggregate, timestamp in events:
+      node = nodes[getattr(node, 'pk', node)]
+      if node is None:
+        continue
+
+      key = (node.pk, code)
+      if key in recent and code not in (EventCode.NodeRenamed,) and aggregate:
+        event = recent[key]
+        event.counter += 1
+        event.need_resend = True
+        if event.pk is not None:
+          repeated[event.pk] = event
+        continue
+
+      event = Event(node = node, code = code, summary = summary, source = source, data = data, timestamp = timestamp)
+      recent[key] = event
+      notifications.extend(event.get_notifications(subscriptions.get_subscribers(node, code)))
+      if node.pk in existing:
+        new_events.append(event)
+
+    bulk_update([(aggregated, ['counter', 'need_resend']) for aggregated in repeated.values()])
+    bulk_insert(Event, new_events)
+    bulk_insert(EventNotification, notifications)
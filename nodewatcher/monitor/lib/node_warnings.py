@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from frontend.nodes.models import NodeWarning, WarningCode
+from frontend.nodes.bulk import chunked, bulk_update, bulk_insert, bulk_delete, MAX_QUERY_PARAMS
+
+class WarningAccumulator(object):
+  """
+  Collects node warnings raised during a monitor cycle in memory. Once
+  the cycle is complete, the collected warnings are compared against the
+  stored ones and only the differences are written to the database.
+  """
+  def __init__(self, source):
+    """
+    Class constructor.
+
+    @param source: Warning source
+    """
+    self.source = source
+    self.__warnings = {}
+
+  def add(self, node, code, details = ''):
+    """
+    Records a warning for a node. Raising the same warning multiple times
+    during a cycle only keeps the last details.
+
+    @param node: A valid node to warn
+    @param code: Warning code
+    @param details: Warning details
+    """
+    node.warnings = True
+    self.__warnings[self.__key(node.pk, code, details)] = details
+
+  def items(self):
+    """
+    Returns a list of (node pk, code, details) tuples for all recorded
+    warnings, suitable for passing between processes.
+    """
+    return [(node_id, code, details) for (node_id, code, _), details in self.__warnings.iteritems()]
+
+  def merge(self, items):
+    """
+    Adds warnings recorded by another accumulator.
+
+    @param items: A list of (node pk, code, details) tuples
+    """
+    for node_id, code, details in items:
+      self.__warnings[self.__key(node_id, code, details)] = details
+
+  def __key(self, node_id, code, details):
+    """
+    Returns a key that identifies a warning. Custom warnings are never
+    merged, so they are also identified by their details.
+    """
+    return (node_id, code, details if code == WarningCode.Custom else None)
+
+  def apply(self, scope = None):
+    """
+    Inserts new warnings, touches warnings that are still present and
+    removes warnings that have not been raised during this cycle.
+
+    @param scope: Optional callable that receives a stored warning and
+      returns true when it is managed by this accumulator; other stored
+      warnings are left alone (used when several monitor instances raise
+      warnings for different nodes)
+    """
+    now = datetime.now()
+    pending = dict(self.__warnings)
+    touched = []
+    changed = []
+    removed = []
+
+    for w in NodeWarning.objects.all():
+      key = self.__key(w.node_id, w.code, w.details)
+      if scope is not None and not scope(w):
+        # Never duplicate warnings that are managed elsewhere
+        pending.pop(key, None)
+        continue
+
+      if key not in pending:
+        removed.append(w.pk)
+        continue
+
+      details = pending.pop(key)
+      if w.details != details or w.source != self.source:
+        w.details = details
+        w.source = self.source
+        w.last_update = now
+        changed.append((w, ['details', 'source', 'last_update']))
+      else:
+        touched.append(w.pk)
+
+    bulk_delete(NodeWarning, removed)
+    bulk_update(changed)
+    for chunk in chunked(touched, MAX_QUERY_PARAMS):
+      NodeWarning.objects.filter(pk__in = chunk).update(last_update = now)
+
+    new_warnings = []
+    for (node_id, code, _), details in pending.iteritems():
+      w = NodeWarning(node_id = node_id, code = code, source = self.source, details = details)
+      w.last_update = w.created_at = now
+      w.dirty = True
+      new_warnings.append(w)
+
+    bulk_insert(NodeWarning, new_warnings)
@@ -1,55 +1,83 @@
-# XXX Do NOT use urllib2 here as it causes memory leaks!
-import urllib
-import socket
+import hashlib
+
+from lib.fetcher import Fetcher
+from lib.report_schema import NODEWATCHER_SCHEMA
 
 # A flag that specifies when we should save fetched data for simulation purpuses
 COLLECT_SIMULATION_DATA = False
 
 def parse_node_info(data):
   """
-  Parses node information into usable form.
-  """
-  try:
-    info = {}
-    for line in data.split('\n'):
-      if not line:
-        break
-
-      if line[0] == ';':
-        continue
-
-      key, value = line.split(':', 1)
-      value = value.strip()
-      key = key.split('.')
+  Parses node information into usable form. Values of known keys are
+  converted to their types (see NODEWATCHER_SCHEMA).
 
-      d = info
-      for part in key[:-1]:
-        d = d.setdefault(part, {})
-      
-      d[key[-1]] = value
-  except:
-    return None
-
-  return info
+  @param data: Report as a string or an iterable of lines
+  @return: A nested dictionary or None when the report is malformed
+  """
+  return NODEWATCHER_SCHEMA.parse(data)
 
-def fetch_node_info(node_ip):
+def collect_node_info(node_ip, data):
   """
-  Fetches node information via HTTP.
+  Saves fetched node information for simulation purpuses.
   """
-  socket.setdefaulttimeout(15)
   try:
-    data = urllib.urlopen('http://%s/cgi-bin/nodewatcher' % node_ip).read()
-    if COLLECT_SIMULATION_DATA:
-      try:
-        f = open("simulator/data/nodes/%s.txt" % node_ip, 'w')
-        f.write(data)
-        f.close()
-      except IOError:
-        pass
+    f = open("simulator/data/nodes/%s.txt" % node_ip, 'w')
+    f.write(data)
+    f.close()
+  except IOError:
+    pass
+
+def fetch_all(node_ips, package_ips = (), callback = None, concurrency = 50, timeout = 15, retries = 1, stats = None):
+  """
+  Fetches node information from many nodes concurrently using a non-blocking
+  HTTP client. Installed packages are also fetched for nodes listed in
+  package_ips.
+
+  @param node_ips: A list of node IP addresses to fetch information for
+  @param package_ips: A list of node IP addresses to fetch packages for
+  @param callback: Optional callable invoked with (node_ip, kind, data) as
+    soon as a result is available, kind is either 'info' or 'packages'; for
+    packages data is a (digest, packages) tuple where digest is a hash of
+    the raw listing
+  @param concurrency: Maximum number of concurrent connections
+  @param timeout: Per-request timeout in seconds
+  @param retries: Number of retries for failed requests
+  @param stats: An optional dictionary that receives the number of timed
+    out requests under the 'timeouts' key
+  @return: A tuple (infos, packages) of dictionaries keyed by node IP
+  """
+  results = {
+    'info' : {},
+    'packages' : {}
+  }
+  
+  def completed((kind, node_ip), data):
+    if data is None:
+      pass
+    elif kind == 'info':
+      if COLLECT_SIMULATION_DATA:
+        collect_node_info(node_ip, data)
+      
+      data = parse_node_info(data)
+    else:
+      packages = parse_installed_packages(data)
+      data = (hashlib.sha1(data).hexdigest(), packages) if packages is not None else None
     
-    return parse_node_info(data)
-  except:
-    return None
+    results[kind][node_ip] = data
+    if callback is not None:
+      callback(node_ip, kind, data)
+  
+  fetcher = Fetcher(concurrency = concurrency, timeout = timeout, retries = retries)
+  for node_ip in node_ips:
+    fetcher.add(('info', node_ip), node_ip, '/cgi-bin/nodewatcher', callback = completed)
+  for node_ip in package_ips:
+    fetcher.add(('packages', node_ip), node_ip, '/cgi-bin/opkgwatcher', callback = completed)
+  
+  fetcher.run()
+  if stats is not None:
+    stats['timeouts'] = fetcher.timeouts
+  
+  return results['info'], results['packages']
 
 def frequency_to_channel(frequency):
   """
@@ -65,14 +93,12 @@ def frequency_to_channel(frequency):
   except:
     return 0
 
-def fetch_installed_packages(node_ip):
+def parse_installed_packages(data):
   """
-  Fetches installed node packages.
+  Parses installed package information into usable form.
   """
-  socket.setdefaulttimeout(15)
   try:
     info = {}
-    data = urllib.urlopen('http://%s/cgi-bin/opkgwatcher' % node_ip).read()
     for line in data.split('\n'):
       if not line:
         break
@@ -83,4 +109,3 @@ def fetch_installed_packages(node_ip):
     return None
 
   return info
-
@@ -0,0 +1,48 @@
+import logging
+import threading
+from traceback import format_exc
+
+from django.db import transaction
+
+from frontend.nodes.models import EventNotification
+
+class OutboxSender(threading.Thread):
+  """
+  Sends queued event notifications in a background thread, so the monitor
+  never waits for the mail server.
+  """
+  def __init__(self, interval = 60):
+    """
+    Class constructor.
+
+    @param interval: Maximum number of seconds between sends
+    """
+    super(OutboxSender, self).__init__(name = "outbox")
+    self.daemon = True
+    self.interval = interval
+    self.__wakeup = threading.Event()
+
+  def wake(self):
+    """
+    Requests pending notifications to be sent as soon as possible.
+    """
+    self.__wakeup.set()
+
+  def run(self):
+    while True:
+      self.__wakeup.wait(self.interval)
+      self.__wakeup.clear()
+
+      try:
+        self.send()
+      except:
+        logging.warning("Failed to send event notifications!")
+        logging.warning(format_exc())
+
+  @transaction.commit_on_success
+  def send(self):
+    """
+    Sends all pending notifications.
+    """
+    transaction.set_dirty()
+    EventNotification.send_pending()
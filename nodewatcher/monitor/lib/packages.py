@@ -0,0 +1,86 @@
+import zlib
+from datetime import datetime, timedelta
+
+from django.db import models
+
+from frontend.nodes.models import InstalledPackage
+from frontend.nodes.bulk import chunked, bulk_update, bulk_insert, bulk_delete, MAX_QUERY_PARAMS
+
+def sync_installed_packages(node, packages):
+  """
+  Applies a package listing to the stored inventory of a node. Only
+  differences are written: removed packages are deleted, packages with
+  changed versions are updated and new ones are inserted, each in bulk.
+
+  @param node: Node instance
+  @param packages: A dictionary mapping package names to versions
+  """
+  now = datetime.now()
+  removed = []
+  changed = []
+  packages = dict(packages)
+  for package in InstalledPackage.objects.filter(node = node):
+    if package.name not in packages:
+      removed.append(package.pk)
+      continue
+
+    new_version = packages.pop(package.name)
+    if package.version != new_version:
+      package.version = new_version
+      package.last_update = now
+      changed.append((package, ['version', 'last_update']))
+
+  bulk_delete(InstalledPackage, removed)
+  bulk_update(changed)
+  bulk_insert(InstalledPackage, [
+    InstalledPackage(node = node, name = name, version = version, last_update = now)
+    for name, version in packages.iteritems()
+  ])
+
+class PackageRefreshSchedule(object):
+  """
+  Decides which nodes should have their package listing refreshed in
+  the current cycle. Nodes are spread over all cycles of a refresh
+  interval based on their IP address, so refreshes do not all happen
+  in the same cycle.
+  """
+  def __init__(self, interval = 3600, poll_interval = 300):
+    """
+    Class constructor.
+
+    @param interval: Number of seconds between refreshes of a node
+    @param poll_interval: Number of seconds between monitor cycles
+    """
+    self.interval = interval
+    self.slots = max(1, interval // poll_interval)
+    self.poll_interval = poll_interval
+
+  def slot(self, node_ip):
+    """
+    Returns the cycle slot of a node.
+
+    @param node_ip: Node's IP address
+    """
+    return (zlib.crc32(node_ip) & 0xffffffff) % self.slots
+
+  def due(self, node_ips, timestamp):
+    """
+    Returns a list of node IP addresses that need their installed package
+    listing refreshed. Besides nodes in the current slot, nodes without
+    any packages and nodes that have missed their slot (for example
+    because they were down) are refreshed.
+
+    @param node_ips: A list of node IP addresses to check
+    @param timestamp: Current UNIX timestamp
+    """
+    last_updates = {}
+    for chunk in chunked(node_ips, MAX_QUERY_PARAMS):
+      for item in InstalledPackage.objects.filter(node__ip__in = chunk).values('node__ip').annotate(last_update = models.Max('last_update')):
+        last_updates[item['node__ip']] = item['last_update']
+
+    current = int(timestamp // self.poll_interval) % self.slots
+    overdue = datetime.fromtimestamp(timestamp) - timedelta(seconds = self.interval + self.poll_interval)
+    return [
+      node_ip for node_ip in node_ips
+      if not last_updates.get(node_ip) or last_updates[node_ip] < overdue or self.slot(node_ip) == current
+    ]
@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+import Queue
+from contextlib import contextmanager
+from traceback import format_exc
+
+class StageTimer(object):
+  """
+  Records wall clock durations of individual monitor cycle stages. Stages
+  may overlap as some of them run in background threads.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.durations = {}
+    self.__started = {}
+    self.__lock = threading.Lock()
+
+  def start(self, name):
+    """
+    Marks the start of a stage.
+
+    @param name: Stage name
+    """
+    with self.__lock:
+      self.__started[name] = time.time()
+
+  def stop(self, name):
+    """
+    Marks the end of a stage. Durations of repeated stages are summed.
+
+    @param name: Stage name
+    """
+    with self.__lock:
+      delta = time.time() - self.__started.pop(name)
+      self.durations[name] = self.durations.get(name, 0.0) + delta
+
+  @contextmanager
+  def stage(self, name):
+    """
+    Times the enclosed block as a stage.
+
+    @param name: Stage name
+    """
+    self.start(name)
+    try:
+      yield
+    finally:
+      self.stop(name)
+
+  def slowest(self, count = 3):
+    """
+    Returns a list of (name, duration) tuples for the slowest stages.
+
+    @param count: Maximum number of stages to return
+    """
+    return sorted(self.durations.items(), key = lambda x: x[1], reverse = True)[:count]
+
+  def format_slowest(self, count = 3):
+    """
+    Returns a human readable description of the slowest stages.
+
+    @param count: Maximum number of stages to include
+    """
+    return ", ".join(["{0} ({1} sec)".format(name, round(duration, 2)) for name, duration in self.slowest(count)])
+
+class BackgroundStage(threading.Thread):
+  """
+  A stage that runs in a background thread. Exceptions are logged and the
+  optional failure handler is invoked so that consumers are never left
+  waiting for results that will not arrive.
+  """
+  def __init__(self, name, timer, target, args = (), on_failure = None):
+    """
+    Class constructor.
+
+    @param name: Stage name
+    @param timer: StageTimer instance
+    @param target: Callable that performs the work
+    @param args: Arguments for the callable
+    @param on_failure: Optional callable invoked when the stage fails
+    """
+    super(BackgroundStage, self).__init__(name = "stage-%s" % name)
+    self.daemon = True
+    self.stage_name = name
+    self.timer = timer
+    self.target = target
+    self.target_args = args
+    self.on_failure = on_failure
+
+  def run(self):
+    try:
+      with self.timer.stage(self.stage_name):
+        self.target(*self.target_args)
+    except:
+      logging.warning("Monitor stage '%s' has failed!" % self.stage_name)
+      logging.warning(format_exc())
+      if self.on_failure is not None:
+        self.on_failure()
+
+class NodeCollector(object):
+  """
+  Collects per-node results of concurrently running stages and hands out
+  nodes as soon as all of their expected results are available.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.__expected = {}
+    self.__results = {}
+    self.__ready = Queue.Queue()
+    self.__remaining = 0
+    self.__lock = threading.Lock()
+
+  def expect(self, key, *parts):
+    """
+    Registers a node and the results that must be collected for it.
+
+    @param key: Node identifier
+    @param parts: Names of results that are expected for this node
+    """
+    with self.__lock:
+      self.__remaining += 1
+      if not parts:
+        self.__ready.put((key, {}))
+        return
+
+      self.__expected[key] = set(parts)
+      self.__results[key] = {}
+
+  def put(self, key, part, value):
+    """
+    Stores a result for a node.
+
+    @param key: Node identifier
+    @param part: Result name
+    @param value: Result value
+    """
+    with self.__lock:
+      expected = self.__expected.get(key)
+      if not expected or part not in expected:
+        return
+
+      expected.remove(part)
+      self.__results[key][part] = value
+      if not expected:
+        del self.__expected[key]
+        self.__ready.put((key, self.__results.pop(key)))
+
+  def fail(self, part):
+    """
+    Marks all outstanding results with the given name as unavailable.
+
+    @param part: Result name
+    """
+    with self.__lock:
+      keys = [key for key, expected in self.__expected.items() if part in expected]
+
+    for key in keys:
+      self.put(key, part, None)
+
+  def __iter__(self):
+    """
+    Yields (key, results) tuples as nodes become ready, blocking until all
+    registered nodes have been handed out.
+    """
+    while True:
+      with self.__lock:
+        if not self.__remaining:
+          return
+        self.__remaining -= 1
+
+      # Wait with a timeout so the main thread remains interruptible
+      item = None
+      while item is None:
+        try:
+          item = self.__ready.get(True, 1)
+        except Queue.Empty:
+          pass
+
+      yield item
@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+import SocketServer
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from traceback import format_exc
+
+# Maximum size of a pushed report (also the largest possible UDP payload)
+MAX_REPORT_SIZE = 65507
+
+class ReportBuffer(object):
+  """
+  Keeps nodewatcher reports pushed by nodes in memory until the nodes are
+  polled. Only the latest report of each node is kept and reports are only
+  accepted from nodes that are being polled, for the address they were
+  sent from, so a node can never push a report in the name of another.
+  """
+  def __init__(self, parser, max_age = 300):
+    """
+    Class constructor.
+
+    @param parser: Callable that parses a raw report (returns None when
+      the report is invalid)
+    @param max_age: Maximum number of seconds a pushed report is used
+      instead of pulling node data
+    """
+    self.parser = parser
+    self.max_age = max_age
+    self.__lock = threading.Lock()
+    self.__reports = {}
+    self.__allowed = frozenset()
+
+  def allow(self, node_ips):
+    """
+    Sets nodes that may push reports. Reports of other nodes are dropped.
+
+    @param node_ips: A list of node IP addresses
+    """
+    allowed = frozenset(node_ips)
+    with self.__lock:
+      self.__allowed = allowed
+      for node_ip in self.__reports.keys():
+        if node_ip not in allowed:
+          del self.__reports[node_ip]
+
+  def put(self, node_ip, data, now = None):
+    """
+    Stores a report pushed by a node.
+
+    @param node_ip: IP address the report was sent from
+    @param data: Raw nodewatcher report
+    @param now: Optional UNIX timestamp of the report
+    @return: True when the report has been accepted
+    """
+    if node_ip not in self.__allowed:
+      return False
+
+    info = self.parser(data)
+    if not info:
+      return False
+
+    with self.__lock:
+      if node_ip not in self.__allowed:
+        return False
+
+      self.__reports[node_ip] = (now or time.time(), info)
+
+    return True
+
+  def take(self, node_ips, now = None):
+    """
+    Removes and returns recently pushed reports of the given nodes.
+
+    @param node_ips: A list of node IP addresses
+    @param now: Optional current UNIX timestamp
+    @return: A dictionary mapping node IPs to parsed reports
+    """
+    now = now or time.time()
+    reports = {}
+    with self.__lock:
+      for node_ip in node_ips:
+        report = self.__reports.pop(node_ip, None)
+        if report is not None and now - report[0] <= self.max_age:
+          reports[node_ip] = report[1]
+
+    return reports
+
+  def __len__(self):
+    return len(self.__reports)
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
+  """
+  HTTP server that handles each request in its own thread.
+  """
+  daemon_threads = True
+
+class HTTPPushReceiver(threading.Thread):
+  """
+  Receives reports pushed by nodes with HTTP POST requests in a background
+  thread. Requests are handled concurrently and connections that stall
+  are closed after a timeout, so a slow node cannot block the others.
+  """
+  def __init__(self, buffer, address, callback = None, timeout = 10):
+    """
+    Class constructor.
+
+    @param buffer: ReportBuffer instance
+    @param address: A (host, port) tuple to listen on
+    @param callback: Optional callable invoked with (transport, accepted)
+      for each received report
+    @param timeout: Number of seconds after which a stalled connection
+      is closed
+    """
+    super(HTTPPushReceiver, self).__init__(name = "push-http")
+    self.daemon = True
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_POST(self):
+        try:
+          length = int(self.headers.get('Content-Length', 0))
+          if length <= 0 or length > MAX_REPORT_SIZE:
+            self.send_error(413 if length > 0 else 411)
+            return
+
+          accepted = buffer.put(self.client_address[0], self.rfile.read(length))
+        except:
+          logging.warning(format_exc())
+          self.send_error(500)
+          return
+
+        if callback is not None:
+          callback('http', accepted)
+
+        self.send_response(204 if accepted else 403)
+        self.end_headers()
+
+      def log_message(self, format, *args):
+        pass
+
+    Handler.timeout = timeout
+    self.server = ThreadingHTTPServer(address, Handler)
+
+  def run(self):
+    self.server.serve_forever()
+
+class UDPPushReceiver(threading.Thread):
+  """
+  Receives reports pushed by nodes as UDP datagrams in a background
+  thread. Each datagram must contain a complete report. Datagrams are not
+  authenticated and their source address is trivial to spoof, so this
+  receiver must only be used on networks where nodes are trusted.
+  """
+  def __init__(self, buffer, address, callback = None):
+    """
+    Class constructor.
+
+    @param buffer: ReportBuffer instance
+    @param address: A (host, port) tuple to listen on
+    @param callback: Optional callable invoked with (transport, accepted)
+      for each received report
+    """
+    super(UDPPushReceiver, self).__init__(name = "push-udp")
+    self.daemon = True
+
+    class Handler(SocketServer.BaseRequestHandler):
+      def handle(self):
+        try:
+          accepted = buffer.put(self.client_address[0], self.request[0])
+        except:
+          logging.warning(format_exc())
+          return
+
+        if callback is not None:
+          callback('udp', accepted)
+
+    self.server = SocketServer.UDPServer(address, Handler)
+    self.server.max_packet_size = MAX_REPORT_SIZE
+
+  def run(self):
+    self.server.serve_forever()
@@ -0,0 +1,215 @@
+import struct
+from datetime import datetime
+from fnmatch import fnmatchcase
+
+def safe_int_convert(integer):
+  """
+  A helper method for converting a string to an integer.
+  """
+  try:
+    return int(integer)
+  except:
+    return None
+
+def safe_float_convert(value, precision = 3):
+  """
+  A helper method for converting a string to a float.
+  """
+  try:
+    return round(float(value), precision)
+  except:
+    return None
+
+def safe_loadavg_convert(loadavg):
+  """
+  A helper method for converting a string to a loadavg tuple.
+  """
+  try:
+    loadavg = loadavg.split(' ')
+    la1min, la5min, la15min = (float(x) for x in loadavg[0:3])
+    nproc = int(loadavg[3].split('/')[1])
+    return la1min, la5min, la15min, nproc
+  except:
+    return None, None, None, None
+
+def safe_uptime_convert(uptime):
+  """
+  A helper method for converting a string to an uptime integer.
+  """
+  try:
+    return int(float(uptime.split(' ')[0]))
+  except:
+    return None
+
+def safe_date_convert(timestamp):
+  """
+  A helper method for converting a string timestamp into a datetime
+  object.
+  """
+  try:
+    return datetime.fromtimestamp(int(timestamp))
+  except:
+    return None
+
+def safe_dbm_convert(dbm):
+  """
+  A helper method for converting a string into a valid dBm integer
+  value. This also takes care of unsigned/signed char conversions.
+  """
+  try:
+    dbm = safe_int_convert(dbm)
+    if dbm is None:
+      return None
+
+    if dbm > 127:
+      # Convert from unsigned char into signed one
+      dbm = struct.unpack("b", struct.pack("<i", dbm)[0])[0]
+
+    return dbm
+  except:
+    return None
+
+def safe_bandwidth_convert(limit):
+  """
+  A helper method for converting a traffic shaping limit (like 512Kbit
+  or 2Mbit) into an integer in kbit/s.
+  """
+  try:
+    if 'Kbit' in limit:
+      return safe_int_convert(limit[:-4])
+
+    return safe_int_convert(limit[:-3]) // 1000
+  except TypeError:
+    return None
+
+class ReportSchema(object):
+  """
+  A compiled schema of a report in the "key.sub: value" format. Values of
+  known keys are converted to their types once while parsing, values of
+  unknown keys are kept as strings. Keys are split and matched against
+  the schema only the first time they are seen, afterwards each line
+  costs a single lookup.
+  """
+  def __init__(self, fields, max_keys = 10000):
+    """
+    Class constructor.
+
+    @param fields: A dictionary mapping keys to converters; a key segment
+      may contain wildcards (like nds.client*.up) and converters receive
+      a stripped string value
+    @param max_keys: Maximum number of distinct keys that are remembered
+    """
+    self.max_keys = max_keys
+    self.__exact = {}
+    self.__patterns = []
+    for key, convert in fields.iteritems():
+      if '*' in key or '?' in key:
+        self.__patterns.append((key.split('.'), convert))
+      else:
+        self.__exact[key] = convert
+
+    self.__keys = {}
+
+  def __compile(self, key):
+    """
+    Returns a (parent path, name, converter) tuple for a key.
+    """
+    path = key.split('.')
+    convert = self.__exact.get(key)
+    if convert is None:
+      for pattern, pattern_convert in self.__patterns:
+        if len(pattern) == len(path) and all([fnmatchcase(part, x) for part, x in zip(path, pattern)]):
+          convert = pattern_convert
+          break
+
+    if len(self.__keys) >= self.max_keys:
+      self.__keys.clear()
+
+    field = self.__keys[key] = (tuple(path[:-1]), path[-1], convert)
+    return field
+
+  def parse(self, data):
+    """
+    Parses a report. Parsing stops at the first empty line.
+
+    @param data: Report as a string or an iterable of lines (like a file)
+    @return: A nested dictionary or None when the report is malformed
+    """
+    if isinstance(data, basestring):
+      lines = data.split('\n')
+    else:
+      lines = (line.rstrip('\n') for line in data)
+
+    info = {}
+    containers = { () : info }
+    keys = self.__keys
+    try:
+      for line in lines:
+        if not line:
+          break
+
+        if line[0] == ';':
+          continue
+
+        key, value = line.split(':', 1)
+        field = keys.get(key)
+        if field is None:
+          field = self.__compile(key)
+
+        parent, name, convert = field
+        d = containers.get(parent)
+        if d is None:
+          d = info
+          for part in parent:
+            d = d.setdefault(part, {})
+          containers[parent] = d
+
+        if convert is None:
+          d[name] = value.strip()
+        else:
+          d[name] = convert(value.strip())
+    except:
+      return None
+
+    return info
+
+# Schema of nodewatcher reports, values of keys that are not listed are strings
+NODEWATCHER_SCHEMA = ReportSchema({
+  'general.local_time' : safe_date_convert,
+  'general.uptime' : safe_uptime_convert,
+  'general.loadavg' : safe_loadavg_convert,
+  'general.memfree' : safe_int_convert,
+  'general.buffers' : safe_int_convert,
+  'general.cached' : safe_int_convert,
+  'wifi.mcast_rate' : safe_int_convert,
+  'wifi.errors' : safe_int_convert,
+  'wifi.cells' : safe_int_convert,
+  'wifi.rts' : safe_int_convert,
+  'wifi.frag' : safe_int_convert,
+  'wifi.bitrate' : safe_int_convert,
+  'wifi.signal' : safe_dbm_convert,
+  'wifi.noise' : safe_dbm_convert,
+  'net.losses' : safe_int_convert,
+  'net.vpn.upload_limit' : safe_bandwidth_convert,
+  'nds.down' : safe_int_convert,
+  'nds.client*.added_at' : safe_date_convert,
+  'nds.client*.up' : safe_int_convert,
+  'nds.client*.down' : safe_int_convert,
+  'dns.local' : safe_int_convert,
+  'dns.remote' : safe_int_convert,
+  'iface.*.up' : safe_int_convert,
+  'iface.*.down' : safe_int_convert,
+  'solar.batvoltage' : safe_float_convert,
+  'solar.solvoltage' : safe_float_convert,
+  'solar.charge' : safe_float_convert,
+  'solar.load' : safe_float_convert,
+  'environment.sensor*.temp' : safe_float_convert,
+  'voltage.1' : safe_float_convert,
+  'voltage.2' : safe_float_convert,
+  'voltage.3' : safe_float_convert,
+  'voltage.4' : safe_float_convert,
+  'voltage.1m' : safe_int_convert,
+  'voltage.2m' : safe_int_convert,
+  'voltage.3m' : safe_int_convert,
+  'voltage.4m' : safe_int_convert,
+})
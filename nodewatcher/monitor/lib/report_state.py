@@ -0,0 +1,100 @@
+import hashlib
+import time
+
+def fingerprint(value):
+  """
+  Returns a fingerprint of a parsed report section (or any combination
+  of nested dictionaries, lists and scalars). Dictionaries are hashed in
+  key order, so equal sections always produce equal fingerprints.
+
+  @param value: Value to fingerprint
+  """
+  h = hashlib.sha1()
+
+  def update(value):
+    if isinstance(value, dict):
+      h.update('{')
+      for key in sorted(value):
+        update(key)
+        update(value[key])
+      h.update('}')
+    elif isinstance(value, (list, tuple)):
+      h.update('[')
+      for item in value:
+        update(item)
+      h.update(']')
+    else:
+      h.update('%s:%r;' % (type(value).__name__, value))
+
+  update(value)
+  return h.hexdigest()
+
+class ReportState(object):
+  """
+  Keeps results of per-node checks between monitor cycles. A check is
+  only performed again when the fingerprint of its inputs (report
+  sections and node configuration) changes; otherwise the warnings it
+  raised and its result are carried forward. Entries expire after a
+  while so configuration that is not part of the inputs is eventually
+  picked up as well.
+  """
+  def __init__(self, previous = None, max_age = 3600):
+    """
+    Class constructor.
+
+    @param previous: State items of the previous cycle as returned by items()
+    @param max_age: Number of seconds after which checks are always performed
+    """
+    self.previous = previous or {}
+    self.max_age = max_age
+    self.current = {}
+    self.now = time.time()
+
+  def __valid(self, entry):
+    """
+    Returns true when an entry has not yet expired.
+    """
+    return self.now < entry[3]
+
+  def run(self, name, inputs, warnings, node, check, max_age = None):
+    """
+    Performs a check unless its inputs are unchanged since the previous
+    cycle.
+
+    @param name: Check name
+    @param inputs: Everything the check depends on or None when the
+      inputs are known to be unchanged since the previous cycle
+    @param warnings: WarningAccumulator for raised warnings
+    @param node: Node instance that warnings are raised for
+    @param check: A callable that performs the check; it receives a
+      function for raising warnings with signature (code, details = '')
+    @param max_age: Optional number of seconds after which this check is
+      always performed (overrides the default)
+    @return: Result of the check
+    """
+    entry = self.previous.get(name)
+    if inputs is None and entry is not None:
+      fp = entry[0]
+    else:
+      fp = fingerprint(inputs)
+
+    if entry is None or entry[0] != fp or not self.__valid(entry):
+      raised = []
+      result = check(lambda code, details = '': raised.append((code, details)))
+      entry = (fp, raised, result, self.now + (max_age or self.max_age))
+
+    self.current[name] = entry
+    for code, details in entry[1]:
+      warnings.add(node, code, details)
+
+    return entry[2]
+
+  def items(self):
+    """
+    Returns state items that should be passed to the next cycle. Entries
+    of checks that have not been performed in this cycle are kept until
+    they expire.
+    """
+    items = dict([(name, entry) for name, entry in self.previous.iteritems() if self.__valid(entry)])
+    items.update(self.current)
+    return items
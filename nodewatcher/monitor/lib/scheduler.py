@@ -0,0 +1,158 @@
+import heapq
+import zlib
+
+class NodeScheduler(object):
+  """
+  Keeps a due time for each visible node in a priority queue, so nodes
+  are polled individually instead of all at once. Stable nodes are polled
+  at the base interval while newly seen nodes and nodes that have changed
+  their status are polled at a faster interval for a few polls. Initial
+  due times are spread over the whole interval based on node IP and
+  nodes keep their phase afterwards, so work is spread evenly.
+  """
+  def __init__(self, interval = 300, fast_interval = 60, fast_polls = 3, max_interval = None):
+    """
+    Class constructor.
+
+    @param interval: Base number of seconds between polls of a node
+    @param fast_interval: Number of seconds between polls of new and
+      flapping nodes
+    @param fast_polls: Number of polls performed at the fast interval
+    @param max_interval: Maximum number of seconds between polls of a node
+      (should be below RRD heartbeats, so no graph updates are lost)
+    """
+    if max_interval is not None:
+      interval = min(interval, max_interval)
+
+    self.interval = interval
+    self.fast_interval = min(fast_interval, interval)
+    self.fast_polls = fast_polls
+    self.queue = []
+    self.due_at = {}
+    self.state = {}
+    self.started = False
+
+  def __schedule(self, node_ip, due):
+    """
+    Sets a node's due time. Queue entries that no longer match the node's
+    due time are skipped when they are popped.
+    """
+    self.due_at[node_ip] = due
+    heapq.heappush(self.queue, (due, node_ip))
+
+  def offset(self, node_ip):
+    """
+    Returns the phase of a node within the base interval.
+
+    @param node_ip: Node's IP address
+    """
+    return (zlib.crc32(node_ip) & 0xffffffff) % max(1, int(self.interval))
+
+  def update(self, node_ips, now):
+    """
+    Synchronizes the set of scheduled nodes with visible nodes. Nodes seen
+    for the first time are polled right away and then at the fast interval
+    for a few polls, except on startup when all nodes are spread over the
+    base interval. Nodes that are no longer visible are forgotten.
+
+    @param node_ips: A list of IP addresses of visible nodes
+    @param now: Current UNIX timestamp
+    @return: A list of IP addresses of nodes that have been forgotten
+    """
+    visible = set(node_ips)
+    removed = [node_ip for node_ip in self.due_at if node_ip not in visible]
+    for node_ip in removed:
+      del self.due_at[node_ip]
+      del self.state[node_ip]
+
+    for node_ip in visible:
+      if node_ip in self.due_at:
+        continue
+
+      if self.started:
+        self.state[node_ip] = [None, self.fast_polls, None]
+        self.__schedule(node_ip, now)
+      else:
+        due = now - now % self.interval + self.offset(node_ip)
+        if due < now:
+          due += self.interval
+
+        self.state[node_ip] = [None, 0, None]
+        self.__schedule(node_ip, due)
+
+    self.started = True
+
+    # Drop stale entries once they dominate the queue
+    if len(self.queue) > 2 * len(self.due_at) + 64:
+      self.queue = [(node_due, node_ip) for node_ip, node_due in self.due_at.iteritems()]
+      heapq.heapify(self.queue)
+
+    return removed
+
+  def due(self, now):
+    """
+    Returns nodes that are due for polling. Returned nodes are already
+    rescheduled at the base interval, so they are polled again even when
+    processing fails; completed() adjusts the schedule afterwards.
+
+    @param now: Current UNIX timestamp
+    @return: A list of node IP addresses
+    """
+    nodes = []
+    while self.queue and self.queue[0][0] <= now:
+      due, node_ip = heapq.heappop(self.queue)
+      if self.due_at.get(node_ip) != due:
+        continue
+
+      nodes.append(node_ip)
+      self.state[node_ip][2] = due
+      self.__schedule(node_ip, self.__next(due, self.interval, now))
+
+    return nodes
+
+  def all(self, now):
+    """
+    Returns all scheduled nodes and treats them as due.
+
+    @param now: Current UNIX timestamp
+    @return: A list of node IP addresses
+    """
+    nodes = self.due_at.keys()
+    for node_ip in nodes:
+      self.state[node_ip][2] = now
+      self.__schedule(node_ip, now + self.interval)
+
+    return nodes
+
+  def __next(self, due, interval, now):
+    """
+    Returns the next due time after a poll that was due at the given time.
+    Nodes keep their phase, unless they are so late that this would
+    immediately make them due again.
+    """
+    return max(due + interval, now + interval // 2)
+
+  def completed(self, node_ip, status, now):
+    """
+    Reschedules a node once it has been polled.
+
+    @param node_ip: Node's IP address
+    @param status: Node status determined by the poll
+    @param now: Current UNIX timestamp
+    """
+    state = self.state.get(node_ip)
+    if state is None or state[2] is None:
+      return
+
+    last_status, fast, due = state
+    if last_status is not None and status != last_status:
+      fast = self.fast_polls
+
+    if fast > 0:
+      self.__schedule(node_ip, self.__next(due, self.fast_interval, now))
+      fast -= 1
+
+    state[:] = [status, fast, None]
+
+  def __len__(self):
+    return len(self.due_at)
@@ -0,0 +1,97 @@
+import bisect
+import hashlib
+import os
+import socket
+from datetime import datetime, timedelta
+
+from django.db import transaction
+
+from frontend.monitor.models import MonitorInstance
+
+class HashRing(object):
+  """
+  A consistent hash ring that assigns keys to members. Each member is
+  placed on the ring multiple times, so keys are distributed evenly and
+  only keys of a joining or leaving member change their owner.
+  """
+  def __init__(self, members, replicas = 100):
+    """
+    Class constructor.
+
+    @param members: A list of member names
+    @param replicas: Number of ring positions of each member
+    """
+    self.members = sorted(set(members))
+    self.ring = []
+    for member in self.members:
+      for i in xrange(replicas):
+        self.ring.append((self.__hash('%s:%d' % (member, i)), member))
+
+    self.ring.sort()
+    self.positions = [position for position, member in self.ring]
+
+  def __hash(self, key):
+    return long(hashlib.md5(key).hexdigest()[:16], 16)
+
+  def owner(self, key):
+    """
+    Returns the member that owns a key.
+
+    @param key: Key (like a node UUID)
+    @return: Member name or None when the ring is empty
+    """
+    if not self.ring:
+      return None
+
+    index = bisect.bisect(self.positions, self.__hash(key)) % len(self.ring)
+    return self.ring[index][1]
+
+class ShardMembership(object):
+  """
+  Tracks live monitor instances using heartbeats stored in the database.
+  Instances that have not sent a heartbeat for a while are considered to
+  have left, so their nodes are taken over by the remaining instances.
+  """
+  def __init__(self, name, timeout = 90):
+    """
+    Class constructor.
+
+    @param name: Unique name of this instance
+    @param timeout: Number of seconds after which an instance without
+      heartbeats is considered dead
+    """
+    self.name = name
+    self.timeout = timeout
+    self.members = []
+
+  @transaction.commit_on_success
+  def heartbeat(self):
+    """
+    Records a heartbeat of this instance.
+
+    @return: A tuple (members, changed) where members is a list of names
+      of live instances and changed is true when membership changed since
+      the previous heartbeat
+    """
+    now = datetime.now()
+    try:
+      instance = MonitorInstance.objects.get(name = self.name)
+    except MonitorInstance.DoesNotExist:
+      instance = MonitorInstance(name = self.name, started_at = now)
+
+    instance.host = socket.gethostname()
+    instance.pid = os.getpid()
+    instance.last_seen = now
+    instance.save()
+
+    members = sorted(MonitorInstance.objects.filter(last_seen__gte = now - timedelta(seconds = self.timeout)).values_list('name', flat = True))
+    changed = members != self.members
+    self.members = members
+    return members, changed
+
+  @transaction.commit_on_success
+  def leave(self):
+    """
+    Removes this instance, so its nodes are taken over immediately.
+    """
+    MonitorInstance.objects.filter(name = self.name).delete()
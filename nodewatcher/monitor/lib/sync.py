@@ -0,0 +1,457 @@
+from datetime import datetime, timedelta
+import time
+import uuid
+
+from frontend.nodes.models import Node, NodeStatus, NodeType, Subnet, SubnetStatus, Pool, Link, RenumberNotice, EventCode, EventSource, WarningCode
+from frontend.nodes.bulk import ChangeTracker, bulk_update, bulk_insert, bulk_delete
+from frontend.nodes.prefix_trie import PrefixTrie
+from frontend.nodes import data_archive
+
+class NetworkState(object):
+  """
+  Synchronizes the state of nodes, links and subnets with a snapshot of
+  the routing tables. All rows are loaded in a few queries, compared to
+  the snapshot in memory and only changed rows are written back using
+  batched statements.
+
+  All nodes are locked when they are loaded and stay locked until the
+  synchronization is committed. Node rows are locked in primary key order
+  before any other rows are written; workers that process polled nodes
+  (possibly in other monitor instances) lock their nodes the same way,
+  so the two can never deadlock.
+  """
+  def __init__(self, nodes, hna, warnings, events, delta = None):
+    """
+    Class constructor.
+
+    @param nodes: Topology information from the routing daemon
+    @param hna: Announce information from the routing daemon
+    @param warnings: WarningAccumulator instance for raised warnings
+    @param events: EventAggregator instance for generated events
+    @param delta: Optional TopologyDelta against the previous cycle, link
+      metrics are then only written for added and changed links
+    """
+    self.olsr_nodes = nodes
+    self.hna = hna
+    self.delta = delta
+    self.warnings = warnings
+    self.events = events
+    self.now = datetime.now()
+    self.tracker = ChangeTracker()
+    self.db_nodes = {}
+
+  def load(self):
+    """
+    Loads current nodes, links, subnets, renumber notices and peering
+    history from the database. Nodes are locked in primary key order.
+    """
+    self.nodes = {}
+    self.nodes_by_pk = {}
+    for node in Node.objects.select_for_update().order_by('pk'):
+      self.nodes[node.ip] = node
+      self.nodes_by_pk[node.pk] = node
+
+    self.links = {}
+    self.node_links = {}
+    for link in Link.objects.all():
+      link.src = self.nodes_by_pk[link.src_id]
+      link.dst = self.nodes_by_pk[link.dst_id]
+      self.links[(link.src_id, link.dst_id)] = link
+      self.node_links.setdefault(link.src_id, []).append(link)
+
+    self.subnets = {}
+    for subnet in Subnet.objects.all():
+      subnet.node = self.nodes_by_pk[subnet.node_id]
+      self.subnets.setdefault((subnet.node_id, subnet.subnet, subnet.cidr), subnet)
+
+    self.renumber_notices = {}
+    for notice in RenumberNotice.objects.all():
+      notice.node = self.nodes_by_pk[notice.node_id]
+      self.renumber_notices.setdefault(notice.original_ip, notice)
+
+    self.PeerHistory = Node.peer_history.through
+    self.peer_history = set(self.PeerHistory.objects.values_list('from_node_id', 'to_node_id'))
+
+    # Reset visibility and status flags (only in memory, just like all other
+    # changes they are only written when different from the stored state)
+    for obj in self.nodes.values():
+      self.tracker.track(obj)
+      obj.visible = False
+      obj.warnings = False
+      obj.conflicting_subnets = False
+
+    for obj in self.links.values() + self.subnets.values():
+      self.tracker.track(obj)
+      obj.visible = False
+
+  def sync_nodes(self):
+    """
+    Updates visibility of nodes seen by the routing daemon and creates
+    entries for unknown nodes.
+
+    @return: A tuple (db_nodes, nodes_to_ping) where db_nodes maps IPs of
+      all visible nodes to Node instances
+    """
+    nodes_to_ping = []
+    new_nodes = []
+
+    for node_ip, olsr_node in self.olsr_nodes.iteritems():
+      n = self.nodes.get(node_ip)
+      if n is not None:
+        n.visible = True
+        n.peers = len(olsr_node.links)
+
+        # If we have succeeded, add to list (if not invalid)
+        if not n.is_invalid():
+          if n.awaiting_renumber:
+            self.reset_renumbering(n)
+
+          nodes_to_ping.append(node_ip)
+        else:
+          n.last_seen = self.now
+
+          # Create a warning since node is not registered
+          self.warnings.add(n, WarningCode.UnregisteredNode)
+      else:
+        # Node does not exist, create an invalid entry for it
+        n = Node(ip = node_ip, status = NodeStatus.Invalid, last_seen = self.now)
+        n.pk = str(uuid.uuid4())
+        n.visible = True
+        n.node_type = NodeType.Unknown
+        n.peers = len(olsr_node.links)
+
+        # Check if there are any renumber notices for this IP address
+        notice = self.renumber_notices.get(node_ip)
+        if notice is not None:
+          n.status = NodeStatus.AwaitingRenumber
+          n.node_type = notice.node.node_type
+          n.awaiting_renumber = True
+
+        self.nodes[node_ip] = n
+        self.nodes_by_pk[n.pk] = n
+        new_nodes.append(n)
+
+      self.db_nodes[node_ip] = n
+
+    bulk_insert(Node, new_nodes)
+    for n in new_nodes:
+      self.tracker.track(n)
+
+      # Create an event and append a warning since an unknown node has appeared
+      self.warnings.add(n, WarningCode.UnregisteredNode)
+      self.events.add(n, EventCode.UnknownNodeAppeared, '', EventSource.Monitor)
+
+    return self.db_nodes, nodes_to_ping
+
+  def reset_renumbering(self, n):
+    """
+    Resets any status from awaiting renumber to invalid for nodes that
+    have been renumbered into the given node.
+
+    @param n: Renumbered Node instance
+    """
+    for original_ip, notice in self.renumber_notices.items():
+      if notice.node_id != n.pk:
+        continue
+
+      rn = self.nodes.get(original_ip)
+      if rn is not None and rn.status == NodeStatus.AwaitingRenumber:
+        rn.status = NodeStatus.Invalid
+        rn.node_type = NodeType.Unknown
+        rn.awaiting_renumber = False
+
+      notice.delete()
+      del self.renumber_notices[original_ip]
+
+    n.awaiting_renumber = False
+
+  def sync_topology(self):
+    """
+    Performs the rest of the synchronization after nodes have been
+    synchronized and writes all changes to the database.
+    """
+    self.check_renumbering()
+    self.mark_invisible_nodes()
+    self.sync_links()
+    self.sync_subnets()
+    self.remove_invisible_nodes()
+    bulk_update(self.tracker.changes())
+
+  def get_incoming_links(self):
+    """
+    Returns visible links grouped by their destination node. Must be
+    called after the topology has been synchronized.
+
+    @return: A dictionary mapping node primary keys to lists of links
+    """
+    incoming = {}
+    for link in self.links.values():
+      incoming.setdefault(link.dst.pk, []).append(link)
+
+    return incoming
+
+  def check_renumbering(self):
+    """
+    Adds a warning to all nodes that have been stuck in renumbering state
+    for over a week.
+    """
+    for notice in self.renumber_notices.values():
+      if notice.renumbered_at < self.now - timedelta(days = 7):
+        self.warnings.add(notice.node, WarningCode.LongRenumber)
+
+  def mark_invisible_nodes(self):
+    """
+    Marks invisible nodes as down.
+    """
+    for node in self.nodes.values():
+      if node.status in (NodeStatus.Invalid, NodeStatus.AwaitingRenumber):
+        continue
+
+      oldStatus = node.status
+      if node.ip not in self.db_nodes:
+        if node.status == NodeStatus.New:
+          node.status = NodeStatus.Pending
+        elif node.status != NodeStatus.Pending:
+          node.status = NodeStatus.Down
+
+      if oldStatus in (NodeStatus.Up, NodeStatus.Visible, NodeStatus.Duped) and node.status == NodeStatus.Down:
+        self.events.add(node, EventCode.NodeDown, '', EventSource.Monitor)
+
+        # Invalidate uptime credit for this node
+        node.uptime_last = None
+
+  def sync_links(self):
+    """
+    Synchronizes node peerings.
+    """
+    new_links = []
+    new_history = []
+    timestamp = self.now
+    snapshot_id = int(time.time())
+
+    for node_ip, olsr_node in self.olsr_nodes.iteritems():
+      n = self.db_nodes[node_ip]
+      n.redundancy_link = False
+      links = []
+
+      # Find old VPN server peers
+      old_vpn_peers = set([l.dst for l in self.node_links.get(n.pk, []) if l.dst.vpn_server])
+
+      for peerIp, lq, ilq, etx, vtime in olsr_node.links:
+        dst = self.db_nodes[peerIp]
+        l = self.links.get((n.pk, dst.pk))
+        if l is None:
+          l = Link(src = n, dst = dst)
+          self.links[(n.pk, dst.pk)] = l
+          new_links.append(l)
+          update_metrics = True
+        else:
+          # Metric changes below the threshold are not written
+          update_metrics = self.delta is None or self.delta.link_needs_update(node_ip, peerIp)
+
+        if update_metrics:
+          l.lq = float(lq)
+          l.ilq = float(ilq)
+          l.etx = float(etx)
+          l.vtime = float(vtime)
+
+        l.visible = True
+        links.append(l)
+
+        # Check if any of the peers has never peered with us before
+        if n.is_adjacency_important() and dst.is_adjacency_important() and (n.pk, dst.pk) not in self.peer_history:
+          for pair in ((n.pk, dst.pk), (dst.pk, n.pk)):
+            self.peer_history.add(pair)
+            new_history.append(self.PeerHistory(from_node_id = pair[0], to_node_id = pair[1]))
+
+          self.events.add(n, EventCode.AdjacencyEstablished, '', EventSource.Monitor,
+                          data = 'Peer node: %s' % dst, aggregate = False)
+          self.events.add(dst, EventCode.AdjacencyEstablished, '', EventSource.Monitor,
+                          data = 'Peer node: %s' % n, aggregate = False)
+
+        # Check if we have a peering with any VPN servers
+        if dst.vpn_server:
+          n.redundancy_link = True
+
+      if not n.is_invalid():
+        # Determine new VPN server peers
+        new_vpn_peers = set([link.dst for link in links if link.dst.vpn_server])
+
+        if old_vpn_peers != new_vpn_peers:
+          for p in old_vpn_peers:
+            if p not in new_vpn_peers:
+              # Redundancy loss has ocurred
+              self.events.add(n, EventCode.RedundancyLoss, '', EventSource.Monitor,
+                              data = 'VPN server: %s' % p)
+
+          for p in new_vpn_peers:
+            if p not in old_vpn_peers:
+              # Redundancy restoration has ocurred
+              self.events.add(n, EventCode.RedundancyRestored, '', EventSource.Monitor,
+                              data = 'VPN server: %s' % p)
+
+        # Issue a warning when node requires peering but has none
+        if n.redundancy_req and not n.redundancy_link:
+          self.warnings.add(n, WarningCode.NoRedundancy)
+
+      # Archive topology information
+      data_archive.record_topology_entry(snapshot_id, timestamp, n, links)
+
+    # Remove invisible links and write new ones
+    removed = [link for link in self.links.values() if not link.visible]
+    for link in removed:
+      self.tracker.forget(link)
+      del self.links[(link.src_id, link.dst_id)]
+
+    bulk_delete(Link, [link.pk for link in removed])
+    bulk_insert(Link, new_links)
+    bulk_insert(self.PeerHistory, new_history)
+
+  def sync_subnets(self):
+    """
+    Updates valid subnet status in the database.
+    """
+    # Determine subnet visibility and create entries for new announces
+    new_subnets = []
+    for node_ip, subnets in self.hna.iteritems():
+      if node_ip not in self.db_nodes:
+        continue
+
+      node = self.db_nodes[node_ip]
+      for subnet in subnets:
+        subnet, cidr = subnet.split("/")
+        key = (node.pk, subnet, int(cidr))
+        s = self.subnets.get(key)
+        if s is None:
+          s = Subnet(node = node, subnet = subnet, cidr = int(cidr), status = SubnetStatus.NotAllocated)
+          s.ip_subnet = '%s/%s' % (subnet, cidr)
+          s.allocated = False
+          self.subnets[key] = s
+          new_subnets.append(s)
+
+        s.last_seen = self.now
+        s.visible = True
+
+    # Remove (or change their status) subnets that are not visible
+    removed = []
+    for key, s in self.subnets.items():
+      if s.visible:
+        continue
+
+      if s.status == SubnetStatus.Hijacked:
+        # Remove subnets that were hijacked but are not visible anymore
+        self.events.add(s.node, EventCode.SubnetRestored, '', EventSource.Monitor, data = 'Subnet: %s/%s' % (s.subnet, s.cidr))
+        removed.append(s)
+      elif not s.allocated:
+        removed.append(s)
+      else:
+        s.status = SubnetStatus.NotAnnounced
+        if s.node.visible:
+          self.warnings.add(s.node, WarningCode.OwnNotAnnounced)
+
+    for s in removed:
+      self.tracker.forget(s)
+      del self.subnets[(s.node_id, s.subnet, s.cidr)]
+
+    # Write visibility changes, so announce checks below see a consistent state
+    bulk_delete(Subnet, [s.pk for s in removed])
+    bulk_insert(Subnet, new_subnets)
+    bulk_update(self.tracker.changes())
+
+    # New subnets have no primary keys yet, so reload all subnets and index
+    # their prefixes for classification of the visible ones
+    for s in self.subnets.values():
+      self.tracker.forget(s)
+
+    subnets = list(Subnet.objects.all())
+    self.subnet_index = PrefixTrie()
+    for s in subnets:
+      s.node = self.nodes_by_pk[s.node_id]
+      self.subnet_index.add('%s/%s' % (s.subnet, s.cidr), s)
+
+    self.pool_index = PrefixTrie()
+    for pool in Pool.objects.all():
+      self.pool_index.add('%s/%s' % (pool.network, pool.cidr), pool)
+
+    for s in subnets:
+      if s.visible:
+        self.tracker.track(s)
+        self.check_subnet(s)
+
+  def check_subnet(self, s):
+    """
+    Determines the status of an announced subnet.
+
+    @param s: A visible Subnet instance
+    """
+    prefix = '%s/%s' % (s.subnet, s.cidr)
+    supernets = self.subnet_index.contains(prefix)
+
+    # Save previous subnet status for later use
+    old_status = s.status
+
+    # Set status accoording to allocation flag
+    if s.allocated:
+      s.status = SubnetStatus.AnnouncedOk
+    else:
+      s.status = SubnetStatus.NotAllocated
+
+    # Check if this is a more specific prefix announce for an allocated prefix
+    if not s.allocated and [x for x in supernets if x.node_id == s.node_id and x.allocated]:
+      s.status = SubnetStatus.Subset
+
+    # Check if this is a hijack (subnet is contained in an allocated and visible
+    # subnet of another node)
+    origins = [x for x in supernets if x.node_id != s.node_id and x.allocated and x.visible]
+    if origins:
+      s.status = SubnetStatus.Hijacked
+
+    # Generate an event if status has changed
+    if old_status != s.status and s.status == SubnetStatus.Hijacked:
+      self.events.add(s.node, EventCode.SubnetHijacked, '', EventSource.Monitor,
+                      data = 'Subnet: %s/%s\n  Allocated to: %s' % (s.subnet, s.cidr, origins[0].node))
+
+    # Flag node entry with warnings flag for unregistered announces
+    if not s.is_properly_announced():
+      # Default route is never considered to be from a known pool
+      from_known_pool = s.cidr != 0 and len(self.pool_index.contains(prefix)) > 0
+      if s.node.border_router and not from_known_pool:
+        # TODO when we have peering announce registration this should first check if
+        #      the subnet is registered as a peering
+        s.status = SubnetStatus.Peering
+
+      if not s.node.border_router or s.status == SubnetStatus.Hijacked or from_known_pool:
+        # Add a warning message for unregistered announced subnets
+        self.warnings.add(s.node, WarningCode.UnregisteredAnnounce)
+
+    # Detect subnets that cause conflicts and raise warning flags for all involved
+    # nodes
+    if s.cidr == 0:
+      return
+
+    conflicting = [x for x in self.subnet_index.conflicts(prefix) if x.cidr != 0 and x.node_id != s.node_id]
+    if conflicting:
+      self.warnings.add(s.node, WarningCode.AnnounceConflict)
+      s.node.conflicting_subnets = True
+
+      for cs in conflicting:
+        self.warnings.add(cs.node, WarningCode.AnnounceConflict)
+        cs.node.conflicting_subnets = True
+
+  def remove_invisible_nodes(self):
+    """
+    Removes invisible unknown nodes.
+    """
+    removed = []
+    for node in self.nodes.values():
+      if node.visible or node.status not in (NodeStatus.Invalid, NodeStatus.AwaitingRenumber):
+        continue
+
+      if node.status == NodeStatus.Invalid:
+        # Create an event since an unknown node has disappeared
+        self.events.add(node, EventCode.UnknownNodeDisappeared, '', EventSource.Monitor)
+
+      self.tracker.forget(node)
+      removed.append(node)
+
+    bulk_delete(Node, [node.pk for node in removed])
@@ -1,15 +1,23 @@
+import hashlib
+import os
+import re
 import subprocess
 import logging
-from traceback import print_exc
+import threading
+from traceback import format_exc
 from frontend.nodes.models import NodeType
 
+# Matches node statements and their position in laid out dot output
+NODE_POSITION_RE = re.compile(r'^\s*"([^"]+)"\s*\[[^\]]*?\bpos="([-\d.e+]+),([-\d.e+]+)"', re.M | re.S)
+
 class DotTopologyPlotter:
   """
   A topology plotter with Dot (Graphviz) output.
   """
-  __output = None
+  __nodes = None
+  __links = None
   __edges = None
-  
+
   # Location of graphviz binary
   GRAPHVIZ_BIN = '/usr/bin/neato'
 
@@ -17,12 +25,17 @@ class DotTopologyPlotter:
     """
     Class constructor.
     """
-    self.__output = ""
+    self.__nodes = {}
+    self.__links = []
     self.__edges = {}
 
-  def addNode(self, node):
+  def addNode(self, node, links = None):
     """
     Adds a new node.
+
+    @param node: Node instance
+    @param links: Optional list of visible links towards this node with
+      their source nodes already resolved (queried when not given)
     """
     if node.system_node:
       color = "#FFCB05"
@@ -35,19 +48,20 @@ class DotTopologyPlotter:
         color = "#F26006"
       else:
         color = "#BFCB05"
-    
+
     if node.name:
       name = "%s\\n(%s)" % (node.name, node.ip)
     else:
       name = node.ip
-    
-    links = {}
+
+    if links is None:
+      links = [link for link in node.dst.select_related('src') if link.visible]
+
+    nodeLinks = {}
     linksEtx = {}
 
-    self.__output += '"%s" [label="%s",color="%s",style="filled"];\n' % (node.ip, name, color)
-    for link in node.dst.all():
-      if not link.visible:
-        continue
+    self.__nodes[node.ip] = 'label="%s",color="%s",style="filled"' % (name, color)
+    for link in links:
       if linksEtx.get(link.src.ip, 0) > link.etx:
         pass
       elif (node.ip, link.src.ip) in self.__edges or (link.src.ip, node.ip) in self.__edges:
@@ -65,23 +79,61 @@ class DotTopologyPlotter:
         weight = 0.7
         color = "red"
 
-      links[link.src.ip] = '"%s" -- "%s" [label="%s",color="%s",weight="%s"];\n' % (node.ip, link.src.ip, link.etx, color, weight)
+      nodeLinks[link.src.ip] = '"%s" -- "%s" [label="%s",color="%s",weight="%s"];\n' % (node.ip, link.src.ip, link.etx, color, weight)
       linksEtx[link.src.ip] = link.etx
       self.__edges[(node.ip, link.src.ip)] = link.etx
 
-    self.__output += "".join(links.values())
+    self.__links.extend(nodeLinks.values())
 
-  def save(self, filename_graph, filename_dot):
+  def digest(self):
+    """
+    Returns a canonical hash of the graph, which does not depend on the
+    order in which nodes have been added.
+    """
+    h = hashlib.sha1()
+    for ip in sorted(self.__nodes):
+      h.update('%s %s\n' % (ip, self.__nodes[ip]))
+
+    for link in sorted(self.__links):
+      h.update(link)
+
+    return h.hexdigest()
+
+  def output(self, positions = None):
+    """
+    Returns the graph in dot format.
+
+    @param positions: Optional dictionary mapping node IPs to initial
+      (x, y) positions in points
+    """
+    positions = positions or {}
+    out = []
+    for ip in sorted(self.__nodes):
+      attrs = self.__nodes[ip]
+      if ip in positions:
+        attrs += ',pos="%s,%s"' % positions[ip]
+
+      out.append('"%s" [%s];\n' % (ip, attrs))
+
+    out.extend(sorted(self.__links))
+    return "graph topology {\n%s}\n" % "".join(out)
+
+  def save(self, filename_graph, filename_dot, positions = None):
     """
     Saves generated graph to a PNG file.
 
     @param filename_graph: The filename of resulting graph image
     @param filename_dot: The filename of resulting graph dot file
+    @param positions: Optional dictionary mapping node IPs to initial
+      (x, y) positions, so the layout converges faster
+    @return: A dictionary mapping node IPs to their positions in the
+      new layout
     """
     dot = open(filename_dot, 'w')
-    dot.write("graph topology {\n%s}\n" % self.__output)
+    dot.write(self.output(positions))
     dot.close()
-    
+
+    filename_layout = filename_dot + '.layout'
     try:
       subprocess.check_call(
         [
@@ -89,9 +141,80 @@ class DotTopologyPlotter:
           '-Gfontpath=/usr/share/fonts/corefonts',
           '-Nfontname=verdana', '-Nfontsize=12',
           '-Efontname=verdana', '-Efontsize=10', '-Elen=3', '-Earrowsize=1',
+          '-s',
           '-o', filename_graph,
+          '-Tdot', '-o', filename_layout,
           filename_dot
         ]
       )
+
+      layout = open(filename_layout)
+      try:
+        return dict([(ip, (x, y)) for ip, x, y in NODE_POSITION_RE.findall(layout.read())])
+      finally:
+        layout.close()
     except:
-      logging.warning(print_exc())
+      logging.warning(format_exc())
+      return {}
+
+class TopologyRenderer(threading.Thread):
+  """
+  Renders topology graphs in a background thread. Only the most recently
+  submitted graph is rendered and rendering is skipped when the graph
+  has not changed since the last render. Node positions of the previous
+  layout are used as a starting point for the next one.
+  """
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    super(TopologyRenderer, self).__init__(name = "topology")
+    self.daemon = True
+    self.positions = {}
+    self.last_digest = None
+    self.__pending = None
+    self.__wakeup = threading.Condition()
+
+  def submit(self, plotter, filename_graph, filename_dot):
+    """
+    Requests a graph to be rendered. When the renderer thread is not
+    running the graph is rendered immediately.
+
+    @param plotter: DotTopologyPlotter instance
+    @param filename_graph: The filename of resulting graph image
+    @param filename_dot: The filename of resulting graph dot file
+    """
+    if not self.is_alive():
+      self.render(plotter, filename_graph, filename_dot)
+      return
+
+    with self.__wakeup:
+      self.__pending = (plotter, filename_graph, filename_dot)
+      self.__wakeup.notify()
+
+  def render(self, plotter, filename_graph, filename_dot):
+    """
+    Renders a graph unless it is the same as the last rendered one.
+    """
+    digest = plotter.digest()
+    if digest == self.last_digest and os.path.exists(filename_graph):
+      return
+
+    positions = plotter.save(filename_graph, filename_dot, self.positions)
+    if positions:
+      self.positions = positions
+      self.last_digest = digest
+
+  def run(self):
+    while True:
+      with self.__wakeup:
+        while self.__pending is None:
+          self.__wakeup.wait()
+
+        job, self.__pending = self.__pending, None
+
+      try:
+        self.render(*job)
+      except:
+        logging.warning("Failed to render network topology!")
+        logging.warning(format_exc())
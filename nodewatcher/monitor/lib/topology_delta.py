@@ -0,0 +1,134 @@
+import logging
+
+class TopologySnapshot(object):
+  """
+  A compact copy of link metrics parsed from the routing daemon. Link
+  metrics in a snapshot are the ones that have last been written to the
+  database, so small changes can not accumulate unnoticed.
+  """
+  def __init__(self, links):
+    """
+    Class constructor.
+
+    @param links: A dictionary mapping (src IP, dst IP) to (lq, ilq, etx)
+    """
+    self.links = links
+
+class TopologyDelta(object):
+  """
+  Differences between link metrics of two consecutive topology
+  snapshots. Nodes and announces are always fully reconciled, as their
+  state also depends on changes made through the web interface.
+  """
+  def __init__(self, snapshot, full = False):
+    """
+    Class constructor.
+
+    @param snapshot: The new TopologySnapshot
+    @param full: True when there was no previous snapshot
+    """
+    self.snapshot = snapshot
+    self.full = full
+    self.links_added = set()
+    self.links_removed = set()
+    self.links_changed = set()
+
+  def link_needs_update(self, src_ip, dst_ip):
+    """
+    Returns true when metrics of the given link should be written.
+
+    @param src_ip: Source node IP
+    @param dst_ip: Destination node IP
+    """
+    if self.full:
+      return True
+
+    key = (src_ip, dst_ip)
+    return key in self.links_added or key in self.links_changed
+
+  def summary(self):
+    """
+    Returns a short human readable description of this delta.
+    """
+    if self.full:
+      return "full synchronization"
+
+    return "+%d/-%d/~%d links" % (len(self.links_added), len(self.links_removed), len(self.links_changed))
+
+class TopologyHistory(object):
+  """
+  Keeps the last synchronized topology in memory between monitor cycles
+  and computes deltas against it.
+  """
+  def __init__(self, threshold = 0.05):
+    """
+    Class constructor.
+
+    @param threshold: Minimum change of link quality (absolute) or ETX
+      (relative) that is considered a link change
+    """
+    self.threshold = threshold
+    self.previous = None
+
+  def __metrics_changed(self, old, new):
+    """
+    Returns true when link metrics differ by more than the threshold.
+    """
+    lq, ilq, etx = old
+    new_lq, new_ilq, new_etx = new
+    if abs(new_lq - lq) > self.threshold or abs(new_ilq - ilq) > self.threshold:
+      return True
+
+    return abs(new_etx - etx) > self.threshold * max(etx, 1.0)
+
+  def compute(self, nodes):
+    """
+    Computes a delta between the last accepted topology and the given
+    one. The delta does not become the new reference until it is
+    accepted.
+
+    @param nodes: Topology information from the routing daemon
+    @return: A TopologyDelta instance, which is a full one when there is
+      no previous topology and everything must be synchronized
+    """
+    previous = self.previous
+    links = {}
+    for node_ip, olsr_node in nodes.iteritems():
+      for peer_ip, lq, ilq, etx, vtime in olsr_node.links:
+        links[(node_ip, peer_ip)] = (float(lq), float(ilq), float(etx))
+
+    snapshot = TopologySnapshot(links)
+    if previous is None:
+      return TopologyDelta(snapshot, full = True)
+
+    delta = TopologyDelta(snapshot)
+    for key, metrics in links.iteritems():
+      old = previous.links.get(key)
+      if old is None:
+        delta.links_added.add(key)
+      elif self.__metrics_changed(old, metrics):
+        delta.links_changed.add(key)
+      else:
+        # Keep the stored metrics as reference for the next cycle
+        links[key] = old
+
+    delta.links_removed = set(previous.links.keys()) - set(links.keys())
+    return delta
+
+  def accept(self, delta):
+    """
+    Makes the topology of the given delta the reference for the next
+    cycle. This should only be called after the delta has been
+    successfully written to the database.
+
+    @param delta: A TopologyDelta instance
+    """
+    self.previous = delta.snapshot
+    logging.info("Topology delta: %s" % delta.summary())
+
+  def reset(self):
+    """
+    Forgets the previous topology, so the next cycle performs a full
+    synchronization.
+    """
+    self.previous = None
@@ -1,8 +1,12 @@
 # XXX Do NOT use urllib2 here as it causes memory leaks!
+import os
 import re
+import select
 import urllib
 import subprocess
 import logging
+import time
+from collections import namedtuple
 from traceback import format_exc
 
 # A flag that specifies when we should save fetched data for simulation purpuses
@@ -11,118 +15,207 @@ COLLECT_SIMULATION_DATA = False
 # Location of fping binary
 FPING_BIN = '/usr/sbin/fping'
 
+# Number of bytes read from the routing daemon at once
+READ_CHUNK_SIZE = 65536
+
+# A single link as reported by the routing daemon (metrics are floats)
+OlsrLink = namedtuple('OlsrLink', 'dst lq ilq etx vtime')
+
 class OlsrNode(object):
   """
   A simple class used for containing topology information received
   from the routing daemon.
   """
-  ip = None
-  links = None
+  __slots__ = ('ip', 'links')
 
-  def __init__(self):
+  def __init__(self, ip = None):
+    self.ip = ip
     self.links = []
 
-def create_node(ip, nodes, hna):
+class TablesParser(object):
   """
-  Creates a new OlsrNode instance with specified parameters.
+  An incremental parser for OLSR txtinfo output. Data may be fed in
+  arbitrary chunks, so the routing tables never have to be held in
+  memory as a whole. IP addresses are interned, so each address is only
+  stored once no matter how many links and announces reference it.
   """
-  if not nodes.has_key(ip):
-    node = OlsrNode()
-    node.ip = ip
-    nodes[ip] = node
+  def __init__(self):
+    """
+    Class constructor.
+    """
+    self.nodes = {}
+    self.hna = {}
+    self.__table = None
+    self.__head = False
+    self.__buffer = ''
 
-    # Treat node entry as /32 HNA
-    l = hna.setdefault(ip, [])
-    l.append('%s/32' % ip)
-  else:
-    node = nodes[ip]
+  def __node(self, ip):
+    """
+    Returns an OlsrNode instance for the given IP, creating it when
+    needed. Node IPs are interned, so links can reference them.
+    """
+    node = self.nodes.get(ip)
+    if node is None:
+      ip = intern(ip)
+      node = self.nodes[ip] = OlsrNode(ip)
 
-  return node
+      # Treat node entry as /32 HNA
+      self.hna.setdefault(ip, []).append('%s/32' % ip)
 
-def parse_tables(data):
-  """
-  Parses the OLSR routing tables.
-  """
-  isTable = False
-  isTableHead = False
-  currentTable = ''
+    return node
 
-  nodes = {}
-  hna = {}
+  def feed(self, data):
+    """
+    Parses a chunk of txtinfo output.
 
-  for line in data.splitlines():
-    line = line.strip()
-    if line[0:6] == 'Table:' and line[7:] in ('Topology', 'HNA', 'MID'):
-      isTable = True
-      isTableHead = True
-      currentTable = line[7:]
-      continue
-    
-    if isTable and isTableHead:
-      isTableHead = False
-      continue
-    
-    if isTable and not line:
-      isTable = False
-      currentTable = ''
-      continue
-    
-    if currentTable == 'Topology':
-      try:
-        dstIp, srcIp, LQ, ILQ, ETX, vtime = line.split('\t')
-      except ValueError:
-        dstIp, srcIp, LQ, ILQ, ETX = line.split('\t')
-        vtime = 0.0
+    @param data: Data chunk
+    """
+    lines = (self.__buffer + data).split('\n')
+    self.__buffer = lines.pop()
+    self.parse_lines(lines)
 
-      try:
-        if not float(ETX):
-          continue
-      except ValueError:
-        # Newer OLSR versions can use INFINITE as ETX
+  def close(self):
+    """
+    Parses any remaining buffered data.
+
+    @return: A tuple (nodes, hna)
+    """
+    if self.__buffer:
+      self.parse_lines([self.__buffer])
+      self.__buffer = ''
+
+    return self.nodes, self.hna
+
+  def parse_lines(self, lines):
+    """
+    Parses complete lines of txtinfo output.
+
+    @param lines: A list of output lines
+    """
+    table = self.__table
+    head = self.__head
+    get_node = self.__node
+    new_link = tuple.__new__
+
+    for line in lines:
+      line = line.strip()
+      if line[0:6] == 'Table:' and line[7:] in ('Topology', 'HNA', 'MID'):
+        table = line[7:]
+        head = True
         continue
 
-      srcNode = create_node(srcIp, nodes, hna)
-      dstNode = create_node(dstIp, nodes, hna)
+      if table is None:
+        continue
 
-      srcNode.links.append((dstIp, LQ, ILQ, ETX, vtime))
-    elif currentTable == 'HNA':
-      network, gwIp = line.split('\t')[0:2]
-      network, cidr = network.split('/')
+      if head:
+        head = False
+        continue
 
-      node = hna.setdefault(gwIp, [])
-      node.append('%s/%s' % (network, cidr))
-    elif currentTable == 'MID':
-      ip, alias = line.split('\t')[0:2]
-      alias = alias.split(';')
+      if not line:
+        table = None
+        continue
 
-      # Treat MIDs as /32 HNAs
-      for x in alias:
-        l = hna.setdefault(ip, [])
-        l.append('%s/32' % x)
-  
-  return nodes, hna
+      if table == 'Topology':
+        fields = line.split('\t')
+        try:
+          etx = float(fields[4])
+        except ValueError:
+          # Newer OLSR versions can use INFINITE as ETX
+          continue
+
+        if not etx:
+          continue
+
+        src = get_node(fields[1])
+        dst = get_node(fields[0])
+        vtime = float(fields[5]) if len(fields) > 5 else 0.0
+        src.links.append(new_link(OlsrLink, (dst.ip, float(fields[2]), float(fields[3]), etx, vtime)))
+      elif table == 'HNA':
+        network, gw_ip = line.split('\t')[0:2]
+        self.hna.setdefault(intern(gw_ip), []).append(network)
+      elif table == 'MID':
+        ip, alias = line.split('\t')[0:2]
+
+        # Treat MIDs as /32 HNAs
+        l = self.hna.setdefault(intern(ip), [])
+        for x in alias.split(';'):
+          l.append('%s/32' % x)
+
+    self.__table = table
+    self.__head = head
+
+def parse_tables(data):
+  """
+  Parses the OLSR routing tables.
+
+  @param data: Complete txtinfo output
+  @return: A tuple (nodes, hna)
+  """
+  parser = TablesParser()
+  parser.feed(data)
+  return parser.close()
 
 def get_tables(olsr_ip = "127.0.0.1"):
   """
-  Parses OLSR tables to extract topology and announce infos.
+  Parses OLSR tables to extract topology and announce infos. Tables are
+  parsed while they are being received.
 
   @param olsr_ip: IP address of the router instance
   """
   try:
-    data = urllib.urlopen('http://%s:2006' % olsr_ip).read()
+    parser = TablesParser()
+    stream = urllib.urlopen('http://%s:2006' % olsr_ip)
+    simulation = None
     if COLLECT_SIMULATION_DATA:
       try:
-        f = open("simulator/data/olsr.txt", 'w')
-        f.write(data)
-        f.close()
+        simulation = open("simulator/data/olsr.txt", 'w')
       except IOError:
         pass
-    
-    return parse_tables(data)
+
+    try:
+      while True:
+        data = stream.read(READ_CHUNK_SIZE)
+        if not data:
+          break
+
+        parser.feed(data)
+        if simulation is not None:
+          simulation.write(data)
+    finally:
+      stream.close()
+      if simulation is not None:
+        simulation.close()
+
+    return parser.close()
   except:
     logging.warning(format_exc())
     return None
 
+def parse_fping_line(line, results, dupes):
+  """
+  Parses a single line of fping output.
+  
+  @param line: Output line
+  @param results: Dictionary where host results are stored
+  @param dupes: Dictionary where hosts with duplicate replies are stored
+  """
+  line = line.split()
+  if not line:
+    return
+  
+  hostIp = line[0]
+  if "duplicate" in line:
+    dupes[hostIp] = True
+    return
+
+  try:
+    rcv = line[4].split('/')
+    min, avg, max = line[7].split('/')
+    loss = int(rcv[2].split('%')[0])
+    results[hostIp] = (min, avg, max, loss)
+  except:
+    pass
+
 def parse_fping(data):
   """
   Parses fping results.
@@ -131,50 +224,103 @@ def parse_fping(data):
   dupes = {}
   
   for line in data.splitlines():
-    line = line.split()
-    hostIp = line[0]
-    up = False
-    
-    if "duplicate" in line:
-      dupes[hostIp] = True
-      continue
-
-    try:
-      rcv = line[4].split('/')
-      min, avg, max = line[7].split('/')
-      loss = int(rcv[2].split('%')[0])
-      results[hostIp] = (min, avg, max, loss)
-    except:
-      pass
+    parse_fping_line(line, results, dupes)
   
   return (results, dupes)
 
-def ping_hosts(count, hosts, packet_size = 56):
+def probe_hosts(count, hosts, packet_sizes, rate = None, durations = None):
   """
-  Pings specified hosts in parallel using fping.
+  Probes specified hosts with ICMP ECHO packets of multiple sizes in a
+  single sweep. One fping process is started for each packet size at the
+  same time, so probes of different sizes are interleaved, and output of
+  all processes is parsed line by line as it streams in.
   
-  @param count: Number of ICMP ECHO packets to send
+  @param count: Number of ICMP ECHO packets to send per packet size
   @param hosts: A list of host IP addresses
+  @param packet_sizes: A list of ICMP payload sizes
+  @param rate: Total send rate in packets per second shared by all packet
+    sizes (None for fping default)
+  @param durations: An optional dictionary that receives the number of
+    seconds each packet size took to complete
+  @return: A dictionary mapping packet sizes to (results, dupes) tuples
   """
+  probes = {}
+  for packet_size in packet_sizes:
+    probes[packet_size] = ({}, {})
+  
   if not hosts:
-    return {}, {}
+    return probes
   
-  # Spawn the fping process to ping hosts in parallel
-  process = subprocess.Popen(
-    [FPING_BIN, '-c', str(count), '-q', '-b%d' % packet_size] + hosts,
-    stdout = subprocess.PIPE,
-    stderr = subprocess.PIPE
-  )
+  # Split the send rate between concurrently running processes
+  interval = []
+  if rate:
+    interval = ['-i', str(max(1, int(1000 * len(probes) / rate)))]
+  
+  # Spawn all fping processes and parse their output as it arrives
+  streams = {}
+  devnull = open(os.devnull, 'w')
+  start = time.time()
+  try:
+    for packet_size in probes:
+      process = subprocess.Popen(
+        [FPING_BIN, '-c', str(count), '-q', '-b%d' % packet_size] + interval + hosts,
+        stdout = devnull,
+        stderr = subprocess.PIPE
+      )
+      streams[process.stderr.fileno()] = [process, packet_size, '']
+    
+    collected = []
+    while streams:
+      readable, _, _ = select.select(streams.keys(), [], [])
+      for fd in readable:
+        stream = streams[fd]
+        data = os.read(fd, 4096)
+        if not data:
+          # Process has finished, parse any remaining partial line
+          results, dupes = probes[stream[1]]
+          parse_fping_line(stream[2], results, dupes)
+          stream[0].stderr.close()
+          stream[0].wait()
+          del streams[fd]
+          if durations is not None:
+            durations[stream[1]] = time.time() - start
+          continue
+        
+        lines = (stream[2] + data).split('\n')
+        stream[2] = lines.pop()
+        results, dupes = probes[stream[1]]
+        for line in lines:
+          parse_fping_line(line, results, dupes)
+        
+        if COLLECT_SIMULATION_DATA and stream[1] == packet_sizes[0]:
+          collected.append(data)
+  finally:
+    devnull.close()
+    for process, packet_size, buf in streams.values():
+      try:
+        process.kill()
+        process.wait()
+      except OSError:
+        pass
   
-  # Parse results
-  data = process.stderr.read()
   if COLLECT_SIMULATION_DATA:
     try:
       f = open("simulator/data/fping.txt", 'w')
-      f.write(data)
+      f.write("".join(collected))
       f.close()
     except IOError:
       pass
   
-  return parse_fping(data)
+  return probes
 
+def ping_hosts(count, hosts, packet_size = 56):
+  """
+  Pings specified hosts in parallel using fping.
+  
+  @param count: Number of ICMP ECHO packets to send
+  @param hosts: A list of host IP addresses
+  """
+  if not hosts:
+    return {}, {}
+  
+  return probe_hosts(count, hosts, [packet_size])[packet_size]
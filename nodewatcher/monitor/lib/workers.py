@@ -0,0 +1,177 @@
+import logging
+import multiprocessing
+import signal
+from traceback import format_exc
+
+from django.db import transaction, connection, connections
+
+# Database connections inherited from the parent process, kept alive in workers
+INHERITED_CONNECTIONS = []
+
+def worker_init():
+  """
+  Initializes a freshly forked worker process. Database connections
+  inherited from the parent must not be used or closed, as that would
+  also terminate the parent's session. Even dropping the last reference
+  closes them (psycopg2 sends a terminate message when a connection is
+  deallocated), so they are moved aside and kept for the lifetime of the
+  worker. Each worker opens its own connection on first use. Workers are
+  always terminated by SIGTERM, even when the parent handles it.
+  """
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  for conn in connections.all():
+    if conn.connection is not None:
+      INHERITED_CONNECTIONS.append(conn.connection)
+      conn.connection = None
+
+def process_chunk(function, chunk, lock = None):
+  """
+  Processes a chunk of items. Failures of individual items are logged
+  and rolled back without affecting other items of the chunk. The whole
+  chunk is processed in a single transaction when the database supports
+  savepoints (like PostgreSQL), otherwise (like SQLite) every item is
+  processed in its own transaction.
+
+  Rows locked by items are held until the end of the transaction, so a
+  chunk that locked them one by one could deadlock with other processes
+  locking the same rows in a different order. The lock callable should
+  therefore lock all rows needed by the items of a transaction up front,
+  in a consistent order.
+
+  @param function: Function that processes a single item
+  @param chunk: A list of argument tuples
+  @param lock: Optional callable that is called with a list of argument
+    tuples at the start of each transaction
+  @return: A list of results of successfully processed items
+  """
+  # Some backends only detect savepoint support once they are connected
+  connection.cursor()
+  if connection.features.uses_savepoints:
+    return process_savepoints(function, chunk, lock)
+
+  results = []
+  for args in chunk:
+    try:
+      results.append(process_item(function, args, lock))
+    except:
+      logging.warning(format_exc())
+
+  return results
+
+@transaction.commit_on_success
+def process_savepoints(function, chunk, lock = None):
+  """
+  Processes a chunk of items in a single transaction with a savepoint
+  for every item.
+
+  @param function: Function that processes a single item
+  @param chunk: A list of argument tuples
+  @param lock: Optional callable that locks rows of all items
+  @return: A list of results of successfully processed items
+  """
+  transaction.set_dirty()
+  if lock is not None:
+    lock(chunk)
+
+  results = []
+  for args in chunk:
+    sid = transaction.savepoint()
+    try:
+      results.append(function(*args))
+      transaction.savepoint_commit(sid)
+    except:
+      transaction.savepoint_rollback(sid)
+      logging.warning(format_exc())
+
+  return results
+
+@transaction.commit_on_success
+def process_item(function, args, lock = None):
+  """
+  Processes a single item in its own transaction.
+
+  @param function: Function that processes a single item
+  @param args: Argument tuple
+  @param lock: Optional callable that locks rows of the item
+  @return: Result of the function
+  """
+  transaction.set_dirty()
+  if lock is not None:
+    lock([args])
+
+  return function(*args)
+
+def run_chunk(task):
+  """
+  Worker entry point for a (function, chunk, lock) task.
+  """
+  return process_chunk(*task)
+
+class WorkerPool(object):
+  """
+  A persistent pool of worker processes that processes items in chunks.
+  Results are streamed back as soon as each chunk completes. Workers
+  are recycled after a configurable number of chunks, so memory leaks
+  stay bounded without restarting the daemon.
+  """
+  def __init__(self, processes, chunk_size = 10, max_tasks = None):
+    """
+    Class constructor.
+
+    @param processes: Number of worker processes
+    @param chunk_size: Maximum number of items dispatched together
+    @param max_tasks: Number of chunks after which a worker is replaced
+      (None means workers are never replaced)
+    """
+    self.chunk_size = chunk_size
+    self.pool = multiprocessing.Pool(
+      processes = processes,
+      initializer = worker_init,
+      maxtasksperchild = max_tasks
+    )
+
+  def __chunks(self, function, items, lock):
+    """
+    Groups items from an iterable into chunks as they arrive.
+    """
+    chunk = []
+    for args in items:
+      chunk.append(args)
+      if len(chunk) >= self.chunk_size:
+        yield function, chunk, lock
+        chunk = []
+
+    if chunk:
+      yield function, chunk, lock
+
+  def imap_unordered(self, function, items, lock = None):
+    """
+    Processes items in worker processes. Items are consumed from the
+    iterable (which may block) in a background thread, so results of
+    completed chunks are available while later items are still arriving.
+
+    @param function: A module level function that processes one item
+    @param items: An iterable of argument tuples
+    @param lock: Optional module level function that locks rows of the
+      items of a transaction up front (see process_chunk)
+    @return: An iterator over results in completion order
+    """
+    iterator = self.pool.imap_unordered(run_chunk, self.__chunks(function, items, lock))
+    while True:
+      try:
+        results = iterator.next()
+      except StopIteration:
+        break
+      except:
+        # A failed chunk must not prevent results of other chunks from being collected
+        logging.warning(format_exc())
+        continue
+
+      for result in results:
+        yield result
+
+  def terminate(self):
+    """
+    Terminates all worker processes.
+    """
+    self.pool.terminate()
@@ -26,6 +26,16 @@ parser.add_option('--update-rrd-opts', dest = 'update_rrd_opts', help = 'Update
 parser.add_option('--reverse-populate', dest = 'reverse_populate', help = 'Reverse populate RRD with data from a database', action = 'store_true')
 parser.add_option('--reverse-populate-node', dest = 'rp_node', help = 'Node to populate data for')
 parser.add_option('--reverse-populate-graph', dest = 'rp_graph', help = 'Graph type to populate data for')
+parser.add_option('--benchmark', dest = 'benchmark', help = 'Benchmark monitor cycles on a synthetic mesh (only used for development, creates nodes in the database)', action = 'store_true')
+parser.add_option('--benchmark-nodes', dest = 'benchmark_nodes', help = 'Number of nodes in the synthetic mesh', type = 'int', default = 1000)
+parser.add_option('--benchmark-cycles', dest = 'benchmark_cycles', help = 'Number of measured cycles', type = 'int', default = 5)
+parser.add_option('--benchmark-seed', dest = 'benchmark_seed', help = 'Random seed of the synthetic mesh', type = 'int', default = 0)
+parser.add_option('--benchmark-churn', dest = 'benchmark_churn', help = 'Probability that a node changes its state between cycles', type = 'float', default = 0.02)
+parser.add_option('--benchmark-output', dest = 'benchmark_output', help = 'Save benchmark results to a file')
+parser.add_option('--benchmark-baseline', dest = 'benchmark_baseline', help = 'Compare benchmark results with results saved by an earlier run')
+parser.add_option('--coordinator', dest = 'coordinator', help = 'Only synchronize routing tables and perform network-wide checks, nodes are polled by shards', action = 'store_true')
+parser.add_option('--shard', dest = 'shard', help = 'Only poll nodes owned by this monitor instance (instance name must be unique)')
+parser.add_option('--metrics-port', dest = 'metrics_port', help = 'Serve monitor metrics on this port (overrides settings file)', type = 'int')
 options, args = parser.parse_args()
 
 if not options.path:
@@ -40,15 +50,18 @@ elif options.reverse_populate and (not options.rp_node or not options.rp_graph):
   print "ERROR: Reverse populate requires node and graph type!\n"
   parser.print_help()
   exit(1)
+elif options.coordinator and options.shard:
+  print "ERROR: Monitor instance cannot be both a coordinator and a shard!\n"
+  parser.print_help()
+  exit(1)
 
 # Setup import paths, since we are using Django models
 sys.path.append(os.path.abspath(options.path))
 os.environ['DJANGO_SETTINGS_MODULE'] = options.settings
 
 # Import our models
-from frontend.nodes.models import Node, NodeStatus, Subnet, SubnetStatus, APClient, Link, GraphType, GraphItem, Event, EventSource, EventCode, IfaceType, InstalledPackage, NodeType, RenumberNotice, WarningCode, NodeWarning, Tweet
+from frontend.nodes.models import Node, NodeStatus, APClient, GraphType, GraphItem, Event, EventSource, EventCode, IfaceType, NodeType, WarningCode, NodeWarning, Tweet, Project
 from frontend.generator.models import Template, Profile
-from frontend.nodes import data_archive
 from django.db import transaction, models, connection
 from django.conf import settings
 
@@ -57,7 +70,7 @@ if options.olsr_host:
   settings.MONITOR_OLSR_HOST = options.olsr_host
 
 # Import other stuff
-if getattr(settings, 'MONITOR_ENABLE_SIMULATION', None) or options.stress_test:
+if getattr(settings, 'MONITOR_ENABLE_SIMULATION', None) or options.stress_test or options.benchmark:
   from simulator import nodewatcher, wifi_utils
 else:
   from lib import nodewatcher, wifi_utils
@@ -68,7 +81,22 @@ else:
 
 from frontend.monitor.rrd import *
 from frontend.monitor import graphs
-from lib.topology import DotTopologyPlotter
+from lib.topology import DotTopologyPlotter, TopologyRenderer
+from lib.pipeline import StageTimer, BackgroundStage, NodeCollector
+from lib.sync import NetworkState
+from lib.topology_delta import TopologyHistory
+from lib.workers import WorkerPool
+from lib.node_warnings import WarningAccumulator
+from lib.node_events import EventAggregator
+from lib.outbox import OutboxSender
+from lib.report_state import ReportState
+from lib.link_metrics import LinkMetrics, topology_links, NUMPY_ENABLED
+from lib.packages import PackageRefreshSchedule, sync_installed_packages
+from lib.clients import SubnetMatcher, sync_ap_clients, CLIENT_EXPIRY
+from lib.metrics import Metrics, MetricsServer, QueryCounter, get_rss
+from lib.scheduler import NodeScheduler
+from lib.sharding import HashRing, ShardMembership
+from lib.push import ReportBuffer, HTTPPushReceiver, UDPPushReceiver
 from lib import ipcalc
 from time import sleep
 from datetime import datetime, timedelta
@@ -78,7 +106,6 @@ import logging
 import time
 import multiprocessing
 import gc
-import struct
 
 if Tweet.tweets_enabled():
   from lib import bitly
@@ -86,72 +113,77 @@ if Tweet.tweets_enabled():
 
 WORKER_POOL = None
 
-def safe_int_convert(integer):
-  """
-  A helper method for converting a string to an integer.
-  """
-  try:
-    return int(integer)
-  except:
-    return None
-
-def safe_float_convert(value, precision = 3):
-  """
-  A helper method for converting a string to a float.
-  """
-  try:
-    return round(float(value), precision)
-  except:
-    return None
-
-def safe_loadavg_convert(loadavg):
-  """
-  A helper method for converting a string to a loadavg tuple.
-  """
-  try:
-    loadavg = loadavg.split(' ')
-    la1min, la5min, la15min = (float(x) for x in loadavg[0:3])
-    nproc = int(loadavg[3].split('/')[1])
-    return la1min, la5min, la15min, nproc
-  except:
-    return None, None, None, None
-
-def safe_uptime_convert(uptime):
-  """
-  A helper method for converting a string to an uptime integer.
-  """
-  try:
-    return int(float(uptime.split(' ')[0]))
-  except:
-    return None
-
-def safe_date_convert(timestamp):
-  """
-  A helper method for converting a string timestamp into a datetime
-  object.
-  """
-  try:
-    return datetime.fromtimestamp(int(timestamp))
-  except:
-    return None
-
-def safe_dbm_convert(dbm):
-  """
-  A helper method for converting a string into a valid dBm integer
-  value. This also takes care of unsigned/signed char conversions.
-  """
-  try:
-    dbm = safe_int_convert(dbm)
-    if dbm is None:
-      return None
-    
-    if dbm > 127:
-      # Convert from unsigned char into signed one
-      dbm = struct.unpack("b", struct.pack("<i", dbm)[0])[0]
-    
-    return dbm
-  except:
-    return None
+# Topology of the previous cycle, used for computing topology deltas
+TOPOLOGY_HISTORY = TopologyHistory(threshold = getattr(settings, 'MONITOR_LINK_THRESHOLD', 0.05))
+
+# Topology graphs are rendered in the background once the renderer is started
+TOPOLOGY_RENDERER = TopologyRenderer()
+
+# Results of per-node checks of the last poll of each node (keyed by node IP)
+REPORT_STATES = {}
+
+# Warnings raised by the last poll of each node (keyed by node IP) and by the last
+# routing table synchronization, carried forward until they are raised again
+NODE_WARNINGS = {}
+SYNC_WARNINGS = []
+
+# Digests of installed package listings that have last been applied to the inventory of each node
+PACKAGE_DIGESTS = {}
+
+# Warnings raised by routing table synchronization (managed by the coordinator when
+# the monitor is sharded, all other warnings are managed by shards polling the nodes)
+SYNC_WARNING_CODES = (
+  WarningCode.AnnounceConflict,
+  WarningCode.LongRenumber,
+  WarningCode.NoRedundancy,
+  WarningCode.OwnNotAnnounced,
+  WarningCode.UnregisteredAnnounce,
+  WarningCode.UnregisteredNode,
+)
+
+# Nodes are polled on their own schedule, but never less often than RRD heartbeats allow
+SCHEDULER = NodeScheduler(
+  interval = settings.MONITOR_POLL_INTERVAL,
+  fast_interval = getattr(settings, 'MONITOR_FAST_POLL_INTERVAL', 60),
+  max_interval = min([source.heartbeat for conf in graphs.RRA_CONF_MAP.values() for source in conf.sources]) - getattr(settings, 'MONITOR_SCHEDULER_TICK', 30)
+)
+
+# Link metrics of the whole mesh, recomputed whenever links are synchronized
+LINK_METRICS = LinkMetrics([])
+
+# Generations of graph items cached by workers, incremented when graph items of a node are removed
+GRAPH_GENERATIONS = {}
+
+# Reports pushed by nodes are used instead of fetching node data until they get too old
+PUSH_BUFFER = ReportBuffer(nodewatcher.parse_node_info, max_age = getattr(settings, 'MONITOR_PUSH_MAX_AGE', settings.MONITOR_POLL_INTERVAL))
+
+# Installed package listings are refreshed every hour, spread over all cycles
+PACKAGE_SCHEDULE = PackageRefreshSchedule(interval = 3600, poll_interval = settings.MONITOR_POLL_INTERVAL)
+
+# Monitor metrics, served over HTTP when MONITOR_METRICS_ADDRESS is set
+METRICS_ADDRESS = getattr(settings, 'MONITOR_METRICS_ADDRESS', None)
+if options.metrics_port:
+  METRICS_ADDRESS = (METRICS_ADDRESS[0] if METRICS_ADDRESS else '127.0.0.1', options.metrics_port)
+
+COUNT_QUERIES = bool(METRICS_ADDRESS) or options.benchmark
+METRICS = Metrics()
+METRICS.describe('nodewatcher_monitor_cycles_total', 'counter', 'Number of completed monitor cycles.')
+METRICS.describe('nodewatcher_monitor_cycle_seconds', 'gauge', 'Duration of the last monitor cycle.')
+METRICS.describe('nodewatcher_monitor_stage_seconds', 'gauge', 'Duration of monitor stages in the last cycle.')
+METRICS.describe('nodewatcher_monitor_fping_seconds', 'gauge', 'Time spent probing nodes with each ICMP payload size in the last cycle.')
+METRICS.describe('nodewatcher_monitor_http_timeouts_total', 'counter', 'Number of timed out nodewatcher data fetches.')
+METRICS.describe('nodewatcher_monitor_node_processing_seconds', 'histogram', 'Time spent processing a single node.',
+  buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+METRICS.describe('nodewatcher_monitor_node_queries', 'histogram', 'Number of database queries issued while processing a single node.',
+  buckets = (5, 10, 20, 30, 50, 75, 100, 150, 250, 500))
+METRICS.describe('nodewatcher_monitor_rrd_updates_total', 'counter', 'Number of RRD archive updates.')
+METRICS.describe('nodewatcher_monitor_rrd_update_seconds_total', 'counter', 'Time spent writing RRD archive updates.')
+METRICS.describe('nodewatcher_monitor_worker_rss_bytes', 'gauge', 'Resident set size of processes that processed nodes in the last cycle.')
+METRICS.describe('nodewatcher_monitor_pushed_reports_total', 'counter', 'Number of reports pushed by nodes.')
+METRICS.describe('nodewatcher_monitor_node_reports_total', 'counter', 'Number of node reports processed by source (pushed or fetched).')
+METRICS.describe('nodewatcher_monitor_links', 'gauge', 'Number of visible links.')
+METRICS.describe('nodewatcher_monitor_link_quality_mean', 'gauge', 'Mean link quality over all visible links.')
+METRICS.describe('nodewatcher_monitor_link_asymmetry_mean', 'gauge', 'Mean difference between LQ and ILQ over all visible links.')
 
 @transaction.commit_on_success
 def check_events():
@@ -234,7 +266,8 @@ def check_dead_graphs():
   )
   
   # Remove RRDs that need removal
-  for graph in GraphItem.objects.filter(need_removal = True):
+  for graph in GraphItem.objects.filter(need_removal = True).select_related('node'):
+    invalidate_graphs(graph.node.ip)
     try:
       os.unlink(os.path.join(settings.MONITOR_WORKDIR, 'rra', graph.rra))
     except:
@@ -242,6 +275,15 @@ def check_dead_graphs():
   
   GraphItem.objects.filter(need_removal = True).delete()
 
+def invalidate_graphs(node_ip):
+  """
+  Makes workers reload cached graph items of a node when it is processed
+  next time.
+  
+  @param node_ip: Node's IP address
+  """
+  GRAPH_GENERATIONS[node_ip] = GRAPH_GENERATIONS.get(node_ip, 0) + 1
+
 def generate_new_node_tweet(node):
   """
   Generates a tweet when a new node connects to the network.
@@ -257,18 +299,53 @@ def generate_new_node_tweet(node):
   except:
     logging.warning("%s/%s: %s" % (node.name, node.ip, format_exc()))
 
-@transaction.commit_on_success
-def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
+def process_node(node_ip, ping_results, is_duped, varsize_results, info, packages, package_digest, links, report_state, graph_generation):
   """
-  Processes a single node.
+  Processes a single node. Must be called inside a transaction. Checks
+  whose report sections and configuration have not changed since the
+  previous cycle are skipped and their warnings are carried forward.
 
   @param node_ip: Node's IP address
   @param ping_results: Results obtained from ICMP ECHO tests
   @param is_duped: True if duplicate echos received
-  @param peers: Peering info from routing daemon
   @param varsize_results: Results of ICMP ECHO tests with variable payloads
+  @param info: Parsed nodewatcher data (None when unavailable)
+  @param packages: A (digest, packages) tuple of the installed package listing
+    when a refresh is due (None otherwise)
+  @param package_digest: Digest of the last applied package listing (None
+    if unknown)
+  @param links: Precomputed link metrics of this node (None when the node
+    has no links)
+  @param report_state: Check results of the previous cycle (None if unknown)
+  @param graph_generation: Generation of the node's cached graph items
+  @return: A tuple (warnings, events, graph_ids, report_state, stats,
+    package_digest) where warnings and events are lists of warnings and
+    events raised for this node, graph_ids is a list of updated graph
+    items, report_state is a (node IP, check results) tuple for the next
+    cycle, stats is a dictionary of processing statistics and
+    package_digest is the digest of the last applied package listing
+  """
+  queries = QueryCounter(enabled = COUNT_QUERIES)
+  queries.start()
+  try:
+    return process_node_counted(queries, node_ip, ping_results, is_duped, varsize_results, info, packages, package_digest, links, report_state, graph_generation)
+  finally:
+    # Counting must stop even when processing fails, otherwise the debug cursor would
+    # keep recording queries for the rest of the process' life
+    queries.stop()
+
+def process_node_counted(queries, node_ip, ping_results, is_duped, varsize_results, info, packages, package_digest, links, report_state, graph_generation):
+  """
+  Processes a single node (see process_node) while its database queries
+  are being counted.
+  
+  @param queries: Started QueryCounter instance
   """
+  start = time.time()
   transaction.set_dirty()
+  warnings = WarningAccumulator(EventSource.Monitor)
+  events = EventAggregator()
+  report = ReportState(report_state, max_age = getattr(settings, 'MONITOR_REPORT_STATE_MAX_AGE', 3600))
   
   try:
     n = Node.get_exclusive(ip = node_ip)
@@ -277,9 +354,9 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
     # did not yet have access to the node. Then after the node has been
     # renumbered we gain access, but the IP has been changed. In this
     # case we must ignore processing of this node.
-    return
+    return [], [], [], None, None, None
   
-  grapher = graphs.Grapher(n)
+  grapher = graphs.Grapher(n, graph_generation)
   oldStatus = n.status
   old_last_seen = n.last_seen
 
@@ -306,7 +383,7 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
   
   if is_duped:
     n.status = NodeStatus.Duped
-    NodeWarning.create(n, WarningCode.DupedReplies, EventSource.Monitor)
+    warnings.add(n, WarningCode.DupedReplies)
 
   # Generate status change events
   if oldStatus in (NodeStatus.Down, NodeStatus.Pending, NodeStatus.New) and n.status in (NodeStatus.Up, NodeStatus.Visible):
@@ -315,51 +392,19 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
       if n.node_type == NodeType.Wireless:
         generate_new_node_tweet(n)
 
-    Event.create_event(n, EventCode.NodeUp, '', EventSource.Monitor)
+    events.add(n, EventCode.NodeUp, '', EventSource.Monitor)
   elif oldStatus != NodeStatus.Duped and n.status == NodeStatus.Duped:
-    Event.create_event(n, EventCode.PacketDuplication, '', EventSource.Monitor)
+    events.add(n, EventCode.PacketDuplication, '', EventSource.Monitor)
   
   # Add olsr peer count graph
   grapher.add_graph(GraphType.OlsrPeers, 'Routing Peers', 'olsrpeers', n.peers)
 
-  # Add LQ/ILQ/ETX graphs
-  if n.peers > 0:
-    etx_avg = lq_avg = ilq_avg = 0.0
-    for peer in n.get_peers():
-      lq_avg += float(peer.lq)
-      ilq_avg += float(peer.ilq)
-      etx_avg += float(peer.etx)
-    
-    lq_graph = grapher.add_graph(GraphType.LQ, 'Average Link Quality', 'lq', ilq_avg / n.peers, lq_avg / n.peers)
-    etx_graph = grapher.add_graph(GraphType.ETX, 'Average ETX', 'etx', etx_avg / n.peers)
-
-    for peer in n.get_peers():
-      # Link quality
-      grapher.add_graph(
-        GraphType.LQ,
-        'Link Quality to {0}'.format(peer.dst),
-        'lq_peer_{0}'.format(peer.dst.pk),
-        peer.ilq,
-        peer.lq,
-        name = peer.dst.ip,
-        parent = lq_graph
-      )
-      
-      # ETX
-      grapher.add_graph(
-        GraphType.ETX,
-        'ETX to {0}'.format(peer.dst),
-        'etx_peer_{0}'.format(peer.dst.pk),
-        peer.etx,
-        name = peer.dst.ip,
-        parent = etx_graph
-      )
+  # Add LQ/ILQ/ETX graphs from link metrics computed for the whole mesh
+  if links is not None:
+    grapher.add_link_graphs(links)
 
   n.last_seen = datetime.now()
   
-  # Attempt to fetch data from nodewatcher
-  info = nodewatcher.fetch_node_info(node_ip)
-  
   # XXX This is an ugly hack for server-type nodes, but it will be fixed by modularization
   #     rewrite anyway, so no need to make it nice
   if n.node_type == NodeType.Server and info is not None and 'iface' in info:
@@ -386,137 +431,137 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
       oldChannel = n.channel or 0
       oldVersion = n.firmware_version
       n.firmware_version = info['general']['version']
-      n.local_time = safe_date_convert(info['general']['local_time'])
+      n.local_time = info['general']['local_time']
       n.bssid = info['wifi']['bssid']
       n.essid = info['wifi']['essid']
       n.channel = nodewatcher.frequency_to_channel(info['wifi']['frequency'])
       n.clients = 0
-      n.uptime = safe_uptime_convert(info['general']['uptime'])
+      n.uptime = info['general']['uptime']
       
       # Treat missing firmware version file as NULL version
       if n.firmware_version == "missing":
         n.firmware_version = None
       
-      # Validate BSSID and ESSID
-      if n.bssid != "02:CA:FF:EE:BA:BE":
-        NodeWarning.create(n, WarningCode.BSSIDMismatch, EventSource.Monitor)
-      
+      # Load node configuration used by the checks below only once
       try:
-        if n.essid != n.configured_essid:
-          NodeWarning.create(n, WarningCode.ESSIDMismatch, EventSource.Monitor)
-      except Project.DoesNotExist:
-        pass
+        profile = n.profile
+      except Profile.DoesNotExist:
+        profile = None
+      
+      wifi_subnets = list(n.subnet_set.filter(gen_iface_type = IfaceType.WiFi, allocated = True))
+      has_client_subnet = any([s.cidr <= 28 for s in wifi_subnets])
+      
+      def check_wifi(warn):
+        # Validate BSSID and ESSID
+        if n.bssid != "02:CA:FF:EE:BA:BE":
+          warn(WarningCode.BSSIDMismatch)
+        
+        try:
+          if n.essid != n.configured_essid:
+            warn(WarningCode.ESSIDMismatch)
+        except Project.DoesNotExist:
+          pass
+        
+        if profile is not None and n.channel != profile.channel:
+          warn(WarningCode.ChannelMismatch)
+        
+        # Check node's multicast rate
+        if 'mcast_rate' in info['wifi']:
+          if info['wifi']['mcast_rate'] != 5500:
+            warn(WarningCode.McastRateMismatch)
+      
+      report.run('wifi', (
+        n.bssid, n.essid, n.channel, info['wifi'].get('mcast_rate'),
+        n.project_id, has_client_subnet, profile and profile.channel
+      ), warnings, n, check_wifi)
       
       if 'uuid' in info['general']:
         n.reported_uuid = info['general']['uuid']
         if n.reported_uuid and n.reported_uuid != n.uuid:
-          NodeWarning.create(n, WarningCode.MismatchedUuid, EventSource.Monitor)
+          warnings.add(n, WarningCode.MismatchedUuid)
 
       if oldVersion != n.firmware_version:
-        Event.create_event(n, EventCode.VersionChange, '', EventSource.Monitor, data = 'Old version: %s\n  New version: %s' % (oldVersion, n.firmware_version))
+        events.add(n, EventCode.VersionChange, '', EventSource.Monitor, data = 'Old version: %s\n  New version: %s' % (oldVersion, n.firmware_version))
 
       if oldUptime > n.uptime:
-        Event.create_event(n, EventCode.UptimeReset, '', EventSource.Monitor, data = 'Old uptime: %s\n  New uptime: %s' % (oldUptime, n.uptime))
+        events.add(n, EventCode.UptimeReset, '', EventSource.Monitor, data = 'Old uptime: %s\n  New uptime: %s' % (oldUptime, n.uptime))
         
         # Setup reboot mode for further graphs as we now know the node has
         # been rebooted
         grapher.enable_reboot_mode(n.uptime, old_last_seen)
 
       if oldChannel != n.channel and oldChannel != 0:
-        Event.create_event(n, EventCode.ChannelChanged, '', EventSource.Monitor, data = 'Old channel: %s\n  New channel %s' % (oldChannel, n.channel))
-      
-      try:
-        if n.channel != n.profile.channel:
-          NodeWarning.create(n, WarningCode.ChannelMismatch, EventSource.Monitor)
-      except Profile.DoesNotExist:
-        pass
+        events.add(n, EventCode.ChannelChanged, '', EventSource.Monitor, data = 'Old channel: %s\n  New channel %s' % (oldChannel, n.channel))
 
       if n.has_time_sync_problems():
-        NodeWarning.create(n, WarningCode.TimeOutOfSync, EventSource.Monitor)
+        warnings.add(n, WarningCode.TimeOutOfSync)
 
       if 'errors' in info['wifi']:
-        error_count = safe_int_convert(info['wifi']['errors'])
+        error_count = info['wifi']['errors']
         if error_count != n.wifi_error_count and error_count > 0:
-          Event.create_event(n, EventCode.WifiErrors, '', EventSource.Monitor, data = 'Old count: %s\n  New count: %s' % (n.wifi_error_count, error_count))
+          events.add(n, EventCode.WifiErrors, '', EventSource.Monitor, data = 'Old count: %s\n  New count: %s' % (n.wifi_error_count, error_count))
         
         n.wifi_error_count = error_count
       
       if 'net' in info:
-        loss_count = safe_int_convert(info['net']['losses']) if 'losses' in info['net'] else 0
+        loss_count = info['net'].get('losses', 0)
         if loss_count != n.loss_count and loss_count > 1:
-          Event.create_event(n, EventCode.ConnectivityLoss, '', EventSource.Monitor, data = 'Old count: %s\n  New count: %s' % (n.loss_count, loss_count))
+          events.add(n, EventCode.ConnectivityLoss, '', EventSource.Monitor, data = 'Old count: %s\n  New count: %s' % (n.loss_count, loss_count))
         
         n.loss_count = loss_count
         
         # Check VPN configuration 
         if 'vpn' in info['net']:
           n.vpn_mac = info['net']['vpn']['mac'] or None
-          try:
-            offset = -3
-            unit = 1000
-            if 'Kbit' in info['net']['vpn']['upload_limit']:
-              offset = -4
-              unit = 1
-            
-            upload_limit = safe_int_convert(info['net']['vpn']['upload_limit'][:offset]) // unit
-          except TypeError:
-            upload_limit = None
           
-          if n.vpn_mac and n.vpn_mac != n.vpn_mac_conf:
-            NodeWarning.create(n, WarningCode.VPNMacMismatch, EventSource.Monitor)
+          def check_vpn(warn):
+            upload_limit = info['net']['vpn']['upload_limit']
+            if n.vpn_mac and n.vpn_mac != n.vpn_mac_conf:
+              warn(WarningCode.VPNMacMismatch)
+            
+            if profile is not None and upload_limit != profile.vpn_egress_limit:
+              warn(WarningCode.VPNLimitMismatch)
           
-          try:
-            if upload_limit != n.profile.vpn_egress_limit:
-              NodeWarning.create(n, WarningCode.VPNLimitMismatch, EventSource.Monitor)
-          except Profile.DoesNotExist:
-            pass
+          report.run('vpn', (
+            info['net']['vpn'], n.vpn_mac_conf, profile and profile.vpn_egress_limit
+          ), warnings, n, check_vpn)
       
       # Parse nodogsplash client information
       oldNdsStatus = n.captive_portal_status
       if 'nds' in info:
-        if 'down' in info['nds'] and info['nds']['down'] == '1':
+        if info['nds'].get('down') == 1:
           n.captive_portal_status = False
           
           # Create a node warning when captive portal is down and the node has it
           # selected in its image generator profile
           try:
-            if n.project.captive_portal and n.has_client_subnet():
-              NodeWarning.create(n, WarningCode.CaptivePortalDown, EventSource.Monitor)
+            if n.project.captive_portal and has_client_subnet:
+              warnings.add(n, WarningCode.CaptivePortalDown)
           except Profile.DoesNotExist:
             pass
         else:
           n.captive_portal_status = True
 
-          for cid, client in info['nds'].iteritems():
-            if not cid.startswith('client'):
-              continue
-
-            try:
-              c = APClient.objects.get(node = n, ip = client['ip'])
-            except APClient.DoesNotExist:
-              c = APClient(node = n)
-              n.clients_so_far += 1
-            
-            n.clients += 1
-            c.ip = client['ip']
-            c.connected_at = safe_date_convert(client['added_at'])
-            c.uploaded = safe_int_convert(client['up'])
-            c.downloaded = safe_int_convert(client['down'])
-            c.last_update = datetime.now()
-            c.save()
+          clients = [
+            (client['ip'], client['added_at'], client['up'], client['down'])
+            for cid, client in info['nds'].iteritems() if cid.startswith('client')
+          ]
+          
+          n.clients += len(clients)
+          n.clients_so_far += sync_ap_clients(n, clients, datetime.now())
       else:
         n.captive_portal_status = True
       
       # Check for captive portal status change
-      if n.has_client_subnet():
+      if has_client_subnet:
         if oldNdsStatus and not n.captive_portal_status:
-          Event.create_event(n, EventCode.CaptivePortalDown, '', EventSource.Monitor)
+          events.add(n, EventCode.CaptivePortalDown, '', EventSource.Monitor)
         elif not oldNdsStatus and n.captive_portal_status:
-          Event.create_event(n, EventCode.CaptivePortalUp, '', EventSource.Monitor)
+          events.add(n, EventCode.CaptivePortalUp, '', EventSource.Monitor)
 
       # Generate a graph for number of wifi cells
       if 'cells' in info['wifi']:
-        grapher.add_graph(GraphType.WifiCells, 'Nearby WiFi Cells', 'wificells', safe_int_convert(info['wifi']['cells']) or 0)
+        grapher.add_graph(GraphType.WifiCells, 'Nearby WiFi Cells', 'wificells', info['wifi']['cells'] or 0)
 
       # Update node's MAC address on wifi iface
       if 'mac' in info['wifi']:
@@ -524,20 +569,14 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
       
       # Update node's RTS and fragmentation thresholds
       if 'rts' in info['wifi'] and 'frag' in info['wifi']:
-        n.thresh_rts = safe_int_convert(info['wifi']['rts']) or 2347
-        n.thresh_frag = safe_int_convert(info['wifi']['frag']) or 2347
-      
-      # Check node's multicast rate
-      if 'mcast_rate' in info['wifi']:
-        rate = safe_int_convert(info['wifi']['mcast_rate'])
-        if rate != 5500:
-          NodeWarning.create(n, WarningCode.McastRateMismatch, EventSource.Monitor)
+        n.thresh_rts = info['wifi']['rts'] or 2347
+        n.thresh_frag = info['wifi']['frag'] or 2347
       
       # Check node's wifi bitrate, level and noise
       if 'signal' in info['wifi']:
-        bitrate = safe_int_convert(info['wifi']['bitrate'])
-        signal = safe_dbm_convert(info['wifi']['signal'])
-        noise = safe_dbm_convert(info['wifi']['noise'])
+        bitrate = info['wifi']['bitrate']
+        signal = info['wifi']['signal']
+        noise = info['wifi']['noise']
         snr = float(signal) - float(noise)
         
         grapher.add_graph(GraphType.WifiBitrate, 'WiFi Bitrate', 'wifibitrate', bitrate)
@@ -545,24 +584,23 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
         grapher.add_graph(GraphType.WifiSNR, 'WiFi Signal/Noise Ratio', 'wifisnr', snr)
       
       # Check for IP shortage
-      wifi_subnet = n.subnet_set.filter(gen_iface_type = IfaceType.WiFi, allocated = True)
-      if wifi_subnet and n.clients > max(0, ipcalc.Network(wifi_subnet[0].subnet, wifi_subnet[0].cidr).size() - 4):
-        Event.create_event(n, EventCode.IPShortage, '', EventSource.Monitor, data = 'Subnet: %s\n  Clients: %s' % (wifi_subnet[0], n.clients))
-        NodeWarning.create(n, WarningCode.IPShortage, EventSource.Monitor)
+      if wifi_subnets and n.clients > max(0, ipcalc.Network(wifi_subnets[0].subnet, wifi_subnets[0].cidr).size() - 4):
+        events.add(n, EventCode.IPShortage, '', EventSource.Monitor, data = 'Subnet: %s\n  Clients: %s' % (wifi_subnets[0], n.clients))
+        warnings.add(n, WarningCode.IPShortage)
       
       # Fetch DHCP leases when available
       lease_count = 0
       if 'dhcp' in info:
         per_subnet_counts = {}
+        subnets = SubnetMatcher(n.subnet_set.all())
         
         for cid, client in info['dhcp'].iteritems():
           if not cid.startswith('client'):
             continue
           
           # Determine which subnet this thing belongs to
-          client_subnet = n.subnet_set.ip_filter(ip_subnet__contains = client['ip'])
-          if client_subnet:
-            client_subnet = client_subnet[0]
+          client_subnet = subnets.match(client['ip'])
+          if client_subnet is not None:
             per_subnet_counts[client_subnet] = per_subnet_counts.get(client_subnet, 0) + 1
           else:
             # TODO Subnet is not announced by this node - potential problem, but ignore for now
@@ -573,39 +611,47 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
         # Check for IP shortage
         for client_subnet, count in per_subnet_counts.iteritems():
           if count > ipcalc.Network(client_subnet.subnet, client_subnet.cidr).size() - 4:
-            Event.create_event(n, EventCode.IPShortage, '', EventSource.Monitor, data = 'Subnet: {0}\n  Leases: {1}' % (client_subnet, count))
-            NodeWarning.create(n, WarningCode.IPShortage, EventSource.Monitor)
+            events.add(n, EventCode.IPShortage, '', EventSource.Monitor, data = 'Subnet: {0}\n  Leases: {1}'.format(client_subnet, count))
+            warnings.add(n, WarningCode.IPShortage)
       
       # Generate a graph for number of clients
       if 'nds' in info or lease_count > 0:
         grapher.add_graph(GraphType.Clients, 'Connected Clients', 'clients', n.clients, lease_count)
       
+      # Check mappings for known wifi interfaces so we can handle hardware changes while
+      # the node is up and not generate useless intermediate graphs
+      def map_interfaces(warn):
+        mapping = {}
+        if profile is not None:
+          iface_wifi = profile.template.iface_wifi
+          known = set(Template.objects.values_list('iface_wifi', flat = True))
+          for iid in info['iface']:
+            if iid in known:
+              mapping[iid] = iface_wifi
+        
+        return mapping
+      
+      iface_map = report.run('interfaces', (
+        sorted(info['iface'].keys()), profile and profile.template_id
+      ), warnings, n, map_interfaces)
+      
       # Record interface traffic statistics for all interfaces
       for iid, iface in info['iface'].iteritems():
         if iid not in ('wifi0', 'wmaster0'):
-          # Check mappings for known wifi interfaces so we can handle hardware changes while
-          # the node is up and not generate useless intermediate graphs
-          try:
-            if n.profile:
-              iface_wifi = n.profile.template.iface_wifi
-              if Template.objects.filter(iface_wifi = iid).count() >= 1:
-                iid = iface_wifi
-          except Profile.DoesNotExist:
-            pass
-          
+          iid = iface_map.get(iid, iid)
           grapher.add_graph(GraphType.Traffic, 'Traffic - %s' % iid, 'traffic_%s' % iid, iface['up'], iface['down'], name = iid)
       
       # Generate load average statistics
       if 'loadavg' in info['general']:
-        n.loadavg_1min, n.loadavg_5min, n.loadavg_15min, n.numproc = safe_loadavg_convert(info['general']['loadavg'])
+        n.loadavg_1min, n.loadavg_5min, n.loadavg_15min, n.numproc = info['general']['loadavg']
         grapher.add_graph(GraphType.LoadAverage, 'Load Average', 'loadavg', n.loadavg_1min, n.loadavg_5min, n.loadavg_15min)
         grapher.add_graph(GraphType.NumProc, 'Number of Processes', 'numproc', n.numproc)
 
       # Generate free memory statistics
       if 'memfree' in info['general']:
-        n.memfree = safe_int_convert(info['general']['memfree'])
-        buffers = safe_int_convert(info['general'].get('buffers', 0))
-        cached = safe_int_convert(info['general'].get('cached', 0))
+        n.memfree = info['general']['memfree']
+        buffers = info['general'].get('buffers', 0)
+        cached = info['general'].get('cached', 0)
         grapher.add_graph(GraphType.MemUsage, 'Memory Usage', 'memusage', n.memfree, buffers, cached)
 
       # Generate solar statistics when available
@@ -617,10 +663,6 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
           'float'       : 4
         }
         
-        for key, value in info['solar'].iteritems():
-          if not value.strip():
-            info['solar'][key] = None
-        
         grapher.add_graph(GraphType.Solar, 'Solar Monitor', 'solar',
           info['solar']['batvoltage'],
           info['solar']['solvoltage'],
@@ -635,15 +677,15 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
           if not key.startswith('sensor'):
             continue
           if 'temp' in value:
-            temp = safe_float_convert(value['temp'])
+            temp = value['temp']
             serial = value['serial']
             grapher.add_graph(GraphType.Temperature, 'Temperature ({0})'.format(serial), 'temp_{0}'.format(serial), temp, name = serial)
 
       # XXX UGLY HACK: Some random voltage reports
       if 'voltage' in info:
         serial = info['voltage']['serial']
-        voltages = [safe_float_convert(info['voltage'][x].strip()) for x in '1234']
-        multipliers = [safe_int_convert(info['voltage']['%sm' % x].strip()) for x in '1234']
+        voltages = [info['voltage'][x] for x in '1234']
+        multipliers = [info['voltage']['%sm' % x] for x in '1234']
         results = []
         for voltage, multiplier in zip(voltages, multipliers):
           if voltage is not None:
@@ -653,394 +695,281 @@ def process_node(node_ip, ping_results, is_duped, peers, varsize_results):
         
         grapher.add_graph(GraphType.Voltage, 'Voltage ({0})'.format(serial), 'volt_{0}'.format(serial), *results, name = serial)
 
-      # Check for installed package versions (every hour)
-      try:
-        last_pkg_update = n.installedpackage_set.all()[0].last_update
-      except:
-        last_pkg_update = None
-
-      if not last_pkg_update or last_pkg_update < datetime.now() - timedelta(hours = 1):
-        packages = nodewatcher.fetch_installed_packages(n.ip) or {}
-
-        # Remove removed packages and update existing package versions
-        for package in n.installedpackage_set.all():
-          if package.name not in packages:
-            package.delete()
-          else:
-            package.version = packages[package.name]
-            package.last_update = datetime.now()
-            package.save()
-            del packages[package.name]
-
-        # Add added packages
-        for packageName, version in packages.iteritems():
-          package = InstalledPackage(node = n)
-          package.name = packageName
-          package.version = version
-          package.last_update = datetime.now()
-          package.save()
+      # Installed packages only change when the package listing is refreshed
+      installed_packages = None
+      if packages is not None:
+        digest, listing = packages
+        installed_packages = sorted(listing.keys())
+        
+        # Apply the listing only when it differs from the last applied one and mark
+        # the inventory as refreshed
+        if digest != package_digest:
+          sync_installed_packages(n, listing)
+          package_digest = digest
+        
+        n.installedpackage_set.update(last_update = datetime.now())
       
       # Check if all selected optional packages are present in package listing
-      try:
+      def check_packages(warn):
+        installed = set(n.installedpackage_set.values_list('name', flat = True))
         missing_packages = []
-        for package in n.profile.optional_packages.all():
+        for package in profile.optional_packages.all():
           for pname in package.name.split():
-            if n.installedpackage_set.filter(name = pname).count() == 0:
+            if pname not in installed:
               missing_packages.append(pname)
         
         if missing_packages:
-          NodeWarning.create(n, WarningCode.OptPackageNotFound, EventSource.Monitor, details = ("Packages missing: %s" % ", ".join(missing_packages)))
-      except Profile.DoesNotExist:
-        pass
+          warn(WarningCode.OptPackageNotFound, details = ("Packages missing: %s" % ", ".join(missing_packages)))
+      
+      if profile is not None:
+        inputs = None
+        if installed_packages is not None:
+          inputs = (installed_packages, profile.pk)
+        
+        report.run('packages', inputs, warnings, n, check_packages)
       
       # Check if DNS works
       if 'dns' in info:
         old_dns_works = n.dns_works
-        n.dns_works = info['dns']['local'] == '0' and info['dns']['remote'] == '0'
+        n.dns_works = info['dns']['local'] == 0 and info['dns']['remote'] == 0
         if not n.dns_works:
-          NodeWarning.create(n, WarningCode.DnsDown, EventSource.Monitor)
+          warnings.add(n, WarningCode.DnsDown)
 
         if old_dns_works != n.dns_works:
           # Generate a proper event when the state changes
           if n.dns_works:
-            Event.create_event(n, EventCode.DnsResolverRestored, '', EventSource.Monitor)
+            events.add(n, EventCode.DnsResolverRestored, '', EventSource.Monitor)
           else:
-            Event.create_event(n, EventCode.DnsResolverFailed, '', EventSource.Monitor)
+            events.add(n, EventCode.DnsResolverFailed, '', EventSource.Monitor)
     except:
       logging.warning("Failed to interpret nodewatcher data for node '%s (%s)'!" % (n.name, n.ip))
       logging.warning(format_exc())
-      NodeWarning.create(n, WarningCode.NodewatcherInterpretFailed, EventSource.Monitor)
+      warnings.add(n, WarningCode.NodewatcherInterpretFailed)
 
+  # Write all buffered graph updates
+  graph_ids = grapher.flush()
   n.save()
   
+  stats = {
+    'pid' : os.getpid(),
+    'duration' : time.time() - start,
+    'queries' : queries.stop(),
+    'rrd_updates' : grapher.rrd_updates,
+    'rrd_seconds' : grapher.rrd_seconds,
+    'rss' : get_rss(),
+    'status' : n.status,
+  }
+  
   # When GC debugging is enabled perform some more work
   if getattr(settings, 'MONITOR_ENABLE_GC_DEBUG', None):
     gc.collect()
-    return os.getpid(), len(gc.get_objects())
+    stats['gc_objects'] = len(gc.get_objects())
   
-  return None, None
+  return warnings.items(), events.items(), graph_ids, (node_ip, report.items()), stats, package_digest
 
-@transaction.commit_on_success
-def check_network_status():
+def record_node_stats(stats, rss):
   """
-  Performs the network status check.
+  Records processing statistics of a single node in monitor metrics.
+  
+  @param stats: Statistics dictionary as returned by process_node
+  @param rss: A dictionary of last reported RSS values keyed by process id
   """
-  # Initialize the state of nodes and subnets, remove out of date ap clients and graph items
-  Node.objects.all().update(visible = False)
-  Subnet.objects.all().update(visible = False)
-  Link.objects.all().update(visible = False)
-  APClient.objects.filter(last_update__lt = datetime.now() -  timedelta(minutes = 11)).delete()
-
-  # Reset some states
-  NodeWarning.objects.all().update(source = EventSource.Monitor, dirty = False)
-  Node.objects.all().update(warnings = False, conflicting_subnets = False)
+  METRICS.observe('nodewatcher_monitor_node_processing_seconds', stats['duration'])
+  if stats['queries'] is not None:
+    METRICS.observe('nodewatcher_monitor_node_queries', stats['queries'])
+  
+  METRICS.inc('nodewatcher_monitor_rrd_updates_total', stats['rrd_updates'])
+  METRICS.inc('nodewatcher_monitor_rrd_update_seconds_total', stats['rrd_seconds'])
+  rss[stats['pid']] = stats['rss']
 
-  # Fetch routing tables from OLSR
-  try:
-    nodes, hna = wifi_utils.get_tables(settings.MONITOR_OLSR_HOST)
-  except TypeError:
-    logging.error("Unable to fetch routing tables from '%s'!" % settings.MONITOR_OLSR_HOST)
-    return
+def ping_nodes(node_ips, collector):
+  """
+  Pings nodes in chunks and hands results for each chunk to the collector
+  as soon as they are available.
 
-  # Ping nodes present in the database and visible in OLSR
-  dbNodes = {}
-  nodesToPing = []
-  for nodeIp in nodes.keys():
-    try:
-      # Try to get the node from the database
-      n = Node.get_exclusive(ip = nodeIp)
-      n.visible = True
-      n.peers = len(nodes[nodeIp].links)
-
-      # If we have succeeded, add to list (if not invalid)
-      if not n.is_invalid():
-        if n.awaiting_renumber:
-          # Reset any status from awaiting renumber to invalid
-          for notice in n.renumber_notices.all():
-            try:
-              rn = Node.objects.get(ip = notice.original_ip)
-              if rn.status == NodeStatus.AwaitingRenumber:
-                rn.status = NodeStatus.Invalid
-                rn.node_type = NodeType.Unknown
-                rn.awaiting_renumber = False
-                rn.save()
-            except Node.DoesNotExist:
-              pass
-            
-            notice.delete()
-          
-          n.awaiting_renumber = False
-          n.save()
-        
-        nodesToPing.append(nodeIp)
-      else:
-        n.last_seen = datetime.now()
-        n.peers = len(nodes[nodeIp].links)
-        
-        # Create a warning since node is not registered
-        NodeWarning.create(n, WarningCode.UnregisteredNode, EventSource.Monitor)
-        n.save()
-      
-      dbNodes[nodeIp] = n
-    except Node.DoesNotExist:
-      # Node does not exist, create an invalid entry for it
-      n = Node(ip = nodeIp, status = NodeStatus.Invalid, last_seen = datetime.now())
-      n.visible = True
-      n.node_type = NodeType.Unknown
-      n.peers = len(nodes[nodeIp].links)
-      
-      # Check if there are any renumber notices for this IP address
-      try:
-        notice = RenumberNotice.objects.get(original_ip = nodeIp)
-        n.status = NodeStatus.AwaitingRenumber
-        n.node_type = notice.node.node_type
-        n.awaiting_renumber = True
-      except RenumberNotice.DoesNotExist:
-        pass
-      
-      n.save(force_insert = True)
-      dbNodes[nodeIp] = n
-
-      # Create an event and append a warning since an unknown node has appeared
-      NodeWarning.create(n, WarningCode.UnregisteredNode, EventSource.Monitor)
-      Event.create_event(n, EventCode.UnknownNodeAppeared, '', EventSource.Monitor)
-  
-  # Add a warning to all nodes that have been stuck in renumbering state for over a week
-  for node in Node.objects.filter(renumber_notices__renumbered_at__lt = datetime.now() - timedelta(days = 7)):
-    NodeWarning.create(node, WarningCode.LongRenumber, EventSource.Monitor)
-    node.save()
-  
-  # Mark invisible nodes as down
-  for node in Node.objects.exclude(status__in = (NodeStatus.Invalid, NodeStatus.AwaitingRenumber)):
-    oldStatus = node.status
-
-    if node.ip not in dbNodes:
-      if node.status == NodeStatus.New:
-        node.status = NodeStatus.Pending
-      elif node.status != NodeStatus.Pending:
-        node.status = NodeStatus.Down
-      node.save()
-
-    if oldStatus in (NodeStatus.Up, NodeStatus.Visible, NodeStatus.Duped) and node.status == NodeStatus.Down:
-      Event.create_event(node, EventCode.NodeDown, '', EventSource.Monitor)
-      
-      # Invalidate uptime credit for this node
-      node.uptime_last = None
-      node.save()
-  
-  # Generate timestamp and snapshot identifier
-  timestamp = datetime.now()
-  snapshot_id = int(time.time())
-  
-  # Setup all node peerings
-  for nodeIp, node in nodes.iteritems():
-    n = dbNodes[nodeIp]
-    n.redundancy_link = False
-    links = []
+  @param node_ips: A list of node IP addresses to ping
+  @param collector: NodeCollector instance
+  """
+  # ICMP payload sizes for the default probe and variable size probes
+  default_size = 56
+  varsize_sizes = [packet_size - 8 for packet_size in (100, 500, 1000, 1480)]
+  
+  chunk_size = getattr(settings, 'MONITOR_PING_CHUNK', 50)
+  totals = dict([(packet_size, 0.0) for packet_size in [default_size] + varsize_sizes])
+  for i in xrange(0, len(node_ips), chunk_size):
+    chunk = node_ips[i:i + chunk_size]
+    durations = {}
+    probes = wifi_utils.probe_hosts(10, chunk, [default_size] + varsize_sizes,
+      rate = getattr(settings, 'MONITOR_PING_RATE', None), durations = durations)
     
-    # Find old VPN server peers
-    old_vpn_peers = set([p.dst for p in n.get_peers().filter(dst__vpn_server = True)])
-
-    for peerIp, lq, ilq, etx, vtime in node.links:
-      try:
-        l = Link.objects.get(src = n, dst = dbNodes[peerIp])
-      except Link.DoesNotExist:
-        l = Link(src = n, dst = dbNodes[peerIp])
-      
-      l.lq = float(lq)
-      l.ilq = float(ilq)
-      l.etx = float(etx)
-      l.vtime = vtime
-      l.visible = True
-      l.save()
-      links.append(l)
-      
-      # Check if any of the peers has never peered with us before
-      if n.is_adjacency_important() and l.dst.is_adjacency_important() and not n.peer_history.filter(pk = l.dst.pk).count():
-        n.peer_history.add(l.dst)
-        Event.create_event(n, EventCode.AdjacencyEstablished, '', EventSource.Monitor,
-                           data = 'Peer node: %s' % l.dst, aggregate = False)
-        Event.create_event(l.dst, EventCode.AdjacencyEstablished, '', EventSource.Monitor,
-                           data = 'Peer node: %s' % n, aggregate = False)
-
-      # Check if we have a peering with any VPN servers
-      if l.dst.vpn_server:
-        n.redundancy_link = True
+    for packet_size, duration in durations.iteritems():
+      totals[packet_size] += duration
     
-    if not n.is_invalid():
-      # Determine new VPN server peers
-      new_vpn_peers = set([p.dst for p in n.get_peers().filter(visible = True, dst__vpn_server = True)])
+    results, dupes = probes[default_size]
+    for node_ip in chunk:
+      varsize_results = []
+      for packet_size in varsize_sizes:
+        r, d = probes[packet_size]
+        varsize_results.append(r[node_ip][3] if node_ip in r else None)
       
-      if old_vpn_peers != new_vpn_peers:
-        for p in old_vpn_peers:
-          if p not in new_vpn_peers:
-            # Redundancy loss has ocurred
-            Event.create_event(n, EventCode.RedundancyLoss, '', EventSource.Monitor,
-                               data = 'VPN server: %s' % p)
-        
-        for p in new_vpn_peers:
-          if p not in old_vpn_peers:
-            # Redundancy restoration has ocurred
-            Event.create_event(n, EventCode.RedundancyRestored, '', EventSource.Monitor,
-                               data = 'VPN server: %s' % p)
-      
-      # Issue a warning when node requires peering but has none
-      if n.redundancy_req and not n.redundancy_link:
-        NodeWarning.create(n, WarningCode.NoRedundancy, EventSource.Monitor)
-    
-    n.save()
-    
-    # Archive topology information
-    data_archive.record_topology_entry(snapshot_id, timestamp, n, links)
+      collector.put(node_ip, 'ping', (results.get(node_ip), node_ip in dupes, varsize_results))
+  
+  for packet_size, duration in totals.iteritems():
+    METRICS.set('nodewatcher_monitor_fping_seconds', duration, size = packet_size)
 
-  # Update valid subnet status in the database
-  for nodeIp, subnets in hna.iteritems():
-    if nodeIp not in dbNodes:
-      continue
+def fetch_nodes(node_ips, package_ips, collector):
+  """
+  Fetches nodewatcher data (and installed packages where a refresh is due)
+  from all nodes concurrently and hands results to the collector.
 
-    for subnet in subnets:
-      subnet, cidr = subnet.split("/")
-      
-      try:
-        s = Subnet.objects.get(node__ip = nodeIp, subnet = subnet, cidr = int(cidr))
-        s.last_seen = datetime.now()
-        s.visible = True
-      except Subnet.DoesNotExist:
-        s = Subnet(node = dbNodes[nodeIp], subnet = subnet, cidr = int(cidr), last_seen = datetime.now())
-        s.visible = True
-        s.allocated = False
-      
-      # Save previous subnet status for later use
-      old_status = s.status
-      
-      # Set status accoording to allocation flag
-      if s.allocated:
-        s.status = SubnetStatus.AnnouncedOk
-      else:
-        s.status = SubnetStatus.NotAllocated
-      
-      # Check if this is a more specific prefix announce for an allocated prefix
-      if s.is_more_specific() and not s.allocated:
-        s.status = SubnetStatus.Subset
-      
-      # Check if this is a hijack
-      try:
-        origin = Subnet.objects.ip_filter(
-          # Subnet overlaps with another one
-          ip_subnet__contains = '%s/%s' % (subnet, cidr)
-        ).exclude(
-          # Of another node (= filter all subnets belonging to current node)
-          node = s.node
-        ).get(
-          # That is allocated and visible
-          allocated = True,
-          visible = True
-        )
-        s.status = SubnetStatus.Hijacked
-      except Subnet.DoesNotExist:
-        pass
-      
-      # Generate an event if status has changed
-      if old_status != s.status and s.status == SubnetStatus.Hijacked:
-        Event.create_event(n, EventCode.SubnetHijacked, '', EventSource.Monitor,
-                           data = 'Subnet: %s/%s\n  Allocated to: %s' % (s.subnet, s.cidr, origin.node))
-      
-      # Flag node entry with warnings flag for unregistered announces
-      if not s.is_properly_announced():
-        if s.node.border_router and not s.is_from_known_pool():
-          # TODO when we have peering announce registration this should first check if
-          #      the subnet is registered as a peering
-          s.status = SubnetStatus.Peering
-        
-        if not s.node.border_router or s.status == SubnetStatus.Hijacked or s.is_from_known_pool():
-          # Add a warning message for unregistered announced subnets
-          NodeWarning.create(s.node, WarningCode.UnregisteredAnnounce, EventSource.Monitor)
-          s.node.save()
-      
-      s.save()
-      
-      # Detect subnets that cause conflicts and raise warning flags for all involved
-      # nodes
-      if s.is_conflicting():
-        NodeWarning.create(s.node, WarningCode.AnnounceConflict, EventSource.Monitor)
-        s.node.conflicting_subnets = True
-        s.node.save()
-        
-        for cs in s.get_conflicting_subnets():
-          NodeWarning.create(cs.node, WarningCode.AnnounceConflict, EventSource.Monitor)
-          cs.node.conflicting_subnets = True
-          cs.node.save()
+  @param node_ips: A list of node IP addresses to fetch data for
+  @param package_ips: A list of node IP addresses to fetch packages for
+  @param collector: NodeCollector instance
+  """
+  stats = {}
+  nodewatcher.fetch_all(
+    node_ips,
+    package_ips,
+    callback = collector.put,
+    concurrency = getattr(settings, 'MONITOR_HTTP_CONCURRENCY', 50),
+    timeout = getattr(settings, 'MONITOR_HTTP_TIMEOUT', 15),
+    retries = getattr(settings, 'MONITOR_HTTP_RETRIES', 1),
+    stats = stats
+  )
+  METRICS.inc('nodewatcher_monitor_http_timeouts_total', stats.get('timeouts', 0))
+
+def get_process_node_args(node_ip, data):
+  """
+  Prepares process_node arguments from collected per-node results and
+  check results of the previous cycle.
+
+  @param node_ip: Node's IP address
+  @param data: Results collected by the NodeCollector
+  """
+  ping_results, is_duped, varsize_results = data['ping'] or (None, False, None)
   
-  # Remove subnets that were hijacked but are not visible anymore
-  for s in Subnet.objects.filter(status = SubnetStatus.Hijacked, visible = False):
-    Event.create_event(s.node, EventCode.SubnetRestored, '', EventSource.Monitor, data = 'Subnet: %s/%s' % (s.subnet, s.cidr))
-    s.delete()
+  # Failed package fetches leave the stored package inventory untouched
+  packages = data.get('packages')
   
-  # Remove (or change their status) subnets that are not visible
-  Subnet.objects.filter(allocated = False, visible = False).delete()
-  Subnet.objects.filter(allocated = True, visible = False).update(status = SubnetStatus.NotAnnounced)
+  return node_ip, ping_results, is_duped, varsize_results, data['info'], packages, PACKAGE_DIGESTS.get(node_ip), LINK_METRICS.node(node_ip), REPORT_STATES.get(node_ip), GRAPH_GENERATIONS.get(node_ip, 0)
+
+def update_link_metrics(links):
+  """
+  Computes link metrics of the whole mesh, so polled nodes do not need
+  to load and aggregate their links.
   
-  for subnet in Subnet.objects.filter(status = SubnetStatus.NotAnnounced, node__visible = True):
-    NodeWarning.create(subnet.node, WarningCode.OwnNotAnnounced, EventSource.Monitor)
-    subnet.node.save()
+  @param links: A list of links as returned by topology_links
+  """
+  global LINK_METRICS
+  LINK_METRICS = LinkMetrics(links)
   
-  # Remove invisible unknown nodes
-  for node in Node.objects.filter(status = NodeStatus.Invalid, visible = False).all():
-    # Create an event since an unknown node has disappeared
-    Event.create_event(node, EventCode.UnknownNodeDisappeared, '', EventSource.Monitor)
+  summary = LINK_METRICS.summary()
+  METRICS.set('nodewatcher_monitor_links', summary['links'])
+  METRICS.set('nodewatcher_monitor_link_quality_mean', summary['lq'])
+  METRICS.set('nodewatcher_monitor_link_asymmetry_mean', summary['asymmetry'])
+
+def start_polling(node_ips, timer):
+  """
+  Starts pinging nodes and fetching their data in the background.
   
-  Node.objects.filter(status__in = (NodeStatus.Invalid, NodeStatus.AwaitingRenumber), visible = False).delete()
+  @param node_ips: A list of IP addresses of nodes to poll
+  @param timer: StageTimer instance
+  @return: A tuple (collector, stages) where collector is a NodeCollector
+    that yields results of polled nodes and stages is a list of started
+    BackgroundStage instances
+  """
+  collector = NodeCollector()
+  package_ips = set(PACKAGE_SCHEDULE.due(node_ips, time.time()))
+  for node_ip in node_ips:
+    if node_ip in package_ips:
+      collector.expect(node_ip, 'ping', 'info', 'packages')
+    else:
+      collector.expect(node_ip, 'ping', 'info')
   
-  # Remove invisible links
-  Link.objects.filter(visible = False).delete()
+  # Only nodes that have not recently pushed their report are fetched (nodes are
+  # still pinged and installed packages are still fetched when due)
+  PUSH_BUFFER.allow(SCHEDULER.due_at.keys())
+  pushed = PUSH_BUFFER.take(node_ips)
+  for node_ip, info in pushed.iteritems():
+    collector.put(node_ip, 'info', info)
   
-  # Commit updates to release any pending locks
-  transaction.commit()
+  fetch_ips = [node_ip for node_ip in node_ips if node_ip not in pushed]
+  METRICS.inc('nodewatcher_monitor_node_reports_total', len(pushed), source = 'push')
+  METRICS.inc('nodewatcher_monitor_node_reports_total', len(fetch_ips), source = 'pull')
   
-  # Add nodes to topology map and generate output
-  if not getattr(settings, 'MONITOR_DISABLE_GRAPHS', None):
-    # Only generate topology when graphing is not disabled
-    topology = DotTopologyPlotter()
-    for node in dbNodes.values():
-      topology.addNode(node)
-    topology.save(os.path.join(settings.GRAPH_DIR, 'network_topology.png'), os.path.join(settings.GRAPH_DIR, 'network_topology.dot'))
+  stages = [
+    BackgroundStage('ping', timer, ping_nodes, (node_ips, collector),
+                    on_failure = lambda: collector.fail('ping')),
+    BackgroundStage('fetch', timer, fetch_nodes, (fetch_ips, list(package_ips), collector),
+                    on_failure = lambda: (collector.fail('info'), collector.fail('packages')))
+  ]
+  for stage in stages:
+    stage.start()
+  
+  return collector, stages
+
+def lock_polled_nodes(node_args):
+  """
+  Locks nodes that are about to be processed in a single transaction.
+  Nodes are locked in primary key order, just like routing table
+  synchronization locks them, so processing can not deadlock with a
+  synchronization running in another monitor instance.
+  
+  @param node_args: A list of process_node argument tuples
+  """
+  list(Node.objects.filter(ip__in = [args[0] for args in node_args]).order_by('pk').select_for_update().values_list('pk', flat = True))
 
-  # Ping the nodes to prepare information for later node processing
-  varsize_results = {}
-  results, dupes = wifi_utils.ping_hosts(10, nodesToPing)
-  for packet_size in (100, 500, 1000, 1480):
-    r, d = wifi_utils.ping_hosts(10, nodesToPing, packet_size - 8)
-    for node_ip in nodesToPing:
-      varsize_results.setdefault(node_ip, []).append(r[node_ip][3] if node_ip in r else None)
+def process_polled_nodes(collector, stages, timer, events):
+  """
+  Processes polled nodes as soon as their data arrives. Check results and
+  warnings of each processed node are kept for following cycles and the
+  node is rescheduled. Must be called inside a transaction.
+  
+  @param collector: NodeCollector instance of the polled nodes
+  @param stages: A list of BackgroundStage instances that poll the nodes
+  @param timer: StageTimer instance
+  @param events: EventAggregator for generated events
+  @return: A dictionary mapping primary keys of updated graph items to
+    node IP addresses
+  """
+  timer.start('processing')
+  graph_ids = {}
+  rss = {}
+  
+  def completed(node_warnings, node_events, node_graphs, report_state, stats, package_digest):
+    events.merge(node_events)
+    if report_state is not None:
+      graph_ids.update([(graph_id, report_state[0]) for graph_id in node_graphs])
+      REPORT_STATES[report_state[0]] = report_state[1]
+      NODE_WARNINGS[report_state[0]] = node_warnings
+      if package_digest is not None:
+        PACKAGE_DIGESTS[report_state[0]] = package_digest
+      SCHEDULER.completed(report_state[0], stats['status'], time.time())
+    if stats is not None:
+      record_node_stats(stats, rss)
   
   if getattr(settings, 'MONITOR_DISABLE_MULTIPROCESSING', None):
     # Multiprocessing is disabled (the MONITOR_DISABLE_MULTIPROCESSING option is usually
-    # used for debug purpuses where a single process is prefered)
-    for node_ip in nodesToPing:
-      process_node(node_ip, results.get(node_ip), node_ip in dupes, nodes[node_ip].links, varsize_results.get(node_ip))
-    
-    # Commit the transaction here since we do everything in the same session
-    transaction.commit()
+    # used for debug purpuses where a single process is prefered), each node is
+    # committed separately so at most one node is locked at a time
+    for node_ip, data in collector:
+      completed(*process_node(*get_process_node_args(node_ip, data)))
+      transaction.commit()
   else:
     # We MUST commit the current transaction here, because we will be processing
     # some transactions in parallel and must ensure that this transaction that has
     # modified the nodes is commited. Otherwise this will deadlock!
     transaction.commit()
     
-    worker_results = []
-    for node_ip in nodesToPing:
-      worker_results.append(
-        WORKER_POOL.apply_async(process_node, (node_ip, results.get(node_ip), node_ip in dupes, nodes[node_ip].links, varsize_results.get(node_ip)))
-      )
-    
-    # Wait for all workers to finish processing
+    # Dispatch nodes to workers in chunks as soon as their ping results and data
+    # arrive and collect results of completed chunks
     objects = {}
-    for result in worker_results:
-      try:
-        k, v = result.get()
-        objects[k] = v
-      except Exception, e:
-        logging.warning(format_exc())
+    node_args = (get_process_node_args(node_ip, data) for node_ip, data in collector)
+    for result in WORKER_POOL.imap_unordered(process_node, node_args, lock = lock_polled_nodes):
+      completed(*result)
+      stats = result[4]
+      if stats is not None and 'gc_objects' in stats:
+        objects[stats['pid']] = stats['gc_objects']
     
     # When GC debugging is enabled make some additional computations
     if getattr(settings, 'MONITOR_ENABLE_GC_DEBUG', None):
@@ -1053,8 +982,214 @@ def check_network_status():
       logging.debug("GC object count: %d %s" % (objcount, "!M" if objcount > _MAX_GC_OBJCOUNT else ""))
       _MAX_GC_OBJCOUNT = max(_MAX_GC_OBJCOUNT, objcount)
   
-  # Cleanup all out of date warnings
-  NodeWarning.clear_obsolete_warnings(EventSource.Monitor)
+  timer.stop('processing')
+  for stage in stages:
+    stage.join()
+  
+  # Only processes that are still alive are reported
+  METRICS.clear('nodewatcher_monitor_worker_rss_bytes')
+  for pid, value in rss.iteritems():
+    METRICS.set('nodewatcher_monitor_worker_rss_bytes', value, pid = pid)
+  
+  return graph_ids
+
+def forget_nodes(node_ips):
+  """
+  Forgets check results, warnings and applied package listings of nodes
+  that are no longer polled.
+  
+  @param node_ips: A list of node IP addresses
+  """
+  for node_ip in node_ips:
+    REPORT_STATES.pop(node_ip, None)
+    NODE_WARNINGS.pop(node_ip, None)
+    PACKAGE_DIGESTS.pop(node_ip, None)
+
+def store_results(timer, warnings, events, graph_ids, scope = None):
+  """
+  Writes warnings and events of a cycle and marks updated graphs.
+  
+  @param timer: StageTimer instance
+  @param warnings: WarningAccumulator with all warnings of this cycle
+  @param events: EventAggregator with all events of this cycle
+  @param graph_ids: A dictionary mapping primary keys of updated graph
+    items to node IP addresses
+  @param scope: Optional scope of stored warnings managed by this instance
+  """
+  # Write warnings raised during this cycle and cleanup all out of date ones
+  with timer.stage('store_warnings'):
+    warnings.apply(scope)
+  
+  # Store events generated during this cycle and queue notifications
+  with timer.stage('store_events'):
+    events.apply()
+  
+  # Mark all graphs updated during this cycle, nodes with graph items that
+  # have been removed meanwhile reload them in the next cycle
+  for graph_id in graphs.mark_updated(graph_ids.keys()):
+    invalidate_graphs(graph_ids[graph_id])
+
+@transaction.commit_on_success
+def check_network_status(timer = None, sync = True, poll_all = False, poll = True):
+  """
+  Performs the network status check. Routing tables are synchronized
+  with the database (when requested) and nodes that are due according to
+  the scheduler are polled. Pinging and fetching of node data is
+  performed in the background while database bookkeeping is being done
+  and nodes are processed as soon as their data is available.
+  
+  @param timer: Optional StageTimer instance for recording stage durations
+  @param sync: Should routing tables be synchronized
+  @param poll_all: Should all visible nodes be polled regardless of their
+    schedule
+  @param poll: Should nodes be polled (false for a coordinator of sharded
+    monitor instances, where nodes are polled by shards)
+  """
+  if timer is None:
+    timer = StageTimer()
+  
+  warnings = WarningAccumulator(EventSource.Monitor)
+  events = EventAggregator()
+  
+  if sync:
+    # Fetch routing tables from OLSR
+    try:
+      with timer.stage('olsr'):
+        nodes, hna = wifi_utils.get_tables(settings.MONITOR_OLSR_HOST)
+    except TypeError:
+      logging.error("Unable to fetch routing tables from '%s'!" % settings.MONITOR_OLSR_HOST)
+      return
+    
+    timer.start('sync')
+    
+    # Load the current network state and update visible nodes, link metrics are
+    # only written when they have changed since the previous cycle (nodes must be
+    # locked before any other rows, see NetworkState)
+    delta = TOPOLOGY_HISTORY.compute(nodes)
+    state = NetworkState(nodes, hna, warnings, events, delta)
+    state.load()
+    
+    # Remove out of date ap clients of nodes that are no longer reporting them (clients
+    # of reporting nodes are expired while they are being stored)
+    APClient.objects.filter(last_update__lt = datetime.now() - CLIENT_EXPIRY).delete()
+    dbNodes, nodesToPing = state.sync_nodes()
+    
+    # Forget state of nodes that are no longer visible
+    if poll:
+      forget_nodes(SCHEDULER.update(nodesToPing, time.time()))
+  
+  # Start pinging nodes that are due and fetching their data in the background while
+  # the rest of the database bookkeeping is being done
+  if poll:
+    if poll_all:
+      node_ips = SCHEDULER.all(time.time())
+    else:
+      node_ips = SCHEDULER.due(time.time())
+    
+    collector, stages = start_polling(node_ips, timer)
+  
+  scope = None
+  if sync:
+    # Nodes that are not polled in this cycle keep their warnings
+    if poll:
+      warned = set([dbNodes[node_ip].pk for node_ip, items in NODE_WARNINGS.iteritems() if items and node_ip in dbNodes])
+    else:
+      # Warnings of polled nodes are managed by shards, all other warnings by the coordinator
+      polled = set([dbNodes[node_ip].pk for node_ip in nodesToPing])
+      scope = lambda w: w.code in SYNC_WARNING_CODES or w.node_id not in polled
+      warned = polled.intersection(NodeWarning.objects.exclude(code__in = SYNC_WARNING_CODES).values_list('node', flat = True))
+    
+    for node in dbNodes.values():
+      if node.pk in warned:
+        node.warnings = True
+    
+    # Update peerings, subnets and node states and write all changes
+    state.sync_topology()
+    # Link metrics are graphed as reported by the routing daemon (stored links are only
+    # updated when their metrics change significantly)
+    with timer.stage('link_metrics'):
+      update_link_metrics(topology_links(nodes, dict([(node_ip, (n.pk, str(n))) for node_ip, n in dbNodes.iteritems()])))
+    SYNC_WARNINGS[:] = warnings.items()
+    
+    # Commit updates to release any pending locks
+    transaction.commit()
+    TOPOLOGY_HISTORY.accept(delta)
+    timer.stop('sync')
+    
+    # Add nodes to topology map and generate output
+    if not getattr(settings, 'MONITOR_DISABLE_GRAPHS', None):
+      # Only generate topology when graphing is not disabled
+      with timer.stage('topology'):
+        topology = DotTopologyPlotter()
+        links = state.get_incoming_links()
+        for node in sorted(dbNodes.values(), key = lambda node: node.ip):
+          topology.addNode(node, links.get(node.pk, []))
+        
+        TOPOLOGY_RENDERER.submit(topology, os.path.join(settings.GRAPH_DIR, 'network_topology.png'), os.path.join(settings.GRAPH_DIR, 'network_topology.dot'))
+  else:
+    warnings.merge(SYNC_WARNINGS)
+  
+  graph_ids = {}
+  if poll:
+    graph_ids = process_polled_nodes(collector, stages, timer, events)
+    
+    # Warnings of nodes that have not been polled in this cycle are carried forward
+    for items in NODE_WARNINGS.itervalues():
+      warnings.merge(items)
+  
+  store_results(timer, warnings, events, graph_ids, scope)
+
+@transaction.commit_on_success
+def check_shard_status(timer, membership):
+  """
+  Polls nodes owned by this monitor instance in sharded mode. Visible
+  nodes (as determined by the coordinator) are distributed between live
+  instances by consistent hashing of node UUIDs, so nodes are rebalanced
+  when instances join or leave.
+  
+  @param timer: StageTimer instance
+  @param membership: ShardMembership instance
+  """
+  with timer.stage('membership'):
+    members, changed = membership.heartbeat()
+    if changed:
+      logging.info("Monitor instances changed, now %d live: %s" % (len(members), ", ".join(members)))
+    
+    ring = HashRing(members)
+    owned = {}
+    peers = {}
+    for node in Node.objects.filter(visible = True).only('ip', 'name', 'status'):
+      peers[node.ip] = (node.pk, str(node))
+      if node.status not in (NodeStatus.Invalid, NodeStatus.AwaitingRenumber) and ring.owner(node.pk) == membership.name:
+        owned[node.ip] = node.pk
+    
+    forget_nodes(SCHEDULER.update(owned.keys(), time.time()))
+  
+  # Links are synchronized by the coordinator, but link metrics are graphed as reported
+  # by the routing daemon, so routing tables are fetched whenever nodes are polled
+  node_ips = SCHEDULER.due(time.time())
+  if node_ips:
+    try:
+      with timer.stage('olsr'):
+        nodes, hna = wifi_utils.get_tables(settings.MONITOR_OLSR_HOST)
+    except TypeError:
+      logging.error("Unable to fetch routing tables from '%s'!" % settings.MONITOR_OLSR_HOST)
+      nodes = {}
+    
+    with timer.stage('link_metrics'):
+      update_link_metrics(topology_links(nodes, peers))
+  
+  collector, stages = start_polling(node_ips, timer)
+  events = EventAggregator()
+  graph_ids = process_polled_nodes(collector, stages, timer, events)
+  
+  # Only warnings of nodes that have been polled by this instance are managed here
+  warnings = WarningAccumulator(EventSource.Monitor)
+  for items in NODE_WARNINGS.itervalues():
+    warnings.merge(items)
+  
+  polled = set([owned[node_ip] for node_ip in NODE_WARNINGS if node_ip in owned])
+  store_results(timer, warnings, events, graph_ids, lambda w: w.node_id in polled and w.code not in SYNC_WARNING_CODES)
 
 if __name__ == '__main__':
   # Configure logger
@@ -1143,7 +1278,7 @@ if __name__ == '__main__':
     # Check network status in a tight loop
     try:
       for i in xrange(1000):
-        check_network_status()
+        check_network_status(poll_all = True)
         check_dead_graphs()
         check_events()
         
@@ -1177,31 +1312,191 @@ if __name__ == '__main__':
   if getattr(settings, 'MONITOR_ENABLE_GC_DEBUG', None):
     logging.warning("Garbage collection debugging enabled.")
   
-  # Create worker pool and start processing
+  if getattr(settings, 'MONITOR_PUSH_UDP_ADDRESS', None) and not options.coordinator:
+    logging.warning("Reports pushed over UDP are not authenticated, they can be spoofed by anyone!")
+  
+  if not NUMPY_ENABLED:
+    logging.info("NumPy is not available, link metrics are computed without it.")
+  
+  # Create worker pool and start processing (a coordinator does not poll nodes)
   logging.info("nodewatcher network monitoring system is initializing...")
-  WORKER_POOL = multiprocessing.Pool(processes = settings.MONITOR_WORKERS)
+  if not options.coordinator:
+    WORKER_POOL = WorkerPool(
+      processes = settings.MONITOR_WORKERS,
+      chunk_size = getattr(settings, 'MONITOR_WORKER_CHUNK', 10),
+      max_tasks = getattr(settings, 'MONITOR_WORKER_MAX_TASKS', None)
+    )
+  
+  # Check if we should just benchmark monitor cycles
+  if options.benchmark:
+    from simulator import use_mesh
+    from simulator.mesh import SyntheticMesh
+    from simulator.registration import register_nodes
+    from lib.benchmark import Benchmark
+    
+    print ">>> Generating a synthetic mesh of %d nodes..." % options.benchmark_nodes
+    mesh = SyntheticMesh(options.benchmark_nodes, seed = options.benchmark_seed, churn = options.benchmark_churn)
+    use_mesh(mesh)
+    TOPOLOGY_RENDERER.start()
+    
+    benchmark = Benchmark(METRICS, {
+      'nodes' : options.benchmark_nodes,
+      'seed' : options.benchmark_seed,
+      'churn' : options.benchmark_churn,
+      'workers' : 1 if getattr(settings, 'MONITOR_DISABLE_MULTIPROCESSING', None) else settings.MONITOR_WORKERS,
+    })
+    
+    try:
+      for i in xrange(options.benchmark_cycles):
+        if i > 0:
+          mesh.step()
+        
+        register_nodes(mesh)
+        
+        def cycle(timer):
+          check_network_status(timer, poll_all = True)
+          with timer.stage('dead_graphs'):
+            check_dead_graphs()
+          with timer.stage('events'):
+            check_events()
+        
+        print "  > Cycle %d: %s" % (i + 1, benchmark.format_cycle(benchmark.run(cycle)))
+    except KeyboardInterrupt:
+      print "!!! Aborted by user."
+      WORKER_POOL.terminate()
+      exit(1)
+    
+    WORKER_POOL.terminate()
+    print ">>> Benchmark completed."
+    for key, value in sorted(benchmark.summary().items()):
+      print "  > %s: %s" % (key, value)
+    
+    if options.benchmark_baseline:
+      print ">>> Comparison with baseline:"
+      for line in benchmark.compare(options.benchmark_baseline):
+        print "  > %s" % line
+    
+    if options.benchmark_output:
+      benchmark.save(options.benchmark_output)
+    
+    exit(0)
+  
+  # Serve monitor metrics when configured
+  if METRICS_ADDRESS:
+    MetricsServer(METRICS, METRICS_ADDRESS).start()
+    logging.info("Serving monitor metrics on %s:%s." % METRICS_ADDRESS)
+  
+  # Receive reports pushed by nodes when configured (a coordinator does not poll nodes)
+  if not options.coordinator:
+    def pushed(transport, accepted):
+      METRICS.inc('nodewatcher_monitor_pushed_reports_total', transport = transport, result = 'accepted' if accepted else 'rejected')
+    
+    for receiver, name in ((HTTPPushReceiver, 'MONITOR_PUSH_HTTP_ADDRESS'), (UDPPushReceiver, 'MONITOR_PUSH_UDP_ADDRESS')):
+      address = getattr(settings, name, None)
+      if address:
+        receiver(PUSH_BUFFER, address, callback = pushed).start()
+        logging.info("Receiving pushed node reports on %s:%s (%s)." % (address[0], address[1], receiver.__name__))
+  
+  tick = getattr(settings, 'MONITOR_SCHEDULER_TICK', 30)
+  
+  # Check if we should only poll nodes owned by this instance, routing tables are
+  # synchronized and network-wide checks are performed by the coordinator
+  if options.shard:
+    logging.info("Polling nodes as monitor instance '%s'." % options.shard)
+    membership = ShardMembership(options.shard, timeout = getattr(settings, 'MONITOR_INSTANCE_TIMEOUT', 90))
+    
+    # Stopping a shard (init scripts send SIGTERM) is handled like an interrupt
+    from signal import signal as set_signal_handler, SIGTERM
+    def terminate(signum, frame):
+      raise KeyboardInterrupt
+    set_signal_handler(SIGTERM, terminate)
+    
+    try:
+      while True:
+        ts_start = time.time()
+        timer = StageTimer()
+        try:
+          check_shard_status(timer, membership)
+        except KeyboardInterrupt:
+          raise
+        except:
+          logging.warning(format_exc())
+        
+        # Export durations of this cycle
+        ts_delta = time.time() - ts_start
+        METRICS.inc('nodewatcher_monitor_cycles_total')
+        METRICS.set('nodewatcher_monitor_cycle_seconds', ts_delta)
+        METRICS.clear('nodewatcher_monitor_stage_seconds')
+        for name, duration in timer.durations.iteritems():
+          METRICS.set('nodewatcher_monitor_stage_seconds', duration, stage = name)
+        
+        sleep(max(0, tick - ts_delta))
+    except:
+      # Leave immediately, so remaining instances take over our nodes
+      logging.warning("Terminating workers...")
+      WORKER_POOL.terminate()
+      membership.leave()
+    
+    exit(0)
+  
+  if options.coordinator:
+    logging.info("Running as a coordinator, nodes are polled by shards.")
+  
+  # Start sending event notifications in the background
+  outbox = OutboxSender(interval = getattr(settings, 'MONITOR_OUTBOX_INTERVAL', 60))
+  outbox.start()
+  
+  # Render network topology in the background
+  TOPOLOGY_RENDERER.start()
+  
+  # Routing tables and global statistics are synchronized every poll interval while
+  # nodes that are due are polled every tick (a coordinator only synchronizes)
+  if options.coordinator:
+    tick = settings.MONITOR_POLL_INTERVAL
+  next_sync = time.time()
+  
   try:
     while True:
       # Perform all processing
       ts_start = time.time()
+      timer = StageTimer()
+      sync = ts_start >= next_sync
+      if sync:
+        next_sync = max(next_sync + settings.MONITOR_POLL_INTERVAL, ts_start + tick)
+      
       try:
-        check_network_status()
-        check_dead_graphs()
-        check_global_statistics()
-        check_events()
+        check_network_status(timer, sync = sync, poll = not options.coordinator)
+        if sync:
+          with timer.stage('dead_graphs'):
+            check_dead_graphs()
+          with timer.stage('statistics'):
+            check_global_statistics()
+        
+        with timer.stage('events'):
+          check_events()
+        
+        # Send notifications for events generated during this cycle
+        outbox.wake()
       except KeyboardInterrupt:
         raise
       except:
         logging.warning(format_exc())
       
-      # Go to sleep for a while
+      # Export durations of this cycle
       ts_delta = time.time() - ts_start
+      METRICS.inc('nodewatcher_monitor_cycles_total')
+      METRICS.set('nodewatcher_monitor_cycle_seconds', ts_delta)
+      METRICS.clear('nodewatcher_monitor_stage_seconds')
+      for name, duration in timer.durations.iteritems():
+        METRICS.set('nodewatcher_monitor_stage_seconds', duration, stage = name)
+      
+      # Go to sleep until the next tick (or synchronization when it comes first)
       if ts_delta > settings.MONITOR_POLL_INTERVAL // 2:
-        logging.warning("Processing took more than half of monitor poll interval ({0} sec)!".format(round(ts_delta, 2)))
-        ts_delta = settings.MONITOR_POLL_INTERVAL // 2
+        logging.warning("Processing took more than half of monitor poll interval ({0} sec)! Slowest stages: {1}".format(round(ts_delta, 2), timer.format_slowest()))
       
-      sleep(settings.MONITOR_POLL_INTERVAL - ts_delta)
+      sleep(max(0, min(tick - ts_delta, next_sync - time.time())))
   except:
-    logging.warning("Terminating workers...")
-    WORKER_POOL.terminate()
+    if WORKER_POOL is not None:
+      logging.warning("Terminating workers...")
+      WORKER_POOL.terminate()
 
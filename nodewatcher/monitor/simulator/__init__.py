@@ -0,0 +1,26 @@
+# Synthetic mesh that replaces captured simulation data when set
+MESH = None
+
+# Captured simulation data that has already been loaded
+CAPTURES = {}
+
+def use_mesh(mesh):
+  """
+  Makes simulated feeds generate data from a synthetic mesh instead of
+  replaying captured data.
+
+  @param mesh: SyntheticMesh instance
+  """
+  global MESH
+  MESH = mesh
+
+def load_capture(name):
+  """
+  Returns captured simulation data. Captures are only read once.
+
+  @param name: Name of the capture file
+  """
+  if name not in CAPTURES:
+    CAPTURES[name] = open("simulator/data/%s" % name).read()
+  
+  return CAPTURES[name]
@@ -0,0 +1,368 @@
+import math
+import random
+import time
+
+# Radius (in arbitrary units) within which nodes can form links
+LINK_RADIUS = 1.0
+
+# Interval between simulated monitor cycles
+CYCLE_INTERVAL = 300
+
+# Packages present on every simulated node
+BASE_PACKAGES = [
+  ('base-files', '43'), ('busybox', '1.15.3-2'), ('dnsmasq', '2.52-1'), ('dropbear', '0.52-4'),
+  ('iptables', '1.4.6-1'), ('kmod-tun', '2.6.32.10-1'), ('libc', '0.9.30.1-42'), ('olsrd', '0.5.6-r8-1'),
+  ('olsrd-mod-txtinfo', '0.5.6-r8-1'), ('openvpn', '2.1.1-2'), ('wireless-tools', '29-3'),
+]
+
+# Optional packages installed on some simulated nodes
+OPTIONAL_PACKAGES = [
+  ('nodogsplash', '0.9_beta9.9.5-1'), ('ntpclient', '2007_365-4'), ('solar', '0.1-1'), ('digitemp', '3.6.0-1'),
+  ('kmod-usb-serial', '2.6.32.10-1'), ('tcpdump', '4.0.0-1'),
+]
+
+# Firmware versions nodes are upgraded through
+FIRMWARE_VERSIONS = ['v2.0b', 'v2.0c', 'v2.0d', 'v2.1', 'v2.1a']
+
+class SyntheticNode(object):
+  """
+  State of a single simulated node.
+  """
+  __slots__ = (
+    'index', 'ip', 'subnet', 'x', 'y', 'up', 'registered', 'boot_time', 'hops',
+    'loss', 'version', 'clients', 'traffic', 'features', 'packages', 'errors'
+  )
+
+class SyntheticMesh(object):
+  """
+  A parametric mesh network used instead of a captured one. Nodes are
+  placed in clusters on a plane and linked with their nearest neighbours,
+  so the topology has realistic degrees and path lengths. Each node
+  announces a client subnet, answers pings with node specific latency
+  and loss and produces a nodewatcher report with a random subset of
+  optional sections. Calling step() advances the mesh by one monitor
+  cycle and applies churn: nodes go down and come back, reboot, get
+  upgraded, link qualities drift and new nodes appear.
+  """
+  def __init__(self, size, seed = 0, churn = 0.02, degree = 6, registered = 0.95):
+    """
+    Class constructor.
+
+    @param size: Number of nodes
+    @param seed: Random seed, equal seeds produce equal meshes
+    @param churn: Probability that a node changes its state in a cycle
+    @param degree: Maximum number of links per node
+    @param registered: Fraction of nodes that are registered
+    """
+    self.seed = seed
+    self.random = random.Random(seed)
+    self.churn = churn
+    self.degree = degree
+    self.registered = registered
+    self.timestamp = int(time.time())
+    self.nodes = []
+    self.links = {}
+    self.grid = {}
+
+    # Nodes form clusters of about 50 nodes with an average density that
+    # gives each node a few neighbours in range
+    self.side = math.sqrt(size / 1.6)
+    self.clusters = [
+      (self.random.uniform(0, self.side), self.random.uniform(0, self.side))
+      for i in xrange(max(1, size // 50))
+    ]
+
+    for i in xrange(size):
+      self.add_node()
+
+  def add_node(self):
+    """
+    Adds a new node to the mesh and links it with its neighbours.
+
+    @return: SyntheticNode instance
+    """
+    r = self.random
+    node = SyntheticNode()
+    node.index = i = len(self.nodes)
+    node.ip = '10.254.%d.%d' % (i // 250, i % 250 + 1)
+    node.subnet = '10.%d.%d.%d/27' % (16 + i // 2048, (i // 8) % 256, (i % 8) * 32)
+
+    cx, cy = r.choice(self.clusters)
+    spread = math.sqrt(50 / 1.6) / 2
+    node.x = min(max(r.gauss(cx, spread), 0), self.side)
+    node.y = min(max(r.gauss(cy, spread), 0), self.side)
+    node.hops = 1 + int(math.hypot(node.x, node.y) / LINK_RADIUS)
+
+    node.up = True
+    node.registered = r.random() < self.registered
+    node.boot_time = self.timestamp - r.randint(60, 30 * 86400)
+    node.loss = r.choice([0, 0, 0, 0, 0, 1, 2, 5, 10, 30])
+    node.version = r.choice(FIRMWARE_VERSIONS)
+    node.clients = 0
+    node.traffic = {}
+    node.errors = 0
+    node.features = set([feature for feature, probability in (
+      ('vpn', 0.3), ('nds', 0.2), ('dhcp', 0.4), ('solar', 0.02), ('environment', 0.03),
+      ('voltage', 0.01), ('dns', 0.9), ('wifi_signal', 0.8)
+    ) if r.random() < probability])
+
+    node.packages = dict(BASE_PACKAGES)
+    for name, version in OPTIONAL_PACKAGES:
+      if r.random() < 0.3:
+        node.packages[name] = version
+
+    for iface in ['eth0', 'wifi0', 'ath0'] + (['tap0'] if 'vpn' in node.features else []):
+      node.traffic[iface] = [r.randint(0, 10 ** 9), r.randint(0, 10 ** 9)]
+
+    self.nodes.append(node)
+    self.__link(node)
+    return node
+
+  def __link(self, node):
+    """
+    Links a node with its nearest neighbours within link radius.
+    """
+    cell = (int(node.x // LINK_RADIUS), int(node.y // LINK_RADIUS))
+    candidates = []
+    for dx in (-1, 0, 1):
+      for dy in (-1, 0, 1):
+        for other in self.grid.get((cell[0] + dx, cell[1] + dy), []):
+          distance = math.hypot(node.x - other.x, node.y - other.y)
+          if distance <= LINK_RADIUS:
+            candidates.append((distance, other))
+
+    self.grid.setdefault(cell, []).append(node)
+
+    candidates.sort(key = lambda x: x[0])
+    for distance, other in candidates[:self.degree]:
+      quality = max(0.1, 1.0 - 0.8 * distance / LINK_RADIUS)
+      self.links[node.index, other.index] = self.__quality(quality)
+      self.links[other.index, node.index] = self.__quality(quality)
+
+  def __random(self, *key):
+    """
+    Returns a random generator for generating simulated feeds. Feeds are
+    generated concurrently, so each one gets a generator seeded by its
+    key, which keeps output reproducible.
+    """
+    return random.Random(repr((self.seed, self.timestamp) + key))
+
+  def __quality(self, quality):
+    return min(1.0, max(0.05, quality + self.random.gauss(0, 0.05)))
+
+  def step(self):
+    """
+    Advances the mesh by one monitor cycle.
+    """
+    r = self.random
+    self.timestamp += CYCLE_INTERVAL
+
+    for node in self.nodes:
+      if node.up:
+        if r.random() < self.churn:
+          node.up = False
+          continue
+
+        if r.random() < self.churn / 4:
+          node.boot_time = self.timestamp - r.randint(10, CYCLE_INTERVAL)
+        if r.random() < self.churn / 10:
+          node.version = FIRMWARE_VERSIONS[min(FIRMWARE_VERSIONS.index(node.version) + 1, len(FIRMWARE_VERSIONS) - 1)]
+        if r.random() < self.churn / 10:
+          name = r.choice(node.packages.keys())
+          node.packages[name] = node.packages[name] + '.1'
+        if r.random() < self.churn:
+          node.errors += r.randint(1, 5)
+      elif r.random() < 0.3:
+        # Nodes that come back have been rebooted
+        node.up = True
+        node.boot_time = self.timestamp - r.randint(10, CYCLE_INTERVAL)
+
+      node.clients = max(0, node.clients + r.randint(-2, 2)) if 'nds' in node.features or 'dhcp' in node.features else 0
+      for counters in node.traffic.values():
+        counters[0] += r.randint(0, 10 ** 7)
+        counters[1] += r.randint(0, 10 ** 8)
+
+    # Most links only fluctuate slightly, some change considerably
+    for key, quality in self.links.iteritems():
+      if r.random() < self.churn:
+        self.links[key] = self.__quality(r.uniform(0.1, 1.0))
+      else:
+        self.links[key] = min(1.0, max(0.05, quality + r.gauss(0, 0.01)))
+
+    for i in xrange(int(len(self.nodes) * self.churn / 10)):
+      self.add_node()
+
+  def get_node(self, ip):
+    """
+    Returns a simulated node by its IP address.
+
+    @param ip: Node's IP address
+    @return: SyntheticNode instance or None when no such node exists
+    """
+    try:
+      a, b, c, d = [int(x) for x in ip.split('.')]
+    except ValueError:
+      return None
+
+    if (a, b) != (10, 254) or not 1 <= d <= 250:
+      return None
+
+    index = c * 250 + d - 1
+    return self.nodes[index] if index < len(self.nodes) else None
+
+  def tables(self):
+    """
+    Returns routing tables of the mesh in OLSR txtinfo format.
+    """
+    out = ['HTTP/1.0 200 OK', 'Content-type: text/plain', '', 'Table: Links', 'Local IP\tRemote IP\tHyst.\tLQ\tNLQ\tCost', '']
+    out.append('Table: Topology')
+    out.append('Dest. IP\tLast hop IP\tLQ\tNLQ\tCost\tVTime')
+    nodes = self.nodes
+    for (src, dst), lq in self.links.iteritems():
+      if not nodes[src].up or not nodes[dst].up:
+        continue
+
+      ilq = self.links[dst, src]
+      out.append('%s\t%s\t%.3f\t%.3f\t%.3f\t%.1f' % (nodes[dst].ip, nodes[src].ip, lq, ilq, 1.0 / (lq * ilq), 30.0))
+
+    out.append('')
+    out.append('Table: HNA')
+    out.append('Destination\tGateway')
+    for node in nodes:
+      if node.up:
+        out.append('%s\t%s' % (node.subnet, node.ip))
+        if node.index % 200 == 0:
+          # Border routers announce the default route
+          out.append('0.0.0.0/0\t%s' % node.ip)
+
+    out.append('')
+    out.append('Table: MID')
+    out.append('IP address\tAliases')
+    out.append('')
+    return '\n'.join(out) + '\n'
+
+  def fping(self, hosts, packet_size):
+    """
+    Returns simulated fping output for the given hosts.
+
+    @param hosts: A list of host IP addresses
+    @param packet_size: ICMP payload size
+    """
+    r = self.__random(packet_size, *hosts[:1])
+    out = []
+    for ip in hosts:
+      node = self.get_node(ip)
+      if node is None or not node.up:
+        out.append('%s : xmt/rcv/%%loss = 10/0/100%%' % ip)
+        continue
+
+      loss = min(100, node.loss + packet_size * node.loss // 1480)
+      received = 10 - (10 * loss + r.randint(0, 99)) // 100
+      if not received:
+        out.append('%s : xmt/rcv/%%loss = 10/0/100%%' % ip)
+        continue
+
+      rtt = 1.5 * node.hops + packet_size / 500.0
+      out.append('%s : xmt/rcv/%%loss = 10/%d/%d%%, min/avg/max = %.2f/%.2f/%.2f' % (
+        ip, received, 10 * (10 - received), rtt * 0.8, rtt * r.uniform(1.0, 1.3), rtt * r.uniform(1.5, 4.0)
+      ))
+
+    return '\n'.join(out) + '\n'
+
+  def report(self, ip):
+    """
+    Returns a simulated nodewatcher report of a node.
+
+    @param ip: Node's IP address
+    @return: Report text or None when the node is unreachable
+    """
+    node = self.get_node(ip)
+    if node is None or not node.up:
+      return None
+
+    r = self.__random(ip)
+    uptime = self.timestamp - node.boot_time
+    out = [
+      ';',
+      '; nodewatcher monitoring system',
+      ';',
+      'general.version: %s' % node.version,
+      'general.local_time: %d' % self.timestamp,
+      'general.uptime: %d.00 %d.00' % (uptime, uptime * 0.9),
+      'general.loadavg: %.2f %.2f %.2f 1/%d %d' % (r.uniform(0, 1), r.uniform(0, 0.8), r.uniform(0, 0.5), r.randint(35, 60), r.randint(1000, 30000)),
+      'general.memfree: %d' % r.randint(2000, 8000),
+      'general.buffers: %d' % r.randint(500, 2000),
+      'general.cached: %d' % r.randint(1000, 4000),
+      'wifi.bssid: 02:CA:FF:EE:BA:BE',
+      'wifi.essid: open.wlan-si.net',
+      'wifi.frequency: 2.437',
+      'wifi.mac: 00:15:6d:%02x:%02x:%02x' % (node.index >> 16 & 0xff, node.index >> 8 & 0xff, node.index & 0xff),
+      'wifi.rts: 2347',
+      'wifi.frag: 2347',
+      'wifi.cells: %d' % r.randint(0, 20),
+      'wifi.errors: %d' % node.errors,
+      'net.losses: 0',
+    ]
+
+    if 'wifi_signal' in node.features:
+      out.append('wifi.signal: %d' % r.randint(-90, -50))
+      out.append('wifi.noise: -95')
+      out.append('wifi.bitrate: %d' % r.choice([11, 24, 36, 48, 54]))
+
+    if 'vpn' in node.features:
+      out.append('net.vpn.mac: 00:ff:%02x:%02x:%02x:%02x' % (node.index >> 24 & 0xff, node.index >> 16 & 0xff, node.index >> 8 & 0xff, node.index & 0xff))
+      out.append('net.vpn.upload_limit: 512Kbit')
+
+    if 'dns' in node.features:
+      out.append('dns.local: 0')
+      out.append('dns.remote: 0')
+
+    for iface, (up, down) in sorted(node.traffic.items()):
+      out.append('iface.%s.up: %d' % (iface, up))
+      out.append('iface.%s.down: %d' % (iface, down))
+
+    network = node.subnet.split('/')[0].rsplit('.', 1)
+    clients = ['%s.%d' % (network[0], int(network[1]) + 2 + i) for i in xrange(min(node.clients, 28))]
+    if 'nds' in node.features:
+      out.append('nds.down: 0')
+      for i, client in enumerate(clients):
+        out.append('nds.client%d.ip: %s' % (i, client))
+        out.append('nds.client%d.added_at: %d' % (i, self.timestamp - 600 * (i + 1)))
+        out.append('nds.client%d.up: %d' % (i, r.randint(0, 10 ** 6)))
+        out.append('nds.client%d.down: %d' % (i, r.randint(0, 10 ** 7)))
+
+    if 'dhcp' in node.features:
+      for i, client in enumerate(clients):
+        out.append('dhcp.client%d.ip: %s' % (i, client))
+
+    if 'solar' in node.features:
+      out.append('solar.batvoltage: %.2f' % r.uniform(11, 14))
+      out.append('solar.solvoltage: %.2f' % r.uniform(0, 20))
+      out.append('solar.charge: %.2f' % r.uniform(0, 5))
+      out.append('solar.state: %s' % r.choice(['boost', 'equalize', 'absorption', 'float']))
+      out.append('solar.load: %.2f' % r.uniform(0, 2))
+
+    if 'environment' in node.features:
+      out.append('environment.sensor0.serial: 10%012X' % node.index)
+      out.append('environment.sensor0.temp: %.1f' % r.uniform(-10, 40))
+
+    if 'voltage' in node.features:
+      out.append('voltage.serial: V%d' % node.index)
+      for x in '1234':
+        out.append('voltage.%s: %.2f' % (x, r.uniform(0, 5)))
+        out.append('voltage.%sm: 1' % x)
+
+    return '\n'.join(out) + '\n'
+
+  def package_listing(self, ip):
+    """
+    Returns a simulated installed package listing of a node.
+
+    @param ip: Node's IP address
+    @return: Listing text or None when the node is unreachable
+    """
+    node = self.get_node(ip)
+    if node is None or not node.up:
+      return None
+
+    return ''.join(['%s - %s -\n' % item for item in sorted(node.packages.items())])
@@ -1,5 +1,7 @@
 from lib import nodewatcher
+import hashlib
 import os
+import simulator
 
 # Load simulated output
 SIMULATED_NODEWATCHER_BASE = "simulator/data/nodes"
@@ -8,14 +10,36 @@ def parse_node_info(data):
   return nodewatcher.parse_node_info(data)
 
 def fetch_node_info(node_ip):
+  if simulator.MESH is not None:
+    data = simulator.MESH.report(node_ip)
+    return parse_node_info(data) if data is not None else None
+  
   try:
-    return parse_node_info(open(os.path.join(SIMULATED_NODEWATCHER_BASE, "%s.txt" % node_ip)).read())
+    return parse_node_info(open(os.path.join(SIMULATED_NODEWATCHER_BASE, "%s.txt" % node_ip)))
   except:
     return None
 
+def fetch_all(node_ips, package_ips = (), callback = None, concurrency = 50, timeout = 15, retries = 1, stats = None):
+  infos = dict([(ip, fetch_node_info(ip)) for ip in node_ips])
+  packages = dict([(ip, fetch_package_listing(ip)) for ip in package_ips])
+  if callback is not None:
+    for ip, info in infos.iteritems():
+      callback(ip, 'info', info)
+    for ip, listing in packages.iteritems():
+      callback(ip, 'packages', listing)
+  
+  if stats is not None:
+    stats['timeouts'] = 0
+  
+  return infos, packages
+
 def frequency_to_channel(frequency):
   return nodewatcher.frequency_to_channel(frequency)
 
-def fetch_installed_packages(node_ip):
-  return None
-
+def fetch_package_listing(node_ip):
+  if simulator.MESH is None:
+    return None
+  
+  data = simulator.MESH.package_listing(node_ip)
+  packages = nodewatcher.parse_installed_packages(data) if data is not None else None
+  return (hashlib.sha1(data).hexdigest(), packages) if packages is not None else None
@@ -0,0 +1,44 @@
+import uuid
+from datetime import datetime
+
+from frontend.nodes.models import Node, NodeStatus, NodeType, Subnet, SubnetStatus, IfaceType, project_default
+from frontend.nodes.bulk import chunked, bulk_insert, MAX_QUERY_PARAMS
+
+def register_nodes(mesh):
+  """
+  Registers nodes of a synthetic mesh (that are marked as registered) in
+  the database together with their client subnets, as if their owners
+  registered them. Nodes that already exist are left alone.
+
+  @param mesh: SyntheticMesh instance
+  @return: Number of newly registered nodes
+  """
+  candidates = [node for node in mesh.nodes if node.registered]
+  existing = set()
+  for chunk in chunked([node.ip for node in candidates], MAX_QUERY_PARAMS):
+    existing.update(Node.objects.filter(ip__in = chunk).values_list('ip', flat = True))
+  
+  now = datetime.now()
+  project = project_default()
+  nodes = []
+  subnets = []
+  for node in candidates:
+    if node.ip in existing:
+      continue
+    
+    n = Node(ip = node.ip, name = 'sim-%05d' % node.index, project = project, status = NodeStatus.New, node_type = NodeType.Wireless)
+    n.pk = str(uuid.uuid4())
+    n.visible = False
+    nodes.append(n)
+    
+    subnet, cidr = node.subnet.split('/')
+    s = Subnet(node = n, subnet = subnet, cidr = int(cidr), status = SubnetStatus.NotAnnounced, gen_iface_type = IfaceType.WiFi)
+    s.ip_subnet = node.subnet
+    s.allocated = True
+    s.allocated_at = now
+    s.visible = False
+    subnets.append(s)
+  
+  bulk_insert(Node, nodes)
+  bulk_insert(Subnet, subnets)
+  return len(nodes)
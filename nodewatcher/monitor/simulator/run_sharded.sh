@@ -0,0 +1,36 @@
+#!/bin/sh
+# Runs a sharded monitor on a development machine: a coordinator and two
+# shards (shard-a and shard-b) that share the database configured in the
+# given settings module (SQLite by default). Must be run from the monitor
+# directory:
+#
+#   simulator/run_sharded.sh [settings module]
+#
+# Set MONITOR_ENABLE_SIMULATION to True in the settings module when there is
+# no node with OLSR providing the data feed. All instances log to the same
+# MONITOR_LOGFILE. Press Ctrl+C to stop all instances; shards leave when they
+# are stopped, so the other shard takes over their nodes on its next cycle.
+
+SETTINGS=${1:-frontend.settings}
+PYTHON=${PYTHON:-python}
+PIDS=""
+
+start() {
+  $PYTHON monitor.py --path=.. --settings=$SETTINGS "$@" &
+  PIDS="$PIDS $!"
+  echo ">>> Started monitor instance $* (pid $!)."
+}
+
+stop() {
+  echo ">>> Stopping monitor instances..."
+  kill -TERM $PIDS 2>/dev/null
+  wait
+  exit 0
+}
+
+trap stop INT TERM
+
+start --coordinator
+start --shard=shard-a
+start --shard=shard-b
+wait
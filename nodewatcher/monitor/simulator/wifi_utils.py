@@ -1,18 +1,23 @@
 from lib import wifi_utils
-
-# Load simulated output
-SIMULATED_ROUTER = open("simulator/data/olsr.txt").read()
-SIMULATED_FPING = open("simulator/data/fping.txt").read()
+import simulator
 
 def parse_tables(data):
   return wifi_utils.parse_tables(data)
 
 def get_tables(olsr_ip = None):
-  return parse_tables(SIMULATED_ROUTER)
+  if simulator.MESH is not None:
+    return parse_tables(simulator.MESH.tables())
+  
+  return parse_tables(simulator.load_capture("olsr.txt"))
 
 def parse_fping(data):
   return wifi_utils.parse_fping(data)
 
 def ping_hosts(count, hosts, packet_size = 56):
-  return parse_fping(SIMULATED_FPING)
+  if simulator.MESH is not None:
+    return parse_fping(simulator.MESH.fping(hosts, packet_size))
+  
+  return parse_fping(simulator.load_capture("fping.txt"))
 
+def probe_hosts(count, hosts, packet_sizes, rate = None, durations = None):
+  return dict([(packet_size, ping_hosts(count, hosts, packet_size)) for packet_size in packet_sizes])